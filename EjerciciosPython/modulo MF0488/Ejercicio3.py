@@ -1,8 +1,21 @@
 """Analizador de hashes de archivos para detección de malware conocido."""
 
-import hashlib
+import sys
 from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Iterable, Optional
+
+# El motor de hashes compartido vive en la raíz del proyecto
+RAIZ_PROYECTO = Path(__file__).resolve().parents[2]
+if str(RAIZ_PROYECTO) not in sys.path:
+    sys.path.insert(0, str(RAIZ_PROYECTO))
+
+from archivos_comprimidos import analizar_archivo_comprimido, es_archivo_comprimido
+from barrido import barrido_malware_core, formatear_resumen
+from base_firmas import DIRECTORIO_FIRMAS, abrir_firmas, importar_csv_core
+from cache_hashes import cache_por_defecto, calcular_hashes_cacheado
+from hash_similitud import (ALGORITMO_SIMILITUD, MAX_BYTES_SIMILITUD, RUTA_INDICE_SIMILITUD, HashSimilitud,
+                            IndiceSimilitud, abrir_indice_similitud, importar_csv_similitud)
+from motor_hash import calcular_hashes, formatear_rendimiento
 
 
 # Base de datos simple de hashes maliciosos conocidos (ejemplos educativos)
@@ -11,29 +24,73 @@ HASHES_MALICIOSOS = {
     "275a021bbfb6489e54d471899f7db9d1663fc695ec2fe2a2c4538aabf651fd0f": "Ejemplo de malware",
 }
 
+_firmas = None
+_indice_similitud = None
 
-def calcular_hash_md5(ruta_archivo: Path) -> Optional[str]:
-    """Calcula el hash MD5 de un archivo.
+
+def obtener_firmas() -> Any:
+    """Devuelve la base de firmas en disco (si existe) junto con HASHES_MALICIOSOS.
+    
+    La base se abre una sola vez y se consulta mediante mmap, sin cargar
+    los hashes en memoria.
+    """
+    
+    global _firmas
+    if _firmas is None:
+        _firmas = abrir_firmas(DIRECTORIO_FIRMAS, extra=HASHES_MALICIOSOS)
+    return _firmas
+
+
+def obtener_indice_similitud() -> Optional[IndiceSimilitud]:
+    """Devuelve el índice de firmas ssdeep, o None si todavía no hay corpus."""
+    
+    global _indice_similitud
+    if _indice_similitud is None:
+        _indice_similitud = abrir_indice_similitud(RUTA_INDICE_SIMILITUD)
+    return _indice_similitud
+
+
+def calcular_hashes_archivo(ruta_archivo: Path, algoritmos: Iterable[str] = ("md5", "sha256"), usar_cache: bool = True, similitud: bool = False) -> Optional[Dict[str, Any]]:
+    """Calcula varios hashes de un archivo leyéndolo una sola vez.
     
     Args:
         ruta_archivo: Ruta al archivo a analizar.
+        algoritmos: Algoritmos a calcular (md5, sha1, sha256, blake2b, blake2s).
+        usar_cache: Reutilizar los hashes guardados si el archivo no ha cambiado.
+        similitud: Calcular también la firma ssdeep en la misma lectura.
         
     Returns:
-        Hash MD5 en formato hexadecimal, o None si hay error.
+        Diccionario con los hashes, bytes leídos y velocidad (MB/s), o None si hay error.
     """
     
     try:
-        md5_hash = hashlib.md5()
-        with open(ruta_archivo, "rb") as f:
-            # Leer el archivo en bloques para archivos grandes
-            for bloque in iter(lambda: f.read(4096), b""):
-                md5_hash.update(bloque)
-        return md5_hash.hexdigest()
+        if usar_cache:
+            return calcular_hashes_cacheado(ruta_archivo, tuple(algoritmos), similitud=similitud)
+        if not similitud:
+            return calcular_hashes(ruta_archivo, tuple(algoritmos))
+        observador = HashSimilitud()
+        resultado = calcular_hashes(ruta_archivo, tuple(algoritmos), observadores=(observador,))
+        resultado["hashes"][ALGORITMO_SIMILITUD] = observador.digest()
+        return resultado
     except Exception as e:
         print(f"[ERROR] No se pudo calcular el hash: {e}")
         return None
 
 
+def calcular_hash_md5(ruta_archivo: Path) -> Optional[str]:
+    """Calcula el hash MD5 de un archivo.
+    
+    Args:
+        ruta_archivo: Ruta al archivo a analizar.
+        
+    Returns:
+        Hash MD5 en formato hexadecimal, o None si hay error.
+    """
+    
+    resultado = calcular_hashes_archivo(ruta_archivo, ("md5",))
+    return resultado["hashes"]["md5"] if resultado else None
+
+
 def calcular_hash_sha256(ruta_archivo: Path) -> Optional[str]:
     """Calcula el hash SHA256 de un archivo.
     
@@ -44,76 +101,213 @@ def calcular_hash_sha256(ruta_archivo: Path) -> Optional[str]:
         Hash SHA256 en formato hexadecimal, o None si hay error.
     """
     
-    try:
-        sha256_hash = hashlib.sha256()
-        with open(ruta_archivo, "rb") as f:
-            for bloque in iter(lambda: f.read(4096), b""):
-                sha256_hash.update(bloque)
-        return sha256_hash.hexdigest()
-    except Exception as e:
-        print(f"[ERROR] No se pudo calcular el hash: {e}")
-        return None
+    resultado = calcular_hashes_archivo(ruta_archivo, ("sha256",))
+    return resultado["hashes"]["sha256"] if resultado else None
 
 
-def verificar_malware(hash_md5: str, hash_sha256: str) -> Dict[str, Any]:
+def verificar_malware(hash_md5: str, hash_sha256: str, firmas: Optional[Any] = None, hash_similitud: Optional[str] = None, indice: Optional[IndiceSimilitud] = None) -> Dict[str, Any]:
     """Verifica si los hashes corresponden a malware conocido.
     
+    Si no hay coincidencia exacta y se indica la firma ssdeep, se buscan
+    variantes parecidas en el índice de similitud.
+    
     Args:
         hash_md5: Hash MD5 del archivo.
         hash_sha256: Hash SHA256 del archivo.
+        firmas: Base de firmas a consultar (por defecto, la de obtener_firmas()).
+        hash_similitud: Firma ssdeep del archivo (opcional).
+        indice: Índice de similitud (por defecto, el de obtener_indice_similitud()).
         
     Returns:
         Diccionario con el resultado de la verificación.
     """
     
+    if firmas is None:
+        firmas = obtener_firmas()
     resultado = {
         "es_malicioso": False,
         "descripcion": "Archivo no identificado en la base de datos",
-        "hash_encontrado": None
+        "hash_encontrado": None,
+        "similares": []
     }
     
-    if hash_md5 in HASHES_MALICIOSOS:
+    descripcion_md5 = firmas.get(hash_md5)
+    descripcion_sha256 = firmas.get(hash_sha256) if descripcion_md5 is None else None
+    if descripcion_md5 is not None:
         resultado["es_malicioso"] = True
-        resultado["descripcion"] = HASHES_MALICIOSOS[hash_md5]
+        resultado["descripcion"] = descripcion_md5
         resultado["hash_encontrado"] = f"MD5: {hash_md5}"
-    elif hash_sha256 in HASHES_MALICIOSOS:
+    elif descripcion_sha256 is not None:
         resultado["es_malicioso"] = True
-        resultado["descripcion"] = HASHES_MALICIOSOS[hash_sha256]
+        resultado["descripcion"] = descripcion_sha256
         resultado["hash_encontrado"] = f"SHA256: {hash_sha256}"
+    elif hash_similitud:
+        if indice is None:
+            indice = obtener_indice_similitud()
+        similares = indice.buscar(hash_similitud) if indice is not None else []
+        if similares:
+            mejor = similares[0]
+            resultado["es_malicioso"] = True
+            resultado["descripcion"] = f"Variante de: {mejor['descripcion']} (similitud {mejor['puntuacion']}%)"
+            resultado["hash_encontrado"] = f"SSDEEP: {mejor['firma']}"
+            resultado["similares"] = similares
+    
+    return resultado
+
+
+def barrer_directorio(ruta_directorio: Path, procesos: Optional[int] = None) -> Dict[str, Any]:
+    """Analiza recursivamente un directorio en paralelo contra la base de hashes.
+    
+    Los resultados se muestran según van terminando y al final se imprime un
+    resumen con archivos/s y MB/s.
+    
+    Args:
+        ruta_directorio: Directorio raíz del barrido.
+        procesos: Número de procesos a usar (por defecto, uno por CPU).
+        
+    Returns:
+        Resumen del barrido con detecciones, errores y rendimiento.
+    """
+    
+    def mostrar(resultado: Dict[str, Any]) -> None:
+        if "deteccion" in resultado:
+            deteccion = resultado["deteccion"]
+            print(f"⚠️  {resultado['ruta']}: {deteccion['descripcion']} ({deteccion['algoritmo'].upper()})")
+        elif "error" in resultado:
+            print(f"[ERROR] {resultado['ruta']}: {resultado['error']}")
+    
+    resumen = barrido_malware_core(
+        str(ruta_directorio), obtener_firmas(), ("md5", "sha256"), procesos, mostrar, cache_por_defecto()
+    )
+    print("\n--- RESUMEN DEL BARRIDO ---")
+    print(formatear_resumen(resumen))
+    return resumen
+
+
+def analizar_contenedor(ruta_archivo: Path) -> Optional[Dict[str, Any]]:
+    """Analiza en memoria los miembros de un tar/zip/gz/bz2/xz (incluidos anidados).
+    
+    Ningún miembro se extrae a disco; se aplican límites de profundidad,
+    tamaño descomprimido y ratio de compresión.
+    
+    Args:
+        ruta_archivo: Ruta al archivo comprimido.
+        
+    Returns:
+        Resultado del análisis de los miembros, o None si no es un contenedor.
+    """
     
+    if not es_archivo_comprimido(ruta_archivo):
+        return None
+    resultado = analizar_archivo_comprimido(str(ruta_archivo), ("md5", "sha256"), obtener_firmas())
+    print(f"\n--- CONTENIDO DEL ARCHIVO ({resultado['tipo'].upper()}) ---")
+    print(f"Miembros analizados en memoria: {len(resultado['miembros'])}")
+    for miembro in resultado["detecciones"]:
+        print(f"⚠️  {miembro['ruta']}: {miembro['firma']}")
+    for alerta in resultado["alertas"]:
+        print(f"⚠️  {alerta}")
+    for error in resultado["errores"]:
+        print(f"[ERROR] {error['ruta']}: {error['error']}")
     return resultado
 
 
+def importar_feed(ruta_csv: Path) -> None:
+    """Importa un feed CSV (hash, descripción) en la base de firmas en disco.
+    
+    Args:
+        ruta_csv: Ruta al archivo CSV con los hashes maliciosos.
+    """
+    
+    global _firmas, _indice_similitud
+    try:
+        estadisticas = importar_csv_core(str(ruta_csv), DIRECTORIO_FIRMAS)
+        similitud = importar_csv_similitud(str(ruta_csv), RUTA_INDICE_SIMILITUD)
+    except FileNotFoundError as e:
+        print(f"[ERROR] {e}")
+        return
+    _firmas = None
+    _indice_similitud = None
+    print(f"✓ Firmas importadas: {estadisticas['importadas']} (ignoradas: {estadisticas['ignoradas']})")
+    print(f"  Total en la base '{DIRECTORIO_FIRMAS}': {estadisticas['total']}")
+    if similitud["importadas"]:
+        print(f"✓ Firmas ssdeep importadas: {similitud['importadas']} (total en el índice: {similitud['total']})")
+
+
+def registrar_muestra(ruta_archivo: Path, descripcion: str) -> None:
+    """Añade la firma ssdeep de una muestra conocida al índice de similitud.
+    
+    Args:
+        ruta_archivo: Ruta a la muestra.
+        descripcion: Descripción que se mostrará al detectar variantes.
+    """
+    
+    global _indice_similitud
+    if not ruta_archivo.is_file():
+        print(f"[ERROR] El archivo '{ruta_archivo}' no existe.")
+        return
+    calculo = calcular_hashes_archivo(ruta_archivo, ("md5",), similitud=True)
+    firma = calculo["hashes"][ALGORITMO_SIMILITUD] if calculo else None
+    if firma is None:
+        print(f"[ERROR] No se pudo calcular la firma ssdeep (máximo {MAX_BYTES_SIMILITUD // (1024 * 1024)} MB).")
+        return
+    with IndiceSimilitud(RUTA_INDICE_SIMILITUD) as indice:
+        anadida = indice.anadir(firma, descripcion or ruta_archivo.name)
+    _indice_similitud = None
+    print(f"✓ SSDEEP: {firma}")
+    print("  Muestra añadida al índice de similitud." if anadida else "  La firma ya estaba en el índice.")
+
+
 if __name__ == "__main__":
     print("=== ANALIZADOR DE ARCHIVOS - DETECTOR DE MALWARE ===\n")
+    print("Introduce la ruta del archivo o directorio a analizar,")
+    print("'importar <feed.csv>' para añadir hashes a la base de firmas,")
+    print("o 'muestra <archivo> [descripción]' para añadir una muestra al índice de similitud.")
     
-    ruta_input = input("Introduce la ruta del archivo a analizar: ").strip()
+    ruta_input = input("Ruta: ").strip()
     ruta_archivo = Path(ruta_input)
     
-    if not ruta_archivo.exists():
+    if ruta_input.lower().startswith("importar "):
+        importar_feed(Path(ruta_input[len("importar "):].strip()))
+    elif ruta_input.lower().startswith("muestra "):
+        partes = ruta_input[len("muestra "):].strip().split(maxsplit=1)
+        registrar_muestra(Path(partes[0]), partes[1] if len(partes) > 1 else "")
+    elif not ruta_archivo.exists():
         print(f"[ERROR] El archivo '{ruta_archivo}' no existe.")
+    elif ruta_archivo.is_dir():
+        print(f"\nBarrido recursivo de: {ruta_archivo}")
+        print("-" * 50)
+        barrer_directorio(ruta_archivo)
     elif not ruta_archivo.is_file():
         print(f"[ERROR] '{ruta_archivo}' no es un archivo válido.")
     else:
         print(f"\nAnalizando: {ruta_archivo.name}")
         print("-" * 50)
         
-        # Calcular hashes
-        hash_md5 = calcular_hash_md5(ruta_archivo)
-        hash_sha256 = calcular_hash_sha256(ruta_archivo)
+        # Calcular ambos hashes en una única lectura del archivo
+        calculo = calcular_hashes_archivo(ruta_archivo, similitud=True)
         
-        if hash_md5 and hash_sha256:
+        if calculo:
+            hash_md5 = calculo["hashes"]["md5"]
+            hash_sha256 = calculo["hashes"]["sha256"]
+            hash_ssdeep = calculo["hashes"][ALGORITMO_SIMILITUD]
             print(f"MD5:    {hash_md5}")
             print(f"SHA256: {hash_sha256}")
+            print(f"SSDEEP: {hash_ssdeep or 'no calculado (archivo demasiado grande)'}")
+            print(f"Lectura: {formatear_rendimiento(calculo)}")
             
-            # Verificar si es malware conocido
-            resultado = verificar_malware(hash_md5, hash_sha256)
+            # Verificar si es malware conocido (o una variante parecida)
+            resultado = verificar_malware(hash_md5, hash_sha256, hash_similitud=hash_ssdeep)
             
             print("\n--- RESULTADO DEL ANÁLISIS ---")
             if resultado["es_malicioso"]:
                 print("⚠️  ¡ARCHIVO MALICIOSO DETECTADO!")
                 print(f"Descripción: {resultado['descripcion']}")
                 print(f"Hash: {resultado['hash_encontrado']}")
+                for similar in resultado["similares"][1:]:
+                    print(f"  También parecido a: {similar['descripcion']} ({similar['puntuacion']}%)")
             else:
                 print("✓ No se detectaron amenazas conocidas.")
                 print(f"Nota: {resultado['descripcion']}")
+            
+            # Si es un archivo comprimido, analizar también sus miembros
+            analizar_contenedor(ruta_archivo)
@@ -1,106 +1,313 @@
 """Monitor de cambios en archivos críticos del sistema para detectar modificaciones sospechosas."""
 
-import hashlib
-import json
+import sys
 import time
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Any, Dict, List, Optional
 
+# El motor de hashes compartido vive en la raíz del proyecto
+RAIZ_PROYECTO = Path(__file__).resolve().parents[2]
+if str(RAIZ_PROYECTO) not in sys.path:
+    sys.path.insert(0, str(RAIZ_PROYECTO))
 
-def calcular_hash(archivo: Path) -> Optional[str]:
-    """Calcula el hash SHA256 de un archivo."""
+from arbol_merkle import RUTA_ARBOL, comparar_arboles, comparar_con_actual, construir_arbol, exportar_arbol, leer_metadatos
+from cache_hashes import calcular_hashes_cacheado
+from linea_base import (
+    RUTA_LINEA_BASE,
+    UMBRAL_BLOQUES,
+    crear_linea_base_core,
+    crear_linea_base_directorios_core,
+    formatear_resumen,
+    verificar_linea_base_core,
+)
+from motor_hash import calcular_hashes
+from vigilancia import VigilanteIntegridad
+
+
+# Formato anterior: un único objeto JSON con ruta -> {"hash", "fecha"}
+BASELINE_ANTIGUA = "baseline.json"
+
+
+def calcular_hash(archivo: Path, usar_cache: bool = True) -> Optional[str]:
+    """Calcula el hash SHA256 de un archivo.
+    
+    Con usar_cache, si el archivo no ha cambiado (mismo dispositivo, inodo,
+    tamaño, mtime y ctime) se reutiliza el hash guardado sin leerlo.
+    """
     
     try:
-        sha256 = hashlib.sha256()
-        with open(archivo, "rb") as f:
-            for bloque in iter(lambda: f.read(4096), b""):
-                sha256.update(bloque)
-        return sha256.hexdigest()
+        calcular = calcular_hashes_cacheado if usar_cache else calcular_hashes
+        return calcular(archivo, ("sha256",))["hashes"]["sha256"]
     except Exception:
         return None
 
 
-def crear_baseline(archivos: List[str], baseline_file: str = "baseline.json") -> None:
-    """Crea una línea base con los hashes de los archivos críticos.
+def crear_baseline(archivos: List[str], baseline_file: str = RUTA_LINEA_BASE, bloques: bool = False) -> None:
+    """Crea una línea base con los hashes y metadatos de los archivos críticos.
+    
+    Por cada archivo se guarda el hash, el tamaño, mtime/ctime, el inodo y
+    el modo, en formato JSONL (una línea por archivo).
     
     Args:
         archivos: Lista de rutas de archivos a monitorizar.
         baseline_file: Archivo donde guardar la línea base.
+        bloques: Guardar también hashes por bloques de los archivos grandes,
+            para localizar los cambios y detectar crecimientos sin releerlos.
     """
     
-    baseline = {}
-    
     print("\n=== CREANDO LÍNEA BASE ===\n")
     
-    for ruta in archivos:
-        archivo = Path(ruta)
-        if archivo.exists() and archivo.is_file():
-            hash_actual = calcular_hash(archivo)
-            if hash_actual:
-                baseline[str(archivo)] = {
-                    "hash": hash_actual,
-                    "fecha": time.strftime("%Y-%m-%d %H:%M:%S")
-                }
-                print(f"✓ {archivo.name}")
+    def mostrar(resultado: Dict[str, Any]) -> None:
+        if "error" in resultado:
+            print(f"⚠ {resultado['ruta']} - {resultado['error']}")
         else:
-            print(f"⚠ {ruta} - No encontrado")
+            print(f"✓ {Path(resultado['ruta']).name}")
+    
+    rutas = [str(Path(ruta).expanduser()) for ruta in archivos]
+    crear_linea_base_core(rutas, baseline_file, mostrar, bloques)
+    
+    print(f"\n✓ Línea base guardada en {baseline_file}")
+
+
+def crear_baseline_directorios(raices: List[str], incluir: Optional[List[str]] = None,
+                               excluir: Optional[List[str]] = None, procesos: Optional[int] = None,
+                               baseline_file: str = RUTA_LINEA_BASE, bloques: bool = False,
+                               reanudar: bool = False) -> Optional[Dict[str, Any]]:
+    """Crea la línea base de todos los archivos bajo uno o varios directorios.
+    
+    Los archivos se hashean en paralelo (por defecto, un proceso por CPU, o
+    pocos si el disco es rotacional) y la línea base se escribe según
+    avanza, de modo que si se interrumpe se puede reanudar (los archivos
+    modificados desde entonces se vuelven a hashear).
+    
+    Args:
+        raices: Directorios a recorrer.
+        incluir: Patrones glob de los archivos a incluir (todos si está vacío).
+        excluir: Patrones glob de archivos o directorios a excluir.
+        procesos: Número de procesos de hasheo (None = según el almacenamiento).
+        baseline_file: Archivo donde guardar la línea base.
+        bloques: Guardar también hashes por bloques de los archivos grandes.
+        reanudar: Continuar una línea base interrumpida (una terminada se rehace).
+    
+    Returns:
+        Resumen de la creación, o None si algún directorio no existe.
+    """
+    
+    print("\n=== CREANDO LÍNEA BASE DE DIRECTORIOS ===\n")
+    
+    def progreso(estado: Dict[str, Any]) -> None:
+        eta = "--:--" if estado["eta_s"] is None else time.strftime("%H:%M:%S", time.gmtime(estado["eta_s"]))
+        print(f"\r{estado['archivos']}/{estado['total_archivos']} archivos, "
+              f"{estado['bytes'] / (1024 * 1024):.0f}/{estado['total_bytes'] / (1024 * 1024):.0f} MB, "
+              f"{estado['mb_s']:.1f} MB/s, quedan {eta}   ", end="", flush=True)
     
-    with open(baseline_file, "w", encoding="utf-8") as f:
-        json.dump(baseline, f, indent=4, ensure_ascii=False)
+    try:
+        resumen = crear_linea_base_directorios_core(raices, baseline_file, incluir or (), excluir or (),
+                                                    procesos, reanudar=reanudar, al_progreso=progreso, bloques=bloques)
+    except NotADirectoryError as e:
+        print(f"[ERROR] {e}")
+        return None
     
+    print(f"\r{resumen['archivos']} archivos hasheados ({resumen['bytes'] / (1024 * 1024):.2f} MB) en "
+          f"{resumen['segundos']:.2f} s ({resumen['archivos_s']:.0f} archivos/s, {resumen['mb_s']:.1f} MB/s)")
+    if resumen["reanudados"]:
+        print(f"Reanudada: {resumen['reanudados']} archivos ya estaban en la línea base")
+    for error in resumen["errores"]:
+        print(f"⚠ {error['ruta']} - {error['error']}")
     print(f"\n✓ Línea base guardada en {baseline_file}")
+    return resumen
 
 
-def verificar_integridad(baseline_file: str = "baseline.json") -> None:
+def verificar_integridad(baseline_file: str = RUTA_LINEA_BASE, paranoico: bool = False) -> Optional[Dict[str, Any]]:
     """Verifica la integridad de los archivos comparándolos con la línea base.
     
+    Primero se compara el stat de cada archivo con el guardado y solo se
+    vuelven a hashear los que han cambiado de tamaño, fecha, inodo o modo.
+    
     Args:
         baseline_file: Archivo con la línea base de referencia.
+        paranoico: Rehashear todos los archivos aunque sus metadatos no cambien.
+    
+    Returns:
+        Resumen de la verificación, o None si no existe la línea base.
     """
     
-    try:
-        with open(baseline_file, "r", encoding="utf-8") as f:
-            baseline = json.load(f)
-    except FileNotFoundError:
+    if baseline_file == RUTA_LINEA_BASE and not Path(baseline_file).exists() and Path(BASELINE_ANTIGUA).exists():
+        baseline_file = BASELINE_ANTIGUA
+    if not Path(baseline_file).exists():
         print(f"[ERROR] No se encontró el archivo de línea base: {baseline_file}")
-        return
+        return None
     
     print("\n=== VERIFICACIÓN DE INTEGRIDAD ===\n")
+    if paranoico:
+        print("Modo paranoico: se rehashean todos los archivos.\n")
     
-    cambios_detectados = False
-    
-    for ruta, info in baseline.items():
-        archivo = Path(ruta)
-        
-        if not archivo.exists():
-            print(f"⚠️  ARCHIVO ELIMINADO: {archivo.name}")
-            cambios_detectados = True
-            continue
-        
-        hash_actual = calcular_hash(archivo)
-        
-        if hash_actual and hash_actual != info["hash"]:
-            print(f"🔴 MODIFICADO: {archivo.name}")
-            print(f"   Hash original: {info['hash'][:16]}...")
-            print(f"   Hash actual:   {hash_actual[:16]}...")
-            cambios_detectados = True
-        elif hash_actual:
-            print(f"✓ {archivo.name} - Sin cambios")
+    def mostrar(cambio: Dict[str, Any]) -> None:
+        nombre = Path(cambio["ruta"]).name
+        if cambio["tipo"] == "eliminado":
+            print(f"⚠️  ARCHIVO ELIMINADO: {nombre}")
+        elif cambio["tipo"] == "modificado":
+            print(f"🔴 MODIFICADO: {nombre}")
+            print(f"   Hash original: {cambio['hash_original'][:16]}...")
+            print(f"   Hash actual:   {cambio['hash_actual'][:16]}...")
+            for inicio, fin in cambio.get("rangos", [])[:10]:
+                print(f"   Bytes cambiados: {inicio}-{fin}")
+        elif cambio["tipo"] == "crecido":
+            print(f"🟡 CRECIDO (solo añadido al final): {nombre} "
+                  f"(+{cambio['tamano_actual'] - cambio['tamano_original']} bytes)")
+        elif cambio["tipo"] == "permisos":
+            print(f"🟠 PERMISOS CAMBIADOS: {nombre} ({cambio['modo_original']} -> {cambio['modo_actual']})")
         else:
-            print(f"⚠️  ERROR al leer: {archivo.name}")
-            cambios_detectados = True
+            print(f"⚠️  ERROR al leer: {nombre} ({cambio['error']})")
     
-    if not cambios_detectados:
+    resumen = verificar_linea_base_core(baseline_file, paranoico, mostrar)
+    print(f"\n{formatear_resumen(resumen)}")
+    
+    if not resumen["cambios"]:
         print("\n✓ Todos los archivos mantienen su integridad.")
     else:
         print("\n⚠️  Se detectaron cambios en archivos críticos.")
+    return resumen
+
+
+def vigilar_integridad(baseline_file: str = RUTA_LINEA_BASE) -> None:
+    """Vigila en tiempo real (inotify, solo Linux) los archivos de la línea base.
+    
+    Se agrupan las ráfagas de eventos y solo se comprueban los archivos
+    tocados; los avisos se muestran en cuanto se detecta el cambio.
+    Ctrl+C para terminar.
+    
+    Args:
+        baseline_file: Archivo con la línea base de referencia.
+    """
+    
+    if not Path(baseline_file).exists():
+        print(f"[ERROR] No se encontró el archivo de línea base: {baseline_file}")
+        return
+    
+    def mostrar(cambio: Dict[str, Any]) -> None:
+        hora = time.strftime("%H:%M:%S")
+        latencia = f"({cambio['latencia_ms']:.0f} ms)"
+        if cambio["tipo"] == "eliminado":
+            print(f"[{hora}] ⚠️  ARCHIVO ELIMINADO: {cambio['ruta']} {latencia}")
+        elif cambio["tipo"] == "modificado":
+            print(f"[{hora}] 🔴 MODIFICADO: {cambio['ruta']} {latencia}")
+        elif cambio["tipo"] == "crecido":
+            print(f"[{hora}] 🟡 CRECIDO: {cambio['ruta']} "
+                  f"(+{cambio['tamano_actual'] - cambio['tamano_original']} bytes) {latencia}")
+        elif cambio["tipo"] == "permisos":
+            print(f"[{hora}] 🟠 PERMISOS CAMBIADOS: {cambio['ruta']} "
+                  f"({cambio['modo_original']} -> {cambio['modo_actual']}) {latencia}")
+        elif cambio["tipo"] == "restaurado":
+            print(f"[{hora}] ✓ RESTAURADO: {cambio['ruta']} {latencia}")
+        else:
+            print(f"[{hora}] ⚠️  ERROR al leer: {cambio['ruta']} ({cambio['error']})")
+    
+    try:
+        vigilante = VigilanteIntegridad(baseline_file, mostrar)
+    except OSError as e:
+        print(f"[ERROR] {e}")
+        return
+    
+    print(f"\n=== VIGILANCIA EN TIEMPO REAL ({len(vigilante.registros)} archivos, "
+          f"{len(vigilante.por_directorio)} directorios) ===")
+    print("Pulsa Ctrl+C para terminar.\n")
+    try:
+        vigilante.ejecutar()
+    except KeyboardInterrupt:
+        print("\nVigilancia detenida.")
+    if vigilante.desbordamientos:
+        print(f"Desbordamientos de la cola de eventos: {vigilante.desbordamientos} (se reescaneó la línea base)")
+
+
+def crear_baseline_merkle(directorio: str, baseline_file: str = RUTA_ARBOL) -> None:
+    """Crea una línea base en árbol de Merkle de todo un directorio.
+    
+    Cada directorio guarda el hash de sus hijos, de modo que al comparar
+    solo se recorren las ramas que han cambiado.
+    
+    Args:
+        directorio: Directorio raíz a monitorizar.
+        baseline_file: Archivo SQLite donde guardar el árbol.
+    """
+    
+    print("\n=== CREANDO LÍNEA BASE MERKLE ===\n")
+    
+    def progreso(archivos: int, total_bytes: int) -> None:
+        print(f"\r{archivos} archivos ({total_bytes / (1024 * 1024):.1f} MB)", end="", flush=True)
+    
+    try:
+        resultado = construir_arbol(str(Path(directorio).expanduser()), baseline_file, progreso)
+    except OSError as e:
+        print(f"[ERROR] {e}")
+        return
+    
+    print(f"\r{resultado['archivos']} archivos en {resultado['directorios']} directorios "
+          f"({resultado['bytes'] / (1024 * 1024):.1f} MB) en {resultado['segundos']:.2f} s")
+    for error in resultado["errores"]:
+        print(f"⚠ {error['ruta']} - {error['error']}")
+    print(f"Hash raíz: {resultado['hash_raiz']}")
+    print(f"\n✓ Línea base Merkle guardada en {baseline_file}")
+
+
+def comparar_baseline_merkle(baseline_file: str = RUTA_ARBOL, otra: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """Compara una línea base Merkle con el directorio actual o con otra línea base.
+    
+    Args:
+        baseline_file: Línea base Merkle de referencia.
+        otra: Línea base Merkle a comparar (por ejemplo, exportada desde otro
+            equipo). Si es None se compara con el estado actual del directorio.
+    
+    Returns:
+        Resultado de la comparación, o None si falta alguna línea base.
+    """
+    
+    for archivo in (baseline_file, otra):
+        if archivo and not Path(archivo).exists():
+            print(f"[ERROR] No se encontró el archivo de línea base: {archivo}")
+            return None
+    
+    referencia = leer_metadatos(baseline_file)
+    print("\n=== COMPARACIÓN MERKLE ===\n")
+    print(f"Referencia: {referencia['raiz']} ({referencia['equipo']}, {referencia['creado']})")
+    
+    def mostrar(cambio: Dict[str, Any]) -> None:
+        if cambio["tipo"] == "eliminado":
+            print(f"⚠️  ELIMINADO: {cambio['ruta']}")
+        elif cambio["tipo"] == "anadido":
+            print(f"🟡 AÑADIDO: {cambio['ruta']}")
+        elif cambio["tipo"] == "modificado":
+            print(f"🔴 MODIFICADO: {cambio['ruta']}")
+        elif cambio["tipo"] == "permisos":
+            print(f"🟠 PERMISOS CAMBIADOS: {cambio['ruta']} ({cambio['modo_original']} -> {cambio['modo_actual']})")
+        else:
+            print(f"🔴 TIPO CAMBIADO: {cambio['ruta']} ({cambio['tipo_original']} -> {cambio['tipo_actual']})")
+    
+    if otra:
+        comparada = leer_metadatos(otra)
+        print(f"Comparada:  {comparada['raiz']} ({comparada['equipo']}, {comparada['creado']})\n")
+        resultado = comparar_arboles(baseline_file, otra, mostrar)
+    else:
+        print("Comparada:  estado actual del directorio\n")
+        resultado = comparar_con_actual(baseline_file, al_cambio=mostrar)
+    
+    print(f"\nNodos visitados: {resultado['nodos_visitados']}. Cambios: {len(resultado['cambios'])}")
+    if not resultado["cambios"]:
+        print("\n✓ Los árboles son idénticos.")
+    return resultado
 
 
 if __name__ == "__main__":
     print("=== MONITOR DE INTEGRIDAD DE ARCHIVOS ===")
     print("\n1. Crear línea base")
     print("2. Verificar integridad")
-    print("3. Salir")
+    print("3. Verificación paranoica (rehashear todos los archivos)")
+    print("4. Vigilancia en tiempo real (inotify)")
+    print("5. Crear línea base Merkle de un directorio")
+    print("6. Comparar línea base Merkle (directorio actual u otra línea base)")
+    print("7. Exportar línea base Merkle")
+    print("8. Crear línea base de directorios completos (en paralelo, reanudable)")
+    print("9. Salir")
     
     opcion = input("\nSelecciona una opción: ").strip()
     
@@ -117,7 +324,8 @@ if __name__ == "__main__":
             archivos.append(ruta)
         
         if archivos:
-            crear_baseline(archivos)
+            bloques = input(f"¿Hashes por bloques de los archivos de más de {UMBRAL_BLOQUES // (1024 * 1024)} MB? (s/N): ")
+            crear_baseline(archivos, bloques=bloques.strip().lower() == "s")
         else:
             print("[ERROR] No se especificaron archivos.")
     
@@ -125,6 +333,45 @@ if __name__ == "__main__":
         verificar_integridad()
     
     elif opcion == "3":
+        verificar_integridad(paranoico=True)
+    
+    elif opcion == "4":
+        vigilar_integridad()
+    
+    elif opcion == "5":
+        directorio = input("Directorio raíz: ").strip()
+        if directorio:
+            crear_baseline_merkle(directorio)
+        else:
+            print("[ERROR] No se especificó el directorio.")
+    
+    elif opcion == "6":
+        otra = input("Otra línea base Merkle (vacío = directorio actual): ").strip()
+        comparar_baseline_merkle(otra=otra or None)
+    
+    elif opcion == "7":
+        destino = input("Archivo de destino: ").strip()
+        if not destino:
+            print("[ERROR] No se especificó el destino.")
+        elif not Path(RUTA_ARBOL).exists():
+            print(f"[ERROR] No se encontró el archivo de línea base: {RUTA_ARBOL}")
+        else:
+            exportar_arbol(RUTA_ARBOL, destino)
+            print(f"✓ Línea base exportada a {destino}; cópiala a otro equipo para compararla allí.")
+    
+    elif opcion == "8":
+        raices = input("Directorios raíz (separados por espacios): ").split()
+        incluir = input("Patrones a incluir (vacío = todos, ej. *.conf *.py): ").split()
+        excluir = input("Patrones a excluir (ej. /proc /sys *.log): ").split()
+        bloques = input(f"¿Hashes por bloques de los archivos de más de {UMBRAL_BLOQUES // (1024 * 1024)} MB? (s/N): ")
+        reanudar = input("¿Reanudar una línea base interrumpida? (s/N): ")
+        if raices:
+            crear_baseline_directorios(raices, incluir, excluir, bloques=bloques.strip().lower() == "s",
+                                       reanudar=reanudar.strip().lower() == "s")
+        else:
+            print("[ERROR] No se especificaron directorios.")
+    
+    elif opcion == "9":
         print("Saliendo...")
     
     else:
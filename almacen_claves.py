@@ -0,0 +1,134 @@
+import base64
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from barrido import recorrer_archivos
+from cifrado_flujo import reenvolver_clave
+
+
+RUTA_ALMACEN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "almacen_claves.json")
+FORMATO_ALMACEN = "almacen_claves"
+VERSION = 1
+HILOS_ROTACION = 8
+
+
+class AlmacenClaves:
+    """Almacén local de claves de cifrado de claves (KEK) para el cifrado de sobre.
+
+    Cada archivo cifrado lleva su propia clave de datos envuelta con una
+    KEK del almacén; el almacén guarda todas las KEK por su identificador
+    (16 bytes) y cuál es la activa, la que se usa al cifrar. Se guarda como
+    JSON con permisos 0600 y se reescribe de forma atómica. Solo se crea
+    (con una KEK nueva) si se pide ``crear``; si no, que falte es un error.
+    """
+
+    def __init__(self, ruta=RUTA_ALMACEN, crear=False):
+        self.ruta = ruta
+        if os.path.exists(ruta):
+            with open(ruta, encoding="utf-8") as f:
+                datos = json.load(f)
+            if datos.get("formato") != FORMATO_ALMACEN:
+                raise ValueError("No es un almacén de claves válido.")
+            self._activa = datos["activa"]
+            self._claves = datos["claves"]
+        elif crear:
+            self._activa = None
+            self._claves = {}
+            self.nueva_kek()
+        else:
+            raise FileNotFoundError(f"No existe el almacén de claves: {ruta}")
+
+    def activa(self):
+        """(identificador, clave) de la KEK activa."""
+        return bytes.fromhex(self._activa), base64.b64decode(self._claves[self._activa]["clave"])
+
+    def obtener(self, id_kek):
+        """Clave de la KEK ``id_kek`` (bytes); ValueError si el almacén no la tiene."""
+        entrada = self._claves.get(id_kek.hex())
+        if entrada is None:
+            raise ValueError(f"La clave {id_kek.hex()} no está en el almacén.")
+        return base64.b64decode(entrada["clave"])
+
+    def ids(self):
+        return list(self._claves)
+
+    @property
+    def id_activa(self):
+        return self._activa
+
+    def nueva_kek(self):
+        """Genera una KEK, la deja como activa y guarda el almacén; devuelve su identificador."""
+        id_kek = os.urandom(16).hex()
+        self._claves[id_kek] = {"clave": base64.b64encode(os.urandom(32)).decode(),
+                                "creada": time.strftime("%Y-%m-%d %H:%M:%S")}
+        self._activa = id_kek
+        self.guardar()
+        return id_kek
+
+    def retirar(self, id_kek):
+        """Borra una KEK antigua: los archivos que aún la usen dejarán de poder descifrarse."""
+        if id_kek == self._activa:
+            raise ValueError("No se puede retirar la clave activa.")
+        self._claves.pop(id_kek, None)
+        self.guardar()
+
+    def guardar(self):
+        temporal = self.ruta + ".tmp"
+        descriptor = os.open(temporal, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(descriptor, "w", encoding="utf-8") as f:
+            json.dump({"formato": FORMATO_ALMACEN, "version": VERSION, "activa": self._activa,
+                       "claves": self._claves}, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporal, self.ruta)
+
+
+def _archivos(rutas, errores):
+    for ruta in rutas:
+        if os.path.isdir(ruta):
+            for archivo, _ in recorrer_archivos(ruta, errores):
+                yield archivo
+        else:
+            yield ruta
+
+
+def rotar_claves(rutas, almacen, hilos=None, retirar_anteriores=False):
+    """Genera una KEK nueva y reenvuelve con ella la clave de cada archivo cifrado de ``rutas``.
+
+    ``rutas`` son archivos o directorios (se recorren enteros; los
+    archivos que no usan cifrado de sobre se ignoran). Solo se reescribe
+    el bloque de clave de la cabecera de cada archivo, en su sitio y en un
+    pool de hilos, así que el coste no depende del tamaño de los datos.
+    Las KEK anteriores se conservan salvo que se pida
+    ``retirar_anteriores`` y no haya habido errores; hazlo solo si
+    ``rutas`` cubre todos los archivos cifrados con ellas.
+    """
+    inicio = time.perf_counter()
+    anteriores = [id_kek for id_kek in almacen.ids() if id_kek != almacen.id_activa]
+    anteriores.append(almacen.id_activa)
+    id_nueva = almacen.nueva_kek()
+    errores = []
+    cuentas = {"reenvuelto": 0, "actual": 0, "no_sobre": 0}
+
+    def reenvolver(ruta):
+        try:
+            return ruta, reenvolver_clave(ruta, almacen)
+        except (OSError, ValueError) as exc:
+            return ruta, exc
+
+    with ThreadPoolExecutor(hilos or HILOS_ROTACION) as pool:
+        for ruta, resultado in pool.map(reenvolver, _archivos(rutas, errores)):
+            if isinstance(resultado, Exception):
+                errores.append({"ruta": ruta, "error": str(resultado)})
+            else:
+                cuentas[resultado] += 1
+    retiradas = []
+    if retirar_anteriores and not errores:
+        for id_kek in anteriores:
+            almacen.retirar(id_kek)
+            retiradas.append(id_kek)
+    return {"kek": id_nueva, "reenvueltos": cuentas["reenvuelto"], "ya_actuales": cuentas["actual"],
+            "ignorados": cuentas["no_sobre"], "errores": errores, "retiradas": retiradas,
+            "segundos": time.perf_counter() - inicio}
@@ -0,0 +1,271 @@
+import hashlib
+import os
+import platform
+import sqlite3
+import stat
+import tempfile
+import time
+
+from cache_hashes import calcular_hashes_cacheado
+
+
+RUTA_ARBOL = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline_merkle.sqlite")
+ALGORITMO = "sha256"
+REGISTROS_POR_TANDA = 5000
+
+_FORMATOS = {"f": stat.S_IFREG, "d": stat.S_IFDIR, "l": stat.S_IFLNK}
+
+# ruta, padre y nombre van como BLOB (os.fsencode): SQLite no admite en TEXT los
+# nombres con bytes no UTF-8. Los árboles anteriores los tienen como TEXT y se siguen leyendo.
+_ESQUEMA = (
+    """CREATE TABLE IF NOT EXISTS nodos (
+        ruta BLOB PRIMARY KEY,
+        padre BLOB,
+        nombre BLOB NOT NULL,
+        tipo TEXT NOT NULL,
+        hash TEXT NOT NULL,
+        modo INTEGER NOT NULL,
+        tamano INTEGER NOT NULL
+    ) WITHOUT ROWID""",
+    "CREATE INDEX IF NOT EXISTS idx_padre ON nodos (padre)",
+    "CREATE TABLE IF NOT EXISTS metadatos (clave TEXT PRIMARY KEY, valor TEXT NOT NULL)",
+)
+
+
+def _hash_enlace(ruta):
+    return hashlib.sha256(os.fsencode(os.readlink(ruta))).hexdigest()
+
+
+def _hash_directorio(hijos):
+    """Hash de un directorio a partir de (nombre, tipo, modo, hash) de sus hijos.
+
+    Los hijos se ordenan por nombre y los campos se separan con ``\\0``,
+    que no puede aparecer en un nombre de archivo.
+    """
+    digest = hashlib.sha256()
+    for nombre, tipo, modo, hash_hijo in sorted(hijos):
+        digest.update(f"{nombre}\0{tipo}\0{modo:o}\0{hash_hijo}\n".encode("utf-8", "surrogateescape"))
+    return digest.hexdigest()
+
+
+def _unir(padre, nombre):
+    return f"{padre}/{nombre}" if padre else nombre
+
+
+def _claves(ruta):
+    """Valores con los que buscar ``ruta``: como BLOB y, si se puede, como TEXT (árboles anteriores)."""
+    codificada = os.fsencode(ruta)
+    try:
+        return codificada, codificada.decode("utf-8")
+    except UnicodeDecodeError:
+        return codificada, codificada
+
+
+def construir_arbol(raiz, ruta_arbol=RUTA_ARBOL, al_progreso=None):
+    """Recorre ``raiz`` y guarda su árbol de Merkle en una base SQLite.
+
+    Cada archivo es una hoja con el hash de su contenido (los que no han
+    cambiado se toman de la caché de hashes sin leerlos) y cada directorio
+    guarda el hash de la lista ordenada de sus hijos, con sus permisos. Las
+    rutas se guardan relativas a ``raiz``, así que los árboles de equipos
+    distintos se pueden comparar. Devuelve el hash raíz y los totales.
+    """
+    if not os.path.isdir(raiz):
+        raise NotADirectoryError("El directorio no existe.")
+    temporal = ruta_arbol + ".tmp"
+    if os.path.exists(temporal):
+        os.remove(temporal)
+    conexion = sqlite3.connect(temporal)
+    conexion.execute("PRAGMA journal_mode=OFF")
+    conexion.execute("PRAGMA synchronous=OFF")
+    for sentencia in _ESQUEMA:
+        conexion.execute(sentencia)
+
+    tanda, errores = [], []
+    archivos, directorios, total_bytes = 0, 0, 0
+    inicio = time.perf_counter()
+
+    def guardar(fila):
+        tanda.append(fila)
+        if len(tanda) >= REGISTROS_POR_TANDA:
+            conexion.executemany("INSERT INTO nodos VALUES (?, ?, ?, ?, ?, ?, ?)", tanda)
+            tanda.clear()
+
+    # Recorrido en postorden con pila explícita: (ruta relativa, subdirectorios pendientes, hijos)
+    st_raiz = os.stat(raiz)
+    pila = [("", None, [], stat.S_IMODE(st_raiz.st_mode))]
+    while pila:
+        relativa, pendientes, hijos, modo_directorio = pila[-1]
+        if pendientes is None:
+            pendientes = []
+            try:
+                with os.scandir(os.path.join(raiz, relativa)) as entradas:
+                    entradas = sorted(entradas, key=lambda entrada: entrada.name)
+            except OSError as exc:
+                errores.append({"ruta": relativa or ".", "error": exc.strerror or str(exc)})
+                entradas = []
+            for entrada in entradas:
+                ruta = _unir(relativa, entrada.name)
+                try:
+                    st = entrada.stat(follow_symlinks=False)
+                    modo = stat.S_IMODE(st.st_mode)
+                    if stat.S_ISDIR(st.st_mode):
+                        pendientes.append((ruta, modo))
+                        continue
+                    if stat.S_ISLNK(st.st_mode):
+                        tipo, digest = "l", _hash_enlace(entrada.path)
+                    elif stat.S_ISREG(st.st_mode):
+                        tipo = "f"
+                        digest = calcular_hashes_cacheado(entrada.path, (ALGORITMO,))["hashes"][ALGORITMO]
+                        archivos += 1
+                        total_bytes += st.st_size
+                    else:
+                        continue
+                except OSError as exc:
+                    errores.append({"ruta": ruta, "error": exc.strerror or str(exc)})
+                    continue
+                hijos.append((entrada.name, tipo, modo, digest))
+                guardar((os.fsencode(ruta), os.fsencode(relativa), os.fsencode(entrada.name), tipo, digest, modo,
+                         st.st_size))
+                if al_progreso and archivos % 1000 == 0 and tipo == "f":
+                    al_progreso(archivos, total_bytes)
+            pila[-1] = (relativa, pendientes, hijos, modo_directorio)
+        if pendientes:
+            ruta, modo = pendientes.pop()
+            pila.append((ruta, None, [], modo))
+            continue
+        # Todos los hijos resueltos: se cierra el directorio
+        pila.pop()
+        digest = _hash_directorio(hijos)
+        directorios += 1
+        nombre = relativa.rsplit("/", 1)[-1]
+        padre = relativa.rsplit("/", 1)[0] if "/" in relativa else ("" if relativa else None)
+        guardar((os.fsencode(relativa), None if padre is None else os.fsencode(padre), os.fsencode(nombre), "d",
+                 digest, modo_directorio, len(hijos)))
+        if pila:
+            pila[-1][2].append((nombre, "d", modo_directorio, digest))
+        else:
+            hash_raiz = digest
+
+    if tanda:
+        conexion.executemany("INSERT INTO nodos VALUES (?, ?, ?, ?, ?, ?, ?)", tanda)
+    conexion.executemany("INSERT INTO metadatos VALUES (?, ?)", (
+        ("raiz", os.fsencode(os.path.abspath(raiz))),
+        ("equipo", platform.node()),
+        ("algoritmo", ALGORITMO),
+        ("creado", time.strftime("%Y-%m-%d %H:%M:%S")),
+        ("hash_raiz", hash_raiz),
+    ))
+    conexion.commit()
+    conexion.close()
+    os.replace(temporal, ruta_arbol)
+    segundos = time.perf_counter() - inicio
+    return {
+        "hash_raiz": hash_raiz,
+        "archivos": archivos,
+        "directorios": directorios,
+        "bytes": total_bytes,
+        "errores": errores,
+        "segundos": segundos,
+    }
+
+
+def leer_metadatos(ruta_arbol):
+    # El ``with`` de sqlite3 solo gestiona la transacción, no cierra la conexión
+    conexion = sqlite3.connect(f"file:{ruta_arbol}?mode=ro", uri=True)
+    try:
+        return {clave: os.fsdecode(valor) for clave, valor in conexion.execute("SELECT clave, valor FROM metadatos")}
+    finally:
+        conexion.close()
+
+
+def exportar_arbol(ruta_arbol, destino):
+    """Copia compacta del árbol para llevarla a otro equipo y compararla allí."""
+    if os.path.exists(destino):
+        os.remove(destino)
+    conexion = sqlite3.connect(f"file:{ruta_arbol}?mode=ro", uri=True)
+    try:
+        conexion.execute("VACUUM INTO ?", (destino,))
+    finally:
+        conexion.close()
+
+
+def _hijos(conexion, ruta):
+    filas = conexion.execute("SELECT nombre, tipo, hash, modo FROM nodos WHERE padre IN (?, ?)", _claves(ruta))
+    return {os.fsdecode(nombre): (tipo, digest, modo) for nombre, tipo, digest, modo in filas}
+
+
+def comparar_arboles(ruta_origen, ruta_destino, al_cambio=None):
+    """Diferencias entre dos árboles de Merkle (``origen`` es la referencia).
+
+    Solo se desciende por los directorios cuyo hash difiere, así que el
+    coste es proporcional a los cambios (y a la profundidad a la que
+    están), no al número total de archivos. Cada cambio (``anadido``,
+    ``eliminado``, ``modificado``, ``permisos`` o ``tipo``) se entrega a
+    ``al_cambio``. Devuelve los cambios y el número de nodos visitados.
+    """
+    origen = sqlite3.connect(f"file:{ruta_origen}?mode=ro", uri=True)
+    destino = sqlite3.connect(f"file:{ruta_destino}?mode=ro", uri=True)
+    cambios = []
+    visitados = 0
+
+    def anotar(ruta, tipo, **datos):
+        cambio = {"ruta": ruta or ".", "tipo": tipo, **datos}
+        cambios.append(cambio)
+        if al_cambio:
+            al_cambio(cambio)
+
+    try:
+        consulta = "SELECT hash, modo FROM nodos WHERE ruta IN (?, ?)"
+        raiz_origen = origen.execute(consulta, _claves("")).fetchone()
+        raiz_destino = destino.execute(consulta, _claves("")).fetchone()
+        pila = [""] if raiz_origen != raiz_destino else []
+        if raiz_origen is not None and raiz_destino is not None and raiz_origen[1] != raiz_destino[1]:
+            anotar("", "permisos", modo_original=stat.filemode(stat.S_IFDIR | raiz_origen[1]),
+                   modo_actual=stat.filemode(stat.S_IFDIR | raiz_destino[1]))
+        while pila:
+            directorio = pila.pop()
+            hijos_origen = _hijos(origen, directorio)
+            hijos_destino = _hijos(destino, directorio)
+            visitados += len(hijos_origen) + len(hijos_destino)
+            for nombre in sorted(hijos_origen.keys() | hijos_destino.keys()):
+                ruta = _unir(directorio, nombre)
+                anterior, actual = hijos_origen.get(nombre), hijos_destino.get(nombre)
+                if actual is None:
+                    anotar(ruta, "eliminado", nodo=anterior[0])
+                elif anterior is None:
+                    anotar(ruta, "anadido", nodo=actual[0])
+                elif anterior[0] != actual[0]:
+                    anotar(ruta, "tipo", tipo_original=anterior[0], tipo_actual=actual[0])
+                else:
+                    if anterior[1] != actual[1]:
+                        if actual[0] == "d":
+                            pila.append(ruta)
+                        else:
+                            anotar(ruta, "modificado", hash_original=anterior[1], hash_actual=actual[1])
+                    if anterior[2] != actual[2]:
+                        formato = _FORMATOS[actual[0]]
+                        anotar(ruta, "permisos", modo_original=stat.filemode(formato | anterior[2]),
+                               modo_actual=stat.filemode(formato | actual[2]))
+    finally:
+        origen.close()
+        destino.close()
+    return {"cambios": cambios, "nodos_visitados": visitados}
+
+
+def comparar_con_actual(ruta_arbol, raiz=None, al_cambio=None):
+    """Compara un árbol guardado con el estado actual de su directorio (u otro ``raiz``).
+
+    Se construye el árbol actual en un archivo temporal (los archivos sin
+    cambios salen de la caché de hashes) y se compara con el guardado.
+    """
+    raiz = raiz or leer_metadatos(ruta_arbol)["raiz"]
+    descriptor, temporal = tempfile.mkstemp(suffix=".sqlite")
+    os.close(descriptor)
+    try:
+        construccion = construir_arbol(raiz, temporal)
+        resultado = comparar_arboles(ruta_arbol, temporal, al_cambio)
+    finally:
+        os.remove(temporal)
+    resultado["construccion"] = construccion
+    return resultado
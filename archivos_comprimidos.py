@@ -0,0 +1,257 @@
+import bz2
+import gzip
+import io
+import lzma
+import os
+import tarfile
+import zipfile
+import zlib
+from contextlib import nullcontext
+
+from motor_hash import TAMANO_BUFFER, hash_stream
+
+
+MAX_PROFUNDIDAD = 3
+MAX_TOTAL_DESCOMPRIMIDO = 4 * 1024 * 1024 * 1024
+MAX_RATIO = 100
+MIN_BYTES_SIN_RATIO = 1024 * 1024
+MAX_ZIP_ANIDADO_EN_MEMORIA = 256 * 1024 * 1024
+SEPARADOR = "!"
+
+_MAGIAS = (
+    (b"PK\x03\x04", "zip"),
+    (b"PK\x05\x06", "zip"),
+    (b"\x1f\x8b", "gz"),
+    (b"BZh", "bz2"),
+    (b"\xfd7zXZ\x00", "xz"),
+)
+_DESCOMPRESORES = {"gz": lambda f: gzip.GzipFile(fileobj=f), "bz2": bz2.BZ2File, "xz": lzma.LZMAFile}
+# zlib.error: datos gzip/deflate dañados; NotImplementedError: método de compresión de zip no soportado
+_ERRORES_CONTENEDOR = (tarfile.TarError, zipfile.BadZipFile, EOFError, lzma.LZMAError, OSError, zlib.error,
+                       NotImplementedError)
+
+
+class LimiteExcedido(ValueError):
+    """Se ha superado un límite de tamaño o de ratio de compresión."""
+
+
+class Limites:
+    """Límites y contador de bytes descomprimidos de todo un análisis."""
+
+    def __init__(self, profundidad=MAX_PROFUNDIDAD, total=MAX_TOTAL_DESCOMPRIMIDO, ratio=MAX_RATIO):
+        self.profundidad = profundidad
+        self.total = total
+        self.ratio = ratio
+        self.descomprimido = 0
+
+    def consumir(self, nuevos, leidos, comprimidos):
+        self.descomprimido += nuevos
+        if self.descomprimido > self.total:
+            raise LimiteExcedido(f"se superó el máximo de {self.total} bytes descomprimidos")
+        if leidos > max(MIN_BYTES_SIN_RATIO, comprimidos() * self.ratio):
+            raise LimiteExcedido(f"ratio de compresión superior a {self.ratio}:1 (posible bomba de descompresión)")
+
+
+def detectar_tipo(cabecera):
+    """Tipo de contenedor a partir de los primeros bytes (o None)."""
+    for magia, tipo in _MAGIAS:
+        if cabecera.startswith(magia):
+            return tipo
+    if len(cabecera) >= 262 and cabecera[257:262] == b"ustar":
+        return "tar"
+    return None
+
+
+def es_archivo_comprimido(path):
+    with open(path, "rb") as f:
+        return detectar_tipo(f.read(512)) is not None
+
+
+class _Contador:
+    """Envuelve un objeto binario contando los bytes (comprimidos) leídos."""
+
+    def __init__(self, f):
+        self.f = f
+        self.leidos = 0
+
+    def read(self, n=-1):
+        datos = self.f.read(n)
+        self.leidos += len(datos)
+        return datos
+
+
+class _Stream:
+    """Lector que antepone una cabecera ya leída y, opcionalmente, aplica límites.
+
+    Con ``limites`` cada byte leído cuenta como descomprimido y la lectura
+    se aborta en cuanto se supera el total o el ratio frente a
+    ``comprimidos()``, sin llegar a descomprimir el resto.
+    """
+
+    def __init__(self, f, cabecera=b"", limites=None, comprimidos=None):
+        self.f = f
+        self.cabecera = cabecera
+        self.limites = limites
+        self.comprimidos = comprimidos
+        self.leidos = 0
+
+    def read(self, n=-1):
+        if self.cabecera:
+            datos, self.cabecera = self.cabecera, b""
+            if n is not None and 0 <= n < len(datos):
+                datos, self.cabecera = datos[:n], datos[n:]
+        else:
+            datos = self.f.read(n)
+        self.leidos += len(datos)
+        if self.limites is not None:
+            self.limites.consumir(len(datos), self.leidos, self.comprimidos)
+        return datos
+
+
+def _leer_cabecera(f):
+    cabecera = b""
+    while len(cabecera) < 512:
+        datos = f.read(512 - len(cabecera))
+        if not datos:
+            break
+        cabecera += datos
+    return cabecera
+
+
+def _analizar_stream(f, nombre, profundidad, contexto):
+    """Si ``f`` es un contenedor lo recorre; si no, hashea y escanea su contenido."""
+    cabecera = _leer_cabecera(f)
+    tipo = detectar_tipo(cabecera)
+    stream = _Stream(f, cabecera)
+    if tipo is not None and profundidad < contexto["limites"].profundidad:
+        try:
+            _recorrer_contenedor(stream, tipo, nombre, profundidad + 1, contexto)
+        except LimiteExcedido:
+            raise
+        except _ERRORES_CONTENEDOR as exc:
+            contexto["errores"].append({"ruta": nombre, "error": f"contenedor {tipo} no válido: {exc}"})
+        return
+    if tipo is not None:
+        contexto["alertas"].append(f"{nombre}: profundidad máxima alcanzada, se analiza sin abrir.")
+    _hashear_miembro(stream, nombre, contexto)
+
+
+def _hashear_miembro(stream, nombre, contexto):
+    automata = contexto["automata"]
+    escaneo = automata.nuevo_escaneo() if automata is not None else None
+    observadores = (escaneo,) if escaneo is not None else ()
+    calculo = hash_stream(stream, contexto["algoritmos"], TAMANO_BUFFER, observadores)
+    miembro = {"ruta": nombre, "hashes": calculo["hashes"], "bytes": calculo["bytes"]}
+    if escaneo is not None:
+        miembro["contenido"] = escaneo.resultado()
+    firmas = contexto["firmas"]
+    if firmas is not None:
+        for valor in calculo["hashes"].values():
+            descripcion = firmas.get(valor)
+            if descripcion is not None:
+                miembro["firma"] = descripcion
+                break
+    contexto["miembros"].append(miembro)
+    if miembro.get("firma") or miembro.get("contenido"):
+        contexto["detecciones"].append(miembro)
+
+
+def _recorrer_contenedor(stream, tipo, nombre, profundidad, contexto, ruta_disco=None):
+    if tipo == "zip":
+        _recorrer_zip(stream, nombre, profundidad, contexto, ruta_disco)
+        return
+    crudo = _Contador(stream)
+    descompresor = _DESCOMPRESORES.get(tipo)
+    with descompresor(crudo) if descompresor else nullcontext(crudo) as datos:
+        if descompresor:
+            datos = _Stream(datos, limites=contexto["limites"], comprimidos=lambda: crudo.leidos)
+        cabecera = _leer_cabecera(datos)
+        interior = _Stream(datos, cabecera)
+        if detectar_tipo(cabecera) == "tar":
+            with tarfile.open(fileobj=interior, mode="r|") as tar:
+                for info in tar:
+                    if info.isfile():
+                        miembro = tar.extractfile(info)
+                        _analizar_stream(miembro, f"{nombre}{SEPARADOR}{info.name}", profundidad, contexto)
+        else:
+            # Un único fichero comprimido (p. ej. muestra.exe.gz)
+            sufijo = "." + tipo
+            interno = nombre[:-len(sufijo)] if nombre.endswith(sufijo) else nombre + ".contenido"
+            _analizar_stream(interior, f"{nombre}{SEPARADOR}{os.path.basename(interno)}", profundidad, contexto)
+
+
+def _recorrer_zip(stream, nombre, profundidad, contexto, ruta_disco=None):
+    # zipfile necesita poder hacer seek: el zip de primer nivel se abre desde
+    # disco y los anidados se cargan en memoria (con un tamaño acotado).
+    if ruta_disco is not None:
+        origen = ruta_disco
+    else:
+        contenido = bytearray()
+        while True:
+            bloque = stream.read(TAMANO_BUFFER)
+            if not bloque:
+                break
+            contenido += bloque
+            if len(contenido) > MAX_ZIP_ANIDADO_EN_MEMORIA:
+                raise LimiteExcedido("zip anidado demasiado grande para analizarlo en memoria")
+        origen = io.BytesIO(bytes(contenido))
+    limites = contexto["limites"]
+    with zipfile.ZipFile(origen) as zf:
+        for info in zf.infolist():
+            if info.is_dir():
+                continue
+            ruta = f"{nombre}{SEPARADOR}{info.filename}"
+            comprimido = max(info.compress_size, 1)
+            if info.file_size > MIN_BYTES_SIN_RATIO and info.file_size / comprimido > limites.ratio:
+                contexto["alertas"].append(f"{ruta}: ratio de compresión sospechoso, no se descomprime.")
+                continue
+            try:
+                with zf.open(info) as miembro:
+                    limitado = _Stream(miembro, limites=limites, comprimidos=lambda: comprimido)
+                    _analizar_stream(limitado, ruta, profundidad, contexto)
+            except (RuntimeError,) + _ERRORES_CONTENEDOR as exc:
+                # Miembros cifrados con contraseña, dañados o con compresión no soportada
+                contexto["errores"].append({"ruta": ruta, "error": str(exc)})
+
+
+def analizar_archivo_comprimido(path, algoritmos=("md5", "sha256"), firmas=None, automata=None, limites=None):
+    """Analiza en memoria los miembros de un tar, tar.gz/bz2/xz o zip.
+
+    Los contenedores anidados se abren recursivamente hasta la profundidad
+    máxima. Ningún miembro se escribe en disco: cada uno se hashea (y se
+    pasa por ``automata`` si se indica) mientras se descomprime, y se
+    compara con ``firmas``. El análisis se detiene si se supera el total
+    descomprimido o el ratio de compresión permitidos.
+    """
+    if not os.path.isfile(path):
+        raise FileNotFoundError("El archivo no existe.")
+    contexto = {
+        "algoritmos": tuple(algoritmos),
+        "firmas": firmas,
+        "automata": automata,
+        "limites": limites or Limites(),
+        "miembros": [],
+        "detecciones": [],
+        "alertas": [],
+        "errores": [],
+    }
+    with open(path, "rb") as f:
+        cabecera = _leer_cabecera(f)
+        tipo = detectar_tipo(cabecera)
+        if tipo is None:
+            raise ValueError("El archivo no es un contenedor tar/zip/gz/bz2/xz reconocido.")
+        try:
+            _recorrer_contenedor(_Stream(f, cabecera), tipo, os.path.basename(path), 1, contexto, ruta_disco=path)
+        except LimiteExcedido as exc:
+            contexto["alertas"].append(f"Análisis detenido: {exc}.")
+        except _ERRORES_CONTENEDOR as exc:
+            contexto["errores"].append({"ruta": path, "error": str(exc)})
+    return {
+        "tipo": tipo,
+        "bytes_comprimidos": os.path.getsize(path),
+        "bytes_descomprimidos": contexto["limites"].descomprimido,
+        "miembros": contexto["miembros"],
+        "detecciones": contexto["detecciones"],
+        "alertas": contexto["alertas"],
+        "errores": contexto["errores"],
+    }
@@ -0,0 +1,186 @@
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from cache_hashes import clave_stat
+from motor_hash import calcular_hashes
+
+
+ARCHIVOS_POR_LOTE = 64
+BYTES_POR_LOTE = 64 * 1024 * 1024
+
+
+def recorrer_archivos(raiz, errores=None, descartar=None):
+    """Genera (ruta, stat) de todos los ficheros regulares bajo ``raiz``.
+
+    Usa ``os.scandir`` con una pila explícita (sin recursión) y no sigue
+    enlaces simbólicos. Los directorios ilegibles se anotan en ``errores``
+    y los subdirectorios para los que ``descartar(ruta)`` es cierto no se
+    recorren.
+    """
+    pendientes = [raiz]
+    while pendientes:
+        directorio = pendientes.pop()
+        try:
+            with os.scandir(directorio) as entradas:
+                for entrada in entradas:
+                    try:
+                        if entrada.is_dir(follow_symlinks=False):
+                            if descartar is None or not descartar(entrada.path):
+                                pendientes.append(entrada.path)
+                        elif entrada.is_file(follow_symlinks=False):
+                            yield entrada.path, entrada.stat(follow_symlinks=False)
+                    except OSError as exc:
+                        if errores is not None:
+                            errores.append({"ruta": entrada.path, "error": str(exc)})
+        except OSError as exc:
+            if errores is not None:
+                errores.append({"ruta": directorio, "error": str(exc)})
+
+
+def agrupar_en_lotes(archivos, algoritmos=(), cache=None, max_archivos=ARCHIVOS_POR_LOTE, max_bytes=BYTES_POR_LOTE,
+                     sin_cache=None):
+    """Agrupa rutas en lotes para repartir el trabajo sin saturar la IPC.
+
+    Genera tuplas ``("hashear", rutas)``. Si se indica ``cache``, los
+    ficheros sin cambios se resuelven aquí mismo y se entregan como
+    ``("resuelto", resultados)`` sin pasar por el pool, salvo aquellos
+    para los que ``sin_cache(stat)`` es cierto.
+    """
+    lote, bytes_lote = [], 0
+    for ruta, st in archivos:
+        if cache is not None and (sin_cache is None or not sin_cache(st)):
+            digests = cache.obtener(clave_stat(st), algoritmos)
+            if digests is not None:
+                yield "resuelto", [{"ruta": ruta, "hashes": digests, "bytes": st.st_size, "cache": True}]
+                continue
+        lote.append(ruta)
+        bytes_lote += st.st_size
+        if len(lote) >= max_archivos or bytes_lote >= max_bytes:
+            yield "hashear", lote
+            lote, bytes_lote = [], 0
+    if lote:
+        yield "hashear", lote
+
+
+def hashear_lote(rutas, algoritmos):
+    """Calcula los hashes de un lote de ficheros (se ejecuta en un proceso hijo).
+
+    Cada resultado incluye la clave de metadatos del fichero solo si no
+    cambió durante la lectura, para que pueda guardarse en la caché.
+    """
+    resultados = []
+    for ruta in rutas:
+        try:
+            clave = clave_stat(os.stat(ruta))
+            calculo = calcular_hashes(ruta, algoritmos)
+            resultado = {"ruta": ruta, "hashes": calculo["hashes"], "bytes": calculo["bytes"]}
+            if clave_stat(os.stat(ruta)) == clave:
+                resultado["clave"] = clave
+            resultados.append(resultado)
+        except OSError as exc:
+            resultados.append({"ruta": ruta, "error": str(exc)})
+    return resultados
+
+
+def buscar_firma(hashes, firmas):
+    """Devuelve (algoritmo, hash, descripción) si algún digest está en ``firmas``."""
+    for algoritmo, valor in hashes.items():
+        descripcion = firmas.get(valor)
+        if descripcion is not None:
+            return algoritmo, valor, descripcion
+    return None
+
+
+def mapear_lotes(lotes, algoritmos, procesos, hashear=hashear_lote):
+    """Reparte los lotes en un pool de procesos y los devuelve según terminan.
+
+    Mantiene un número acotado de lotes en vuelo para que el recorrido del
+    árbol (E/S de metadatos) se solape con el cálculo de hashes. ``hashear``
+    procesa cada lote en el proceso hijo (debe poder serializarse con pickle).
+    """
+    if procesos == 1:
+        for tipo, lote in lotes:
+            yield lote if tipo == "resuelto" else hashear(lote, algoritmos)
+        return
+    with ProcessPoolExecutor(max_workers=procesos) as pool:
+        max_en_vuelo = procesos * 4
+        en_vuelo = set()
+        for tipo, lote in lotes:
+            if tipo == "resuelto":
+                yield lote
+                continue
+            en_vuelo.add(pool.submit(hashear, lote, algoritmos))
+            if len(en_vuelo) >= max_en_vuelo:
+                terminados, en_vuelo = wait(en_vuelo, return_when=FIRST_COMPLETED)
+                for futuro in terminados:
+                    yield futuro.result()
+        while en_vuelo:
+            terminados, en_vuelo = wait(en_vuelo, return_when=FIRST_COMPLETED)
+            for futuro in terminados:
+                yield futuro.result()
+
+
+def barrido_malware_core(raiz, firmas, algoritmos=("md5", "sha256"), procesos=None, al_resultado=None, cache=None):
+    """Recorre ``raiz`` recursivamente y compara cada fichero con ``firmas``.
+
+    ``firmas`` es cualquier objeto con ``get(hash)`` que devuelva una
+    descripción o ``None`` (por ejemplo ``HASHES_MALICIOSOS``). Con ``cache``
+    (una ``CacheHashes``) los ficheros que no han cambiado desde el último
+    barrido no se vuelven a leer. Cada resultado se entrega a
+    ``al_resultado`` en cuanto está disponible. Devuelve un resumen con las
+    detecciones, errores y el rendimiento en ficheros/s y MB/s.
+    """
+    if not os.path.isdir(raiz):
+        raise NotADirectoryError("El directorio a analizar no existe.")
+    procesos = procesos or os.cpu_count() or 1
+    algoritmos = tuple(algoritmos)
+    errores, detecciones = [], []
+    archivos, total_bytes, bytes_leidos, cacheados = 0, 0, 0, 0
+    inicio = time.perf_counter()
+
+    lotes = agrupar_en_lotes(recorrer_archivos(raiz, errores), algoritmos, cache)
+    for resultados in mapear_lotes(lotes, algoritmos, procesos):
+        for resultado in resultados:
+            if "error" in resultado:
+                errores.append(resultado)
+            else:
+                archivos += 1
+                total_bytes += resultado["bytes"]
+                if resultado.get("cache"):
+                    cacheados += 1
+                else:
+                    bytes_leidos += resultado["bytes"]
+                    if cache is not None and "clave" in resultado:
+                        cache.guardar(resultado.pop("clave"), resultado["hashes"])
+                coincidencia = buscar_firma(resultado["hashes"], firmas)
+                if coincidencia:
+                    algoritmo, valor, descripcion = coincidencia
+                    resultado["deteccion"] = {"algoritmo": algoritmo, "hash": valor, "descripcion": descripcion}
+                    detecciones.append(resultado)
+            if al_resultado:
+                al_resultado(resultado)
+
+    segundos = time.perf_counter() - inicio
+    return {
+        "archivos": archivos,
+        "bytes": total_bytes,
+        "bytes_leidos": bytes_leidos,
+        "cacheados": cacheados,
+        "detecciones": detecciones,
+        "errores": errores,
+        "segundos": segundos,
+        "archivos_s": archivos / segundos if segundos > 0 else 0.0,
+        "mb_s": total_bytes / (1024 * 1024) / segundos if segundos > 0 else 0.0,
+    }
+
+
+def formatear_resumen(resumen):
+    """Texto con el resumen final de un barrido."""
+    return (
+        f"{resumen['archivos']} archivos, {resumen['bytes'] / (1024 * 1024):.2f} MB en "
+        f"{resumen['segundos']:.2f} s ({resumen['archivos_s']:.1f} archivos/s, "
+        f"{resumen['mb_s']:.1f} MB/s, {resumen['cacheados']} desde caché). "
+        f"Detecciones: {len(resumen['detecciones'])}, "
+        f"errores: {len(resumen['errores'])}"
+    )
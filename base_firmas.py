@@ -0,0 +1,331 @@
+import csv
+import heapq
+import math
+import mmap
+import os
+import struct
+import tempfile
+
+
+DIRECTORIO_FIRMAS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "firmas_db")
+ALGORITMOS_POR_LONGITUD = {32: "md5", 40: "sha1", 64: "sha256"}
+LONGITUD_DIGEST = {"md5": 16, "sha1": 20, "sha256": 32}
+REGISTROS_POR_TANDA = 500_000
+PROBABILIDAD_FALSO_POSITIVO = 0.01
+
+_ID = struct.Struct(">I")
+_OFFSET = struct.Struct(">Q")
+_CABECERA_BLOOM = struct.Struct(">QI")
+
+
+class FiltroBloom:
+    """Filtro de Bloom sobre digests ya uniformes (no necesita hashes extra).
+
+    Las posiciones se obtienen por doble hashing con los primeros 16 bytes
+    del digest, que ya se comportan como valores aleatorios.
+    """
+
+    def __init__(self, bits, num_hashes, datos=None):
+        self.bits = bits
+        self.num_hashes = num_hashes
+        self.datos = datos if datos is not None else bytearray((bits + 7) // 8)
+
+    @classmethod
+    def para(cls, elementos, probabilidad=PROBABILIDAD_FALSO_POSITIVO):
+        elementos = max(elementos, 1)
+        bits = max(64, int(-elementos * math.log(probabilidad) / (math.log(2) ** 2)))
+        num_hashes = max(1, round(bits / elementos * math.log(2)))
+        return cls(bits, num_hashes)
+
+    def _posiciones(self, digest):
+        h1 = int.from_bytes(digest[:8], "big")
+        h2 = int.from_bytes(digest[8:16], "big") | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.bits
+
+    def anadir(self, digest):
+        for posicion in self._posiciones(digest):
+            self.datos[posicion >> 3] |= 1 << (posicion & 7)
+
+    def __contains__(self, digest):
+        datos = self.datos
+        return all(datos[p >> 3] & (1 << (p & 7)) for p in self._posiciones(digest))
+
+    def guardar(self, ruta):
+        with open(ruta, "wb") as f:
+            f.write(_CABECERA_BLOOM.pack(self.bits, self.num_hashes))
+            f.write(self.datos)
+
+
+def _abrir_mmap(ruta):
+    """Abre un fichero en modo solo lectura con mmap (None si está vacío)."""
+    if not os.path.exists(ruta) or os.path.getsize(ruta) == 0:
+        return None
+    with open(ruta, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class BaseFirmas:
+    """Base de hashes maliciosos en disco consultada mediante mmap.
+
+    Cada algoritmo tiene un fichero de registros de ancho fijo
+    (digest + id de descripción) ordenados por digest, de modo que la
+    búsqueda es binaria sobre el mmap y solo se tocan las páginas
+    necesarias. Un filtro de Bloom descarta casi todos los hashes limpios
+    sin acceder a los registros. ``extra`` permite añadir firmas en memoria
+    (por ejemplo, la de EICAR) que se consultan primero.
+    """
+
+    def __init__(self, directorio=DIRECTORIO_FIRMAS, extra=None):
+        self.directorio = directorio
+        self.extra = extra or {}
+        self._registros = {}
+        for algoritmo in LONGITUD_DIGEST:
+            datos = _abrir_mmap(os.path.join(directorio, f"{algoritmo}.bin"))
+            if datos is not None:
+                self._registros[algoritmo] = datos
+        self._descripciones = _abrir_mmap(os.path.join(directorio, "descripciones.dat"))
+        self._indice_descripciones = _abrir_mmap(os.path.join(directorio, "descripciones.idx"))
+        self._bloom = None
+        self._bloom_mmap = _abrir_mmap(os.path.join(directorio, "bloom.bin"))
+        if self._bloom_mmap is not None:
+            bits, num_hashes = _CABECERA_BLOOM.unpack_from(self._bloom_mmap, 0)
+            self._bloom_vista = memoryview(self._bloom_mmap)
+            self._bloom = FiltroBloom(bits, num_hashes, self._bloom_vista[_CABECERA_BLOOM.size:])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cerrar()
+
+    def cerrar(self):
+        if self._bloom is not None:
+            self._bloom.datos.release()
+            self._bloom_vista.release()
+            self._bloom = None
+        mapas = list(self._registros.values())
+        mapas += [self._descripciones, self._indice_descripciones, self._bloom_mmap]
+        for datos in mapas:
+            if datos is not None:
+                datos.close()
+        self._registros = {}
+
+    def __len__(self):
+        return sum(self.total(algoritmo) for algoritmo in self._registros)
+
+    def total(self, algoritmo):
+        datos = self._registros.get(algoritmo)
+        if datos is None:
+            return 0
+        return len(datos) // (LONGITUD_DIGEST[algoritmo] + _ID.size)
+
+    def _buscar_registro(self, algoritmo, digest):
+        datos = self._registros.get(algoritmo)
+        if datos is None:
+            return None
+        ancho = LONGITUD_DIGEST[algoritmo] + _ID.size
+        bajo, alto = 0, len(datos) // ancho
+        while bajo < alto:
+            medio = (bajo + alto) // 2
+            inicio = medio * ancho
+            actual = datos[inicio:inicio + len(digest)]
+            if actual < digest:
+                bajo = medio + 1
+            elif actual > digest:
+                alto = medio
+            else:
+                return _ID.unpack_from(datos, inicio + len(digest))[0]
+        return None
+
+    def _descripcion(self, identificador):
+        if self._descripciones is None or self._indice_descripciones is None:
+            return ""
+        inicio = _OFFSET.unpack_from(self._indice_descripciones, identificador * _OFFSET.size)[0]
+        fin = self._descripciones.find(b"\n", inicio)
+        return self._descripciones[inicio:fin].decode("utf-8")
+
+    def get(self, hash_hex, default=None):
+        """Devuelve la descripción del hash o ``default`` si no es conocido."""
+        if hash_hex in self.extra:
+            return self.extra[hash_hex]
+        algoritmo = ALGORITMOS_POR_LONGITUD.get(len(hash_hex))
+        if algoritmo is None:
+            return default
+        try:
+            digest = bytes.fromhex(hash_hex)
+        except ValueError:
+            return default
+        if self._bloom is not None and digest not in self._bloom:
+            return default
+        identificador = self._buscar_registro(algoritmo, digest)
+        if identificador is None:
+            return default
+        return self._descripcion(identificador)
+
+    def __contains__(self, hash_hex):
+        return self.get(hash_hex) is not None
+
+
+class FirmasEnMemoria(dict):
+    """Firmas sueltas (hash -> descripción) que se usan como una BaseFirmas, también con ``with``."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cerrar()
+
+    def cerrar(self):
+        pass
+
+
+def abrir_firmas(directorio=DIRECTORIO_FIRMAS, extra=None):
+    """Abre la base en disco si existe; si no, devuelve solo las firmas ``extra``.
+
+    En ambos casos el resultado se puede usar con ``with`` para cerrarlo.
+    """
+    if os.path.isdir(directorio):
+        return BaseFirmas(directorio, extra)
+    return FirmasEnMemoria(extra or {})
+
+
+def _leer_registros(ruta, ancho, registros_por_bloque=32768):
+    """Genera los registros de ancho fijo de un fichero leyendo en bloques grandes."""
+    with open(ruta, "rb") as f:
+        while True:
+            bloque = f.read(ancho * registros_por_bloque)
+            if not bloque:
+                return
+            for inicio in range(0, len(bloque) - ancho + 1, ancho):
+                yield bloque[inicio:inicio + ancho]
+
+
+def _volcar_tanda(registros, directorio_temporal):
+    registros.sort()
+    descriptor, ruta = tempfile.mkstemp(dir=directorio_temporal, suffix=".run")
+    with os.fdopen(descriptor, "wb") as f:
+        f.write(b"".join(registros))
+    registros.clear()
+    return ruta
+
+
+def importar_firmas(pares, directorio=DIRECTORIO_FIRMAS, registros_por_tanda=REGISTROS_POR_TANDA):
+    """Importa pares (hash hexadecimal, descripción) en la base de firmas.
+
+    Funciona en streaming con ordenación externa: los registros se ordenan
+    en tandas acotadas que se vuelcan a disco y se fusionan con
+    ``heapq.merge`` junto con la base existente, así que la memoria no
+    depende del tamaño del feed. Los duplicados conservan la primera
+    descripción. Devuelve el número de firmas añadidas e ignoradas.
+    """
+    os.makedirs(directorio, exist_ok=True)
+    ruta_dat = os.path.join(directorio, "descripciones.dat")
+    ruta_idx = os.path.join(directorio, "descripciones.idx")
+    siguiente_id = os.path.getsize(ruta_idx) // _OFFSET.size if os.path.exists(ruta_idx) else 0
+    offset = os.path.getsize(ruta_dat) if os.path.exists(ruta_dat) else 0
+
+    tandas = {algoritmo: [] for algoritmo in LONGITUD_DIGEST}
+    pendientes = {algoritmo: [] for algoritmo in LONGITUD_DIGEST}
+    ids_descripcion = {}
+    leidas, ignoradas = 0, 0
+
+    with tempfile.TemporaryDirectory(dir=directorio) as temporal:
+        with open(ruta_dat, "ab") as dat, open(ruta_idx, "ab") as idx:
+            for hash_hex, descripcion in pares:
+                hash_hex = hash_hex.strip().lower()
+                algoritmo = ALGORITMOS_POR_LONGITUD.get(len(hash_hex))
+                try:
+                    digest = bytes.fromhex(hash_hex) if algoritmo else None
+                except ValueError:
+                    digest = None
+                if digest is None:
+                    ignoradas += 1
+                    continue
+                descripcion = " ".join(descripcion.split()) or "Firma sin descripción"
+                identificador = ids_descripcion.get(descripcion)
+                if identificador is None:
+                    codificada = descripcion.encode("utf-8") + b"\n"
+                    dat.write(codificada)
+                    idx.write(_OFFSET.pack(offset))
+                    identificador = siguiente_id
+                    offset += len(codificada)
+                    siguiente_id += 1
+                    # Solo se deduplican descripciones mientras el dict sea pequeño
+                    if len(ids_descripcion) < 100_000:
+                        ids_descripcion[descripcion] = identificador
+                tanda = tandas[algoritmo]
+                tanda.append(digest + _ID.pack(identificador))
+                leidas += 1
+                if len(tanda) >= registros_por_tanda:
+                    pendientes[algoritmo].append(_volcar_tanda(tanda, temporal))
+
+        for algoritmo, tanda in tandas.items():
+            if tanda:
+                pendientes[algoritmo].append(_volcar_tanda(tanda, temporal))
+
+        # El filtro se dimensiona con una cota superior (existentes + nuevas)
+        rutas = {algoritmo: os.path.join(directorio, f"{algoritmo}.bin") for algoritmo in LONGITUD_DIGEST}
+        estimadas = leidas
+        for algoritmo, ruta_final in rutas.items():
+            if os.path.exists(ruta_final):
+                estimadas += os.path.getsize(ruta_final) // (LONGITUD_DIGEST[algoritmo] + _ID.size)
+        filtro = FiltroBloom.para(estimadas)
+
+        total = 0
+        nuevos = []
+        for algoritmo, ancho_digest in LONGITUD_DIGEST.items():
+            ancho = ancho_digest + _ID.size
+            ruta_final = rutas[algoritmo]
+            fuentes = []
+            if os.path.exists(ruta_final):
+                fuentes.append(_leer_registros(ruta_final, ancho))
+            if not pendientes[algoritmo]:
+                for fuente in fuentes:
+                    for registro in fuente:
+                        filtro.anadir(registro[:ancho_digest])
+                        total += 1
+                continue
+            fuentes.extend(_leer_registros(ruta, ancho) for ruta in pendientes[algoritmo])
+            ruta_nueva = ruta_final + ".tmp"
+            anterior = None
+            with open(ruta_nueva, "wb", buffering=1024 * 1024) as salida:
+                for registro in heapq.merge(*fuentes):
+                    digest = registro[:ancho_digest]
+                    if digest == anterior:
+                        continue
+                    anterior = digest
+                    salida.write(registro)
+                    filtro.anadir(digest)
+                    total += 1
+            nuevos.append((ruta_nueva, ruta_final))
+        # El filtro nuevo cubre los registros viejos y los nuevos, así que se publica antes que ellos:
+        # si el proceso se corta a medias, el filtro nunca descarta un hash que sí está en un .bin
+        ruta_bloom = os.path.join(directorio, "bloom.bin")
+        filtro.guardar(ruta_bloom + ".tmp")
+        os.replace(ruta_bloom + ".tmp", ruta_bloom)
+        for ruta_nueva, ruta_final in nuevos:
+            os.replace(ruta_nueva, ruta_final)
+
+    return {"importadas": leidas, "ignoradas": ignoradas, "total": total}
+
+
+def leer_csv_firmas(ruta_csv, columna_hash=0, columna_descripcion=1):
+    """Genera pares (hash, descripción) de un feed CSV sin cargarlo entero.
+
+    Se ignoran las líneas de comentario (``#``) y las filas incompletas.
+    """
+    with open(ruta_csv, "r", encoding="utf-8", errors="ignore", newline="") as f:
+        lineas = (linea for linea in f if not linea.lstrip().startswith("#"))
+        for fila in csv.reader(lineas, skipinitialspace=True):
+            if len(fila) <= columna_hash:
+                continue
+            descripcion = fila[columna_descripcion] if len(fila) > columna_descripcion else ""
+            yield fila[columna_hash], descripcion
+
+
+def importar_csv_core(ruta_csv, directorio=DIRECTORIO_FIRMAS, columna_hash=0, columna_descripcion=1):
+    """Importa un feed CSV de hashes maliciosos en la base de firmas."""
+    if not os.path.isfile(ruta_csv):
+        raise FileNotFoundError("El archivo no existe.")
+    return importar_firmas(leer_csv_firmas(ruta_csv, columna_hash, columna_descripcion), directorio)
@@ -0,0 +1,317 @@
+import math
+import multiprocessing
+import os
+import platform
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import cryptography
+from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
+from cryptography.hazmat.primitives.hmac import HMAC
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+ALGORITMOS = ("fernet", "aes-256-gcm", "chacha20-poly1305", "aes-ctr-hmac")
+MODOS = ("bloque", "trozos")
+OPERACIONES = ("cifrar", "descifrar")
+TAMANOS_POR_DEFECTO = (1024, 64 * 1024, 1024 * 1024, 64 * 1024 * 1024, 1024 * 1024 * 1024)
+TAMANO_TROZO = 1024 * 1024
+# Cada medida procesa al menos estos bytes (repitiendo los mensajes pequeños)
+BYTES_POR_MEDIDA = 64 * 1024 * 1024
+MAX_REPETICIONES = 100_000
+# Por encima de este tamaño no se cifra el mensaje entero de una vez salvo
+# que se pida: necesita varias veces su tamaño en memoria (unas 8 con Fernet)
+MAX_BLOQUE_COMPLETO = 256 * 1024 * 1024
+PERCENTILES = (50, 90, 99)
+_UNIDADES = {"": 1, "B": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+
+
+class _Fernet:
+    def __init__(self):
+        self._fernet = Fernet(Fernet.generate_key())
+
+    def cifrar(self, datos):
+        return self._fernet.encrypt(datos)
+
+    def descifrar(self, datos):
+        return self._fernet.decrypt(datos)
+
+
+class _Aead:
+    """AES-256-GCM o ChaCha20-Poly1305 con nonce aleatorio delante del texto cifrado."""
+
+    def __init__(self, clase):
+        self._aead = clase(os.urandom(32))
+
+    def cifrar(self, datos):
+        nonce = os.urandom(12)
+        return nonce + self._aead.encrypt(nonce, datos, None)
+
+    def descifrar(self, datos):
+        return self._aead.decrypt(datos[:12], datos[12:], None)
+
+
+class _CtrHmac:
+    """AES-256-CTR y HMAC-SHA256 (cifrar y luego autenticar), con claves independientes."""
+
+    def __init__(self):
+        self._clave = os.urandom(32)
+        self._clave_mac = os.urandom(32)
+
+    def _mac(self, datos):
+        mac = HMAC(self._clave_mac, hashes.SHA256())
+        mac.update(datos)
+        return mac
+
+    def cifrar(self, datos):
+        nonce = os.urandom(16)
+        cifrador = Cipher(algorithms.AES(self._clave), modes.CTR(nonce)).encryptor()
+        cifrado = nonce + cifrador.update(datos) + cifrador.finalize()
+        return cifrado + self._mac(cifrado).finalize()
+
+    def descifrar(self, datos):
+        vista = memoryview(datos)
+        self._mac(vista[:-32]).verify(bytes(vista[-32:]))
+        descifrador = Cipher(algorithms.AES(self._clave), modes.CTR(bytes(vista[:16]))).decryptor()
+        return descifrador.update(vista[16:-32]) + descifrador.finalize()
+
+
+def crear_cifrador(algoritmo):
+    if algoritmo == "fernet":
+        return _Fernet()
+    if algoritmo == "aes-256-gcm":
+        return _Aead(AESGCM)
+    if algoritmo == "chacha20-poly1305":
+        return _Aead(ChaCha20Poly1305)
+    if algoritmo == "aes-ctr-hmac":
+        return _CtrHmac()
+    raise ValueError(f"Algoritmo no soportado: {algoritmo}")
+
+
+def interpretar_tamano(texto):
+    """Convierte ``"64K"``, ``"1M"``, ``"4G"``... en bytes."""
+    texto = texto.strip().upper()
+    numero, unidad = texto[:-1], texto[-1:]
+    if unidad == "B" and numero[-1:] in ("K", "M", "G"):
+        numero, unidad = numero[:-1], numero[-1]
+    elif unidad not in _UNIDADES:
+        numero, unidad = texto, ""
+    try:
+        valor = float(numero) * _UNIDADES[unidad]
+    except ValueError:
+        raise ValueError(f"Tamaño no válido: {texto}") from None
+    if valor < 1:
+        raise ValueError(f"Tamaño no válido: {texto}")
+    return int(valor)
+
+
+def formatear_tamano(tamano):
+    for unidad in ("G", "M", "K"):
+        if tamano >= _UNIDADES[unidad] and tamano % _UNIDADES[unidad] == 0:
+            return f"{tamano // _UNIDADES[unidad]}{unidad}"
+    return f"{tamano}B"
+
+
+def _rss_pico_mb():
+    """Pico de memoria residente del proceso en MB (None si no se puede medir).
+
+    En Linux se lee VmHWM, que ``_reiniciar_pico`` puede bajar; en otros
+    sistemas ``ru_maxrss``, que solo crece.
+    """
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for linea in f:
+                if linea.startswith("VmHWM:"):
+                    return int(linea.split()[1]) / 1024
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux lo da en KB y macOS en bytes
+    return pico / (1024 * 1024) if sys.platform == "darwin" else pico / 1024
+
+
+def _reiniciar_pico():
+    """Hace que el pico vuelva a ser la memoria actual (solo Linux); False si no se puede."""
+    try:
+        with open("/proc/self/clear_refs", "w", encoding="ascii") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _percentil(ordenadas, p):
+    return ordenadas[min(len(ordenadas) - 1, max(0, math.ceil(p / 100 * len(ordenadas)) - 1))]
+
+
+def _cronometrar(operacion, datos):
+    inicio = time.perf_counter()
+    operacion(datos)
+    return time.perf_counter() - inicio
+
+
+def _ejecutar(operacion, unidades, hilos):
+    """Aplica ``operacion`` a cada unidad y devuelve (segundos totales, latencias).
+
+    Con varios hilos hay como mucho ``2 * hilos`` unidades en vuelo, así
+    que la memoria no depende del número de unidades.
+    """
+    latencias = []
+    inicio = time.perf_counter()
+    if hilos <= 1:
+        for datos in unidades:
+            latencias.append(_cronometrar(operacion, datos))
+    else:
+        with ThreadPoolExecutor(hilos) as pool:
+            en_vuelo = deque()
+            for datos in unidades:
+                en_vuelo.append(pool.submit(_cronometrar, operacion, datos))
+                if len(en_vuelo) >= 2 * hilos:
+                    latencias.append(en_vuelo.popleft().result())
+            latencias.extend(futuro.result() for futuro in en_vuelo)
+    return time.perf_counter() - inicio, latencias
+
+
+def _repetir(bloque, tamano):
+    """``tamano`` bytes repitiendo ``bloque`` (sin copia intermedia si el tamaño es múltiplo)."""
+    veces, resto = divmod(tamano, len(bloque))
+    return bloque * veces if not resto else bloque * veces + bloque[:resto]
+
+
+def _unidades(modo, tamano, tam_trozo, repeticiones, completo, ultimo):
+    """Genera los buffers a procesar: mensajes enteros o sus trozos, ``repeticiones`` veces."""
+    for _ in range(repeticiones):
+        if modo == "bloque":
+            yield completo
+            continue
+        for _ in range(tamano // tam_trozo):
+            yield completo
+        if ultimo is not None:
+            yield ultimo
+
+
+def medir_caso(algoritmo, modo, tamano, hilos=1, tam_trozo=TAMANO_TROZO, operaciones=OPERACIONES):
+    """Mide las ``operaciones`` (cifrado y/o descifrado) de un mensaje de ``tamano`` bytes.
+
+    En modo ``bloque`` cada mensaje se cifra de una vez (como hace Fernet
+    con un archivo entero); en modo ``trozos`` se cifra por trozos
+    independientes de ``tam_trozo`` bytes, en streaming, con memoria
+    acotada. Los mensajes pequeños se repiten hasta procesar al menos
+    BYTES_POR_MEDIDA. Las latencias son por mensaje o por trozo.
+
+    ``rss_pico_mb`` es el pico de memoria durante cada operación y
+    ``rss_extra_mb`` lo que sube respecto a la memoria con los datos de
+    entrada ya preparados. En Linux el pico se reinicia antes de cada
+    operación; en otros sistemas solo crece, así que al descifrar incluye
+    el cifrado previo y para separarlos hay que medir cada operación en un
+    proceso nuevo (ver ``ejecutar_benchmark``).
+    """
+    cifrador = crear_cifrador(algoritmo)
+    repeticiones = max(1, min(MAX_REPETICIONES, math.ceil(BYTES_POR_MEDIDA / tamano)))
+    bloque_aleatorio = os.urandom(min(tamano, TAMANO_TROZO))
+    if modo == "bloque":
+        completo = _repetir(bloque_aleatorio, tamano)
+        ultimo = None
+    else:
+        tam_trozo = min(tam_trozo, tamano)
+        completo = _repetir(bloque_aleatorio, tam_trozo)
+        ultimo = completo[:tamano % tam_trozo] if tamano % tam_trozo else None
+    resultados = []
+    for nombre in operaciones:
+        if nombre == "cifrar":
+            operacion = cifrador.cifrar
+        else:
+            # El texto cifrado se prepara después de medir el cifrado para no inflar su pico de memoria
+            operacion = cifrador.descifrar
+            completo = cifrador.cifrar(completo)
+            ultimo = cifrador.cifrar(ultimo) if ultimo is not None else None
+        _reiniciar_pico()
+        rss_base = _rss_pico_mb()
+        segundos, latencias = _ejecutar(
+            operacion, _unidades(modo, tamano, tam_trozo, repeticiones, completo, ultimo), hilos)
+        latencias.sort()
+        rss = _rss_pico_mb()
+        latencia_ms = {f"p{p}": _percentil(latencias, p) * 1000 for p in PERCENTILES}
+        latencia_ms["max"] = latencias[-1] * 1000
+        resultados.append({
+            "algoritmo": algoritmo,
+            "operacion": nombre,
+            "modo": modo,
+            "tamano": tamano,
+            "hilos": hilos,
+            "repeticiones": repeticiones,
+            "mb_s": tamano * repeticiones / (1024 * 1024) / segundos if segundos > 0 else 0.0,
+            "latencia_de": "mensaje" if modo == "bloque" else "trozo",
+            "latencia_ms": latencia_ms,
+            "rss_pico_mb": rss,
+            "rss_extra_mb": rss - rss_base if rss is not None else None,
+        })
+    return resultados
+
+
+def ejecutar_benchmark(algoritmos=ALGORITMOS, tamanos=TAMANOS_POR_DEFECTO, modos=MODOS, hilos=(1, None),
+                       tam_trozo=TAMANO_TROZO, max_bloque=MAX_BLOQUE_COMPLETO, aislar=True, al_resultado=None):
+    """Compara los algoritmos en todas las combinaciones de tamaño, modo e hilos.
+
+    ``hilos`` admite None para "uno por CPU"; el modo ``bloque`` con varios
+    hilos procesa varios mensajes a la vez. Con ``aislar`` el cifrado y el
+    descifrado de cada caso se ejecutan cada uno en un proceso nuevo para
+    que el pico de memoria sea solo suyo; sin él, fuera de Linux el pico
+    del descifrado es el acumulado del caso.
+    Los casos en modo ``bloque`` de más de ``max_bloque`` bytes se omiten.
+    Devuelve los datos de la máquina y la lista de resultados;
+    ``al_resultado`` se llama con cada uno según se obtiene.
+    """
+    cpus = os.cpu_count() or 1
+    hilos = sorted({n or cpus for n in hilos})
+    resultados, omitidos = [], []
+    contexto = multiprocessing.get_context("spawn")
+    for tamano in tamanos:
+        for modo in modos:
+            for n in hilos:
+                for algoritmo in algoritmos:
+                    caso = (algoritmo, modo, tamano, n, tam_trozo)
+                    if modo == "bloque" and tamano > max_bloque:
+                        omitidos.append({"algoritmo": algoritmo, "modo": modo, "tamano": tamano, "hilos": n})
+                        continue
+                    if aislar:
+                        medidas = []
+                        for operacion in OPERACIONES:
+                            with ProcessPoolExecutor(max_workers=1, mp_context=contexto) as pool:
+                                medidas += pool.submit(medir_caso, *caso, (operacion,)).result()
+                    else:
+                        medidas = medir_caso(*caso)
+                    for medida in medidas:
+                        resultados.append(medida)
+                        if al_resultado:
+                            al_resultado(medida)
+    return {
+        "maquina": {"cpus": cpus, "plataforma": platform.platform(), "python": platform.python_version(),
+                    "cryptography": cryptography.__version__},
+        "tam_trozo": tam_trozo,
+        "resultados": resultados,
+        "omitidos": omitidos,
+    }
+
+
+def formatear_tabla(resultados):
+    """Tabla de texto con una fila por medida."""
+    lineas = [f"{'Algoritmo':<18} {'Operación':<9} {'Modo':<6} {'Tamaño':>6} {'Hilos':>5} {'MB/s':>9} "
+              f"{'p50 ms':>9} {'p99 ms':>9} {'RSS MB':>8}"]
+    for r in resultados:
+        rss = f"{r['rss_pico_mb']:.0f}" if r["rss_pico_mb"] is not None else "-"
+        lineas.append(f"{r['algoritmo']:<18} {r['operacion']:<9} {r['modo']:<6} {formatear_tamano(r['tamano']):>6} "
+                      f"{r['hilos']:>5} {r['mb_s']:>9.1f} {r['latencia_ms']['p50']:>9.3f} "
+                      f"{r['latencia_ms']['p99']:>9.3f} {rss:>8}")
+    return "\n".join(lineas)
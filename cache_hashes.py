@@ -0,0 +1,193 @@
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from hash_similitud import ALGORITMO_SIMILITUD, MAX_BYTES_SIMILITUD, HashSimilitud
+from motor_hash import calcular_hashes
+
+
+RUTA_CACHE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache_hashes.sqlite")
+MAX_ENTRADAS = 1_000_000
+VENTANA_MTIME_NS = 2_000_000_000
+COMMIT_CADA = 500
+
+
+def clave_stat(st):
+    """Metadatos que identifican una versión concreta de un fichero."""
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns, st.st_ctime_ns)
+
+
+def es_cacheable(clave, ahora_ns=None):
+    """Un fichero modificado hace muy poco puede volver a cambiar sin que su
+    mtime avance (granularidad del sistema de ficheros), así que no se cachea."""
+    ahora_ns = ahora_ns if ahora_ns is not None else time.time_ns()
+    return ahora_ns - max(clave[3], clave[4]) > VENTANA_MTIME_NS
+
+
+class CacheHashes:
+    """Caché persistente (SQLite) de digests indexada por metadatos del fichero.
+
+    La entrada se localiza por (dispositivo, inodo) y solo es válida si el
+    tamaño, ``mtime_ns`` y ``ctime_ns`` coinciden; en otro caso se descarta y
+    se vuelve a calcular. Cuando se supera ``max_entradas`` se expulsan las
+    menos usadas recientemente (LRU).
+    """
+
+    def __init__(self, ruta=RUTA_CACHE, max_entradas=MAX_ENTRADAS):
+        self.ruta = ruta
+        self.max_entradas = max_entradas
+        self._lock = threading.Lock()
+        self._pendientes = 0
+        self._conexion = sqlite3.connect(ruta, check_same_thread=False)
+        self._conexion.execute("PRAGMA journal_mode=WAL")
+        self._conexion.execute("PRAGMA synchronous=NORMAL")
+        self._conexion.execute(
+            """CREATE TABLE IF NOT EXISTS hashes (
+                dispositivo INTEGER NOT NULL,
+                inodo INTEGER NOT NULL,
+                tamano INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                ctime_ns INTEGER NOT NULL,
+                digests TEXT NOT NULL,
+                ultimo_uso REAL NOT NULL,
+                PRIMARY KEY (dispositivo, inodo)
+            )"""
+        )
+        self._conexion.execute("CREATE INDEX IF NOT EXISTS idx_uso ON hashes (ultimo_uso)")
+        self.aciertos = 0
+        self.fallos = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cerrar()
+
+    def __len__(self):
+        with self._lock:
+            return self._conexion.execute("SELECT COUNT(*) FROM hashes").fetchone()[0]
+
+    def obtener(self, clave, algoritmos):
+        """Devuelve los digests guardados para ``clave`` o None si no sirven."""
+        dispositivo, inodo, tamano, mtime_ns, ctime_ns = clave
+        with self._lock:
+            fila = self._conexion.execute(
+                "SELECT tamano, mtime_ns, ctime_ns, digests FROM hashes WHERE dispositivo=? AND inodo=?",
+                (dispositivo, inodo),
+            ).fetchone()
+            if fila is None or fila[:3] != (tamano, mtime_ns, ctime_ns):
+                self.fallos += 1
+                return None
+            digests = json.loads(fila[3])
+            if any(algoritmo not in digests for algoritmo in algoritmos):
+                self.fallos += 1
+                return None
+            self._conexion.execute(
+                "UPDATE hashes SET ultimo_uso=? WHERE dispositivo=? AND inodo=?",
+                (time.time(), dispositivo, inodo),
+            )
+            self._anotar_cambio()
+            self.aciertos += 1
+            return {algoritmo: digests[algoritmo] for algoritmo in algoritmos}
+
+    def guardar(self, clave, digests):
+        """Guarda los digests calculados para la versión del fichero descrita por ``clave``."""
+        if not es_cacheable(clave):
+            return
+        dispositivo, inodo, tamano, mtime_ns, ctime_ns = clave
+        with self._lock:
+            fila = self._conexion.execute(
+                "SELECT tamano, mtime_ns, ctime_ns, digests FROM hashes WHERE dispositivo=? AND inodo=?",
+                (dispositivo, inodo),
+            ).fetchone()
+            if fila is not None and fila[:3] == (tamano, mtime_ns, ctime_ns):
+                digests = {**json.loads(fila[3]), **digests}
+            self._conexion.execute(
+                "INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (dispositivo, inodo, tamano, mtime_ns, ctime_ns, json.dumps(digests), time.time()),
+            )
+            self._anotar_cambio()
+
+    def invalidar(self, clave):
+        dispositivo, inodo = clave[0], clave[1]
+        with self._lock:
+            self._conexion.execute("DELETE FROM hashes WHERE dispositivo=? AND inodo=?", (dispositivo, inodo))
+            self._anotar_cambio()
+
+    def _anotar_cambio(self):
+        self._pendientes += 1
+        if self._pendientes >= COMMIT_CADA:
+            self._confirmar()
+
+    def _confirmar(self):
+        self._expulsar()
+        self._conexion.commit()
+        self._pendientes = 0
+
+    def _expulsar(self):
+        """Elimina las entradas menos usadas si se supera el tamaño máximo."""
+        total = self._conexion.execute("SELECT COUNT(*) FROM hashes").fetchone()[0]
+        sobrantes = total - self.max_entradas
+        if sobrantes > 0:
+            self._conexion.execute(
+                "DELETE FROM hashes WHERE rowid IN (SELECT rowid FROM hashes ORDER BY ultimo_uso LIMIT ?)",
+                (sobrantes,),
+            )
+
+    def vaciar(self):
+        with self._lock:
+            self._conexion.execute("DELETE FROM hashes")
+            self._conexion.commit()
+            self._pendientes = 0
+
+    def cerrar(self):
+        with self._lock:
+            if self._conexion is None:
+                return
+            self._confirmar()
+            self._conexion.close()
+            self._conexion = None
+
+
+_cache_por_defecto = None
+
+
+def cache_por_defecto():
+    """Caché compartida del proceso (se crea en el directorio de trabajo)."""
+    global _cache_por_defecto
+    if _cache_por_defecto is None:
+        _cache_por_defecto = CacheHashes()
+        atexit.register(_cache_por_defecto.cerrar)
+    return _cache_por_defecto
+
+
+def calcular_hashes_cacheado(path, algoritmos=("md5",), cache=None, observadores=(), similitud=False):
+    """Como ``calcular_hashes`` pero reutiliza digests de ficheros sin cambios.
+
+    Si hay ``observadores`` el fichero se lee siempre (necesitan ver el
+    contenido), aunque el resultado se sigue guardando. Si el fichero cambia
+    mientras se lee (su stat antes y después no coincide), el resultado se
+    devuelve pero no se guarda en la caché. Con ``similitud`` se añade la
+    firma ssdeep, calculada en la misma lectura (None si el fichero supera
+    ``MAX_BYTES_SIMILITUD``), y también se guarda en la caché.
+    """
+    cache = cache if cache is not None else cache_por_defecto()
+    algoritmos = tuple(algoritmos)
+    clave = clave_stat(os.stat(path))
+    buscados = algoritmos + (ALGORITMO_SIMILITUD,) if similitud else algoritmos
+    digests = None if observadores else cache.obtener(clave, buscados)
+    if digests is not None:
+        return {"hashes": digests, "bytes": 0, "segundos": 0.0, "mb_s": 0.0, "cache": True}
+    observador = HashSimilitud() if similitud and clave[2] <= MAX_BYTES_SIMILITUD else None
+    if observador is not None:
+        observadores = tuple(observadores) + (observador,)
+    resultado = calcular_hashes(path, algoritmos, observadores=observadores)
+    if similitud:
+        resultado["hashes"][ALGORITMO_SIMILITUD] = observador.digest() if observador is not None else None
+    if clave_stat(os.stat(path)) == clave:
+        cache.guardar(clave, resultado["hashes"])
+    resultado["cache"] = False
+    return resultado
@@ -0,0 +1,504 @@
+import base64
+import io
+import mmap
+import os
+import struct
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from derivacion_claves import PARAMETROS_KDF, ClaveFrase
+
+
+MAGIA = b"APSC"
+VERSION = 1
+VERSION_SOBRE = 2
+VERSION_FRASE = 3
+ALGORITMO_AES_GCM = 1
+TAMANO_TROZO = 1024 * 1024
+TAMANO_ETIQUETA = 16
+TAMANO_LECTURA = 4 * TAMANO_TROZO
+TROZOS_EN_CACHE = 8
+EXTENSION = ".enc"
+
+# Formato (versión 1):
+#   cabecera: magia, versión, algoritmo, tamaño de trozo y prefijo aleatorio
+#             de 7 bytes para los nonces
+#   trozos:   ``tam_trozo`` bytes cifrados más la etiqueta de 16; el último
+#             puede ser más corto (o vacío)
+# El nonce de cada trozo es prefijo + índice (4 bytes) + 1 si es el último,
+# y la cabecera se autentica como datos asociados en todos los trozos.
+#
+# En la versión 2 (cifrado de sobre) la cabecera lleva detrás un bloque de
+# tamaño fijo con el identificador de la clave de cifrado de claves (KEK)
+# y la clave de datos del archivo envuelta con ella. Los trozos solo
+# autentican la parte fija, así que cambiar de KEK reescribe ese bloque en
+# su sitio sin tocar los datos.
+#
+# En la versión 3 (frase de paso) el bloque lleva los parámetros de
+# derivación (ver derivacion_claves.PARAMETROS_KDF) y la clave de datos
+# envuelta con la clave derivada de la frase; la parte fija y los
+# parámetros se autentican al desenvolverla.
+_CABECERA = struct.Struct(">4sBBI7s")
+_BLOQUE_CLAVE = struct.Struct(">16s60s")
+_TAMANO_ENVUELTA = 60
+
+
+def generar_clave():
+    """Clave AES-256 aleatoria en base64 (mismo aspecto que una clave Fernet)."""
+    return base64.urlsafe_b64encode(os.urandom(32)).decode()
+
+
+def cargar_clave(clave):
+    """Convierte una clave en texto base64 (o bytes) en los 32 bytes de AES-256."""
+    try:
+        datos = base64.urlsafe_b64decode(clave.encode() if isinstance(clave, str) else clave)
+    except (ValueError, TypeError):
+        raise ValueError("La clave no es base64 válido.") from None
+    if len(datos) != 32:
+        raise ValueError("La clave debe tener 32 bytes.")
+    return datos
+
+
+def _es_almacen(clave):
+    """Las claves son texto o bytes y las frases, ClaveFrase; lo demás es un almacén de KEKs (ver almacen_claves)."""
+    return not isinstance(clave, (str, bytes, bytearray, ClaveFrase))
+
+
+def _envolver(kek, clave_datos, asociados):
+    nonce = os.urandom(12)
+    return nonce + AESGCM(kek).encrypt(nonce, clave_datos, asociados)
+
+
+def _desenvolver(kek, envuelta, asociados, error="La clave del almacén no abre la clave de datos del archivo."):
+    try:
+        return AESGCM(kek).decrypt(envuelta[:12], envuelta[12:], asociados)
+    except InvalidTag:
+        raise ValueError(error) from None
+
+
+def _crear_cabecera(clave, tam_trozo):
+    """Devuelve (cabecera, parte fija, prefijo de nonce, clave de datos) para un archivo nuevo.
+
+    Con un almacén se genera una clave de datos aleatoria y se guarda
+    envuelta con su KEK activa (versión 2) y con una frase de paso, con la
+    clave derivada de ella (versión 3); una clave se usa tal cual.
+    """
+    prefijo = os.urandom(7)
+    if isinstance(clave, ClaveFrase):
+        fija = _CABECERA.pack(MAGIA, VERSION_FRASE, ALGORITMO_AES_GCM, tam_trozo, prefijo)
+        parametros = clave.parametros()
+        clave_datos = os.urandom(32)
+        envuelta = _envolver(clave.derivar(parametros), clave_datos, fija + parametros)
+        return fija + parametros + envuelta, fija, prefijo, clave_datos
+    if not _es_almacen(clave):
+        fija = _CABECERA.pack(MAGIA, VERSION, ALGORITMO_AES_GCM, tam_trozo, prefijo)
+        return fija, fija, prefijo, cargar_clave(clave)
+    id_kek, kek = clave.activa()
+    fija = _CABECERA.pack(MAGIA, VERSION_SOBRE, ALGORITMO_AES_GCM, tam_trozo, prefijo)
+    clave_datos = os.urandom(32)
+    return fija + _BLOQUE_CLAVE.pack(id_kek, _envolver(kek, clave_datos, fija)), fija, prefijo, clave_datos
+
+
+def _leer_cabecera(leer, clave):
+    """Lee la cabecera con ``leer(n)``.
+
+    Devuelve (parte fija, tamaño de trozo, prefijo de nonce, clave de
+    datos, tamaño total de la cabecera).
+    """
+    fija = leer(_CABECERA.size)
+    if len(fija) < _CABECERA.size:
+        raise ValueError("No es un archivo cifrado válido.")
+    magia, version, algoritmo, tam_trozo, prefijo = _CABECERA.unpack(fija)
+    if magia != MAGIA:
+        raise ValueError("No es un archivo cifrado válido.")
+    if version not in (VERSION, VERSION_SOBRE, VERSION_FRASE) or algoritmo != ALGORITMO_AES_GCM:
+        raise ValueError(f"Versión de formato no soportada: {version}/{algoritmo}")
+    if version == VERSION:
+        if _es_almacen(clave) or isinstance(clave, ClaveFrase):
+            raise ValueError("El archivo se cifró con una clave: hace falta esa clave.")
+        return fija, tam_trozo, prefijo, cargar_clave(clave), _CABECERA.size
+    if version == VERSION_FRASE:
+        bloque = leer(PARAMETROS_KDF.size + _TAMANO_ENVUELTA)
+        if len(bloque) < PARAMETROS_KDF.size + _TAMANO_ENVUELTA:
+            raise ValueError("Archivo cifrado truncado.")
+        if not isinstance(clave, ClaveFrase):
+            raise ValueError("El archivo se cifró con una frase de paso: hace falta la frase.")
+        parametros = bloque[:PARAMETROS_KDF.size]
+        clave_datos = _desenvolver(clave.derivar(parametros), bloque[PARAMETROS_KDF.size:], fija + parametros,
+                                   "Frase de paso incorrecta o cabecera dañada.")
+        return fija, tam_trozo, prefijo, clave_datos, len(fija) + len(bloque)
+    bloque = leer(_BLOQUE_CLAVE.size)
+    if len(bloque) < _BLOQUE_CLAVE.size:
+        raise ValueError("Archivo cifrado truncado.")
+    if not _es_almacen(clave):
+        raise ValueError("El archivo se cifró con cifrado de sobre: hace falta el almacén de claves.")
+    id_kek, envuelta = _BLOQUE_CLAVE.unpack(bloque)
+    return fija, tam_trozo, prefijo, _desenvolver(clave.obtener(id_kek), envuelta, fija), len(fija) + len(bloque)
+
+
+def _nonce(prefijo, indice, final):
+    """Nonce de 12 bytes: prefijo del archivo, número de trozo y marca de último trozo."""
+    return prefijo + struct.pack(">IB", indice, 1 if final else 0)
+
+
+class EscritorCifrado:
+    """Archivo de solo escritura que cifra en trozos autenticados AES-256-GCM.
+
+    Tras una cabecera con los parámetros se escribe cada trozo de
+    ``tam_trozo`` bytes cifrado con su etiqueta. El nonce sale del índice
+    del trozo y de si es el último, y la cabecera se autentica con cada
+    trozo, así que reordenar, quitar o truncar trozos se detecta al
+    descifrar. ``close`` no cierra ``f``.
+
+    Con ``hilos`` > 1 los trozos se cifran en un pool de hilos (AESGCM
+    libera el GIL) y se escriben en orden; como mucho hay ``2 * hilos``
+    trozos en vuelo, así que la memoria sigue acotada.
+
+    ``clave`` es una clave (ver ``generar_clave``) o un almacén de claves;
+    con un almacén se usa cifrado de sobre.
+    """
+
+    def __init__(self, f, clave, tam_trozo=TAMANO_TROZO, hilos=1):
+        cabecera, self._cabecera, self._prefijo, clave_datos = _crear_cabecera(clave, tam_trozo)
+        self._aead = AESGCM(clave_datos)
+        self._f = f
+        self.tam_trozo = tam_trozo
+        self.bytes_entrada = 0
+        self.bytes_salida = 0
+        self.closed = False
+        self._indice = 0
+        self._buffer = bytearray()
+        self.hilos = hilos
+        self._en_vuelo = deque()
+        self._pool = ThreadPoolExecutor(hilos) if hilos > 1 else None
+        self._salida(cabecera)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, tipo, *exc):
+        if tipo is None:
+            self.close()
+        elif self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+
+    def _salida(self, datos):
+        self._f.write(datos)
+        self.bytes_salida += len(datos)
+
+    def _cifrar_trozo(self, datos, final):
+        nonce = _nonce(self._prefijo, self._indice, final)
+        self._indice += 1
+        if self._pool is None:
+            self._salida(self._aead.encrypt(nonce, datos, self._cabecera))
+            return
+        self._en_vuelo.append(self._pool.submit(self._aead.encrypt, nonce, datos, self._cabecera))
+        while len(self._en_vuelo) > 2 * self.hilos:
+            self._salida(self._en_vuelo.popleft().result())
+
+    def write(self, datos):
+        self.bytes_entrada += len(datos)
+        self._buffer += datos
+        # Se deja siempre algo en el buffer: el último trozo se cifra en close
+        while len(self._buffer) > self.tam_trozo:
+            self._cifrar_trozo(bytes(self._buffer[:self.tam_trozo]), False)
+            del self._buffer[:self.tam_trozo]
+        return len(datos)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._cifrar_trozo(bytes(self._buffer), True)
+        self._buffer.clear()
+        while self._en_vuelo:
+            self._salida(self._en_vuelo.popleft().result())
+        if self._pool is not None:
+            self._pool.shutdown()
+
+
+class LectorCifrado:
+    """Lectura en streaming de un archivo escrito por EscritorCifrado.
+
+    Cada trozo se autentica antes de entregar sus datos; si no se puede
+    (clave incorrecta, datos manipulados o archivo truncado) se lanza
+    ValueError. Con ``hilos`` > 1 se leen y descifran por adelantado hasta
+    ``2 * hilos`` trozos en un pool de hilos y se entregan en orden.
+    """
+
+    def __init__(self, f, clave, hilos=1):
+        self._f = f
+        self._cabecera, self.tam_trozo, self._prefijo, clave_datos, _ = _leer_cabecera(f.read, clave)
+        self._aead = AESGCM(clave_datos)
+        self._indice = 0
+        self._siguiente = self._leer_trozo()
+        self._leido_final = False
+        self._buffer = bytearray()
+        self._terminado = False
+        self.hilos = hilos
+        self._en_vuelo = deque()
+        self._pool = ThreadPoolExecutor(hilos) if hilos > 1 else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Detiene el pool de hilos (no cierra ``f``)."""
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+    def _leer_trozo(self):
+        return self._f.read(self.tam_trozo + TAMANO_ETIQUETA)
+
+    def _trozo_siguiente(self):
+        """(nonce, datos cifrados, es el último) del siguiente trozo, o None tras el último."""
+        if self._leido_final:
+            return None
+        actual = self._siguiente
+        if len(actual) < TAMANO_ETIQUETA:
+            raise ValueError("Archivo cifrado truncado.")
+        # Es el último si no queda nada detrás (se lee un trozo por adelantado)
+        self._siguiente = self._leer_trozo() if len(actual) == self.tam_trozo + TAMANO_ETIQUETA else b""
+        final = self._leido_final = not self._siguiente
+        nonce = _nonce(self._prefijo, self._indice, final)
+        self._indice += 1
+        return nonce, actual, final
+
+    def _descifrar(self, nonce, datos):
+        try:
+            return self._aead.decrypt(nonce, datos, self._cabecera)
+        except InvalidTag:
+            raise ValueError("Clave incorrecta o archivo cifrado dañado o truncado.") from None
+
+    def _descifrar_siguiente(self):
+        if self._pool is None:
+            nonce, datos, self._terminado = self._trozo_siguiente()
+            return self._descifrar(nonce, datos)
+        while len(self._en_vuelo) < 2 * self.hilos:
+            trozo = self._trozo_siguiente()
+            if trozo is None:
+                break
+            nonce, datos, final = trozo
+            self._en_vuelo.append((self._pool.submit(self._descifrar, nonce, datos), final))
+        futuro, self._terminado = self._en_vuelo.popleft()
+        datos = futuro.result()
+        if self._terminado:
+            self.close()
+        return datos
+
+    def read(self, n=-1):
+        while not self._terminado and (n < 0 or len(self._buffer) < n):
+            self._buffer += self._descifrar_siguiente()
+        if n < 0 or n >= len(self._buffer):
+            datos = bytes(self._buffer)
+            self._buffer.clear()
+            return datos
+        datos = bytes(self._buffer[:n])
+        del self._buffer[:n]
+        return datos
+
+
+class ArchivoCifradoAleatorio(io.RawIOBase):
+    """Archivo de solo lectura con acceso aleatorio sobre un archivo cifrado por trozos.
+
+    El cifrado se proyecta en memoria con mmap y ``read`` descifra solo los
+    trozos que cubren el rango pedido (su posición se calcula a partir del
+    índice, porque todos miden lo mismo salvo el último). Los últimos
+    ``cache_trozos`` trozos descifrados se guardan en una caché LRU. Al
+    abrir se autentica el último trozo, así que el tamaño es fiable aunque
+    el archivo se haya truncado. Envuelto en io.BufferedReader o
+    io.TextIOWrapper sirve a cualquier código que lea archivos.
+    """
+
+    def __init__(self, ruta, clave, cache_trozos=TROZOS_EN_CACHE):
+        super().__init__()
+        with open(ruta, "rb") as f:
+            if os.fstat(f.fileno()).st_size < _CABECERA.size + TAMANO_ETIQUETA:
+                raise ValueError("No es un archivo cifrado válido.")
+            self._mapa = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._cabecera, self.tam_trozo, self._prefijo, clave_datos, self._inicio = _leer_cabecera(
+                io.BytesIO(self._mapa[:_CABECERA.size + PARAMETROS_KDF.size + _TAMANO_ENVUELTA]).read, clave)
+            cuerpo = len(self._mapa) - self._inicio
+            paso = self.tam_trozo + TAMANO_ETIQUETA
+            self.trozos = -(-cuerpo // paso)
+            if cuerpo <= 0 or 0 < cuerpo % paso < TAMANO_ETIQUETA:
+                raise ValueError("Archivo cifrado truncado.")
+        except ValueError:
+            self._mapa.close()
+            raise
+        self._aead = AESGCM(clave_datos)
+        self.tamano = cuerpo - self.trozos * TAMANO_ETIQUETA
+        self.cache_trozos = cache_trozos
+        self.trozos_descifrados = 0
+        self._cache = OrderedDict()
+        self._posicion = 0
+        self._trozo(self.trozos - 1)
+
+    def _trozo(self, indice):
+        datos = self._cache.get(indice)
+        if datos is not None:
+            self._cache.move_to_end(indice)
+            return datos
+        inicio = self._inicio + indice * (self.tam_trozo + TAMANO_ETIQUETA)
+        cifrado = self._mapa[inicio:inicio + self.tam_trozo + TAMANO_ETIQUETA]
+        nonce = _nonce(self._prefijo, indice, indice == self.trozos - 1)
+        try:
+            datos = self._aead.decrypt(nonce, cifrado, self._cabecera)
+        except InvalidTag:
+            raise ValueError("Clave incorrecta o archivo cifrado dañado o truncado.") from None
+        self.trozos_descifrados += 1
+        self._cache[indice] = datos
+        if len(self._cache) > self.cache_trozos:
+            self._cache.popitem(last=False)
+        return datos
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._posicion
+
+    def seek(self, desplazamiento, desde=io.SEEK_SET):
+        if desde == io.SEEK_CUR:
+            desplazamiento += self._posicion
+        elif desde == io.SEEK_END:
+            desplazamiento += self.tamano
+        if desplazamiento < 0:
+            raise ValueError("Posición negativa.")
+        self._posicion = desplazamiento
+        return self._posicion
+
+    def readinto(self, buffer):
+        vista = memoryview(buffer).cast("B")
+        escritos = 0
+        while escritos < len(vista) and self._posicion < self.tamano:
+            indice, dentro = divmod(self._posicion, self.tam_trozo)
+            datos = self._trozo(indice)
+            n = min(len(vista) - escritos, len(datos) - dentro)
+            vista[escritos:escritos + n] = datos[dentro:dentro + n]
+            escritos += n
+            self._posicion += n
+        return escritos
+
+    def close(self):
+        if not self.closed:
+            self._mapa.close()
+            self._cache.clear()
+        super().close()
+
+
+def abrir_cifrado(ruta, clave, modo="rb", encoding="utf-8", errors="replace"):
+    """Abre un archivo cifrado por trozos para leerlo como si estuviera en claro (``rb`` o ``r``)."""
+    binario = io.BufferedReader(ArchivoCifradoAleatorio(ruta, clave), TAMANO_TROZO)
+    if modo == "rb":
+        return binario
+    if modo == "r":
+        return io.TextIOWrapper(binario, encoding=encoding, errors=errors)
+    raise ValueError(f"Modo no soportado: {modo}")
+
+
+def es_cifrado_por_trozos(ruta):
+    """Indica si ``ruta`` empieza con la cabecera de este formato."""
+    with open(ruta, "rb") as f:
+        return f.read(len(MAGIA)) == MAGIA
+
+
+def version_cifrado(ruta):
+    """Versión del formato por trozos de ``ruta`` (None si no es de este formato)."""
+    with open(ruta, "rb") as f:
+        inicio = f.read(len(MAGIA) + 1)
+    if len(inicio) <= len(MAGIA) or inicio[:len(MAGIA)] != MAGIA:
+        return None
+    return inicio[len(MAGIA)]
+
+
+def usa_sobre(ruta):
+    """Indica si ``ruta`` está cifrado con cifrado de sobre (su clave está en un almacén)."""
+    return version_cifrado(ruta) == VERSION_SOBRE
+
+
+def usa_frase(ruta):
+    """Indica si ``ruta`` está cifrado con una frase de paso."""
+    return version_cifrado(ruta) == VERSION_FRASE
+
+
+def reenvolver_clave(ruta, almacen):
+    """Vuelve a envolver la clave de datos de ``ruta`` con la KEK activa de ``almacen``.
+
+    Solo se reescribe, en su sitio, el bloque de 76 bytes de la cabecera
+    con la clave envuelta; los trozos cifrados no se tocan. Devuelve
+    ``reenvuelto``, ``actual`` (ya usaba la KEK activa) o ``no_sobre``.
+    """
+    with open(ruta, "r+b") as f:
+        fija = f.read(_CABECERA.size)
+        if len(fija) < _CABECERA.size or fija[:len(MAGIA)] != MAGIA or fija[len(MAGIA)] != VERSION_SOBRE:
+            return "no_sobre"
+        bloque = f.read(_BLOQUE_CLAVE.size)
+        if len(bloque) < _BLOQUE_CLAVE.size:
+            raise ValueError("Archivo cifrado truncado.")
+        id_kek, envuelta = _BLOQUE_CLAVE.unpack(bloque)
+        id_activa, kek_activa = almacen.activa()
+        if id_kek == id_activa:
+            return "actual"
+        clave_datos = _desenvolver(almacen.obtener(id_kek), envuelta, fija)
+        f.seek(_CABECERA.size)
+        f.write(_BLOQUE_CLAVE.pack(id_activa, _envolver(kek_activa, clave_datos, fija)))
+        f.flush()
+        os.fsync(f.fileno())
+    return "reenvuelto"
+
+
+def hilos_por_defecto():
+    return os.cpu_count() or 1
+
+
+def cifrar_archivo(origen, destino, clave, tam_trozo=TAMANO_TROZO, hilos=None):
+    """Cifra ``origen`` en ``destino`` en streaming (memoria constante), en ``hilos`` hilos."""
+    with open(origen, "rb") as entrada, open(destino, "wb") as salida, \
+            EscritorCifrado(salida, clave, tam_trozo, hilos or hilos_por_defecto()) as cifrado:
+        while True:
+            datos = entrada.read(TAMANO_LECTURA)
+            if not datos:
+                break
+            cifrado.write(datos)
+    return cifrado.bytes_entrada
+
+
+def descifrar_archivo(origen, destino, clave, hilos=None):
+    """Descifra ``origen`` en ``destino`` en streaming.
+
+    Se escribe en un temporal que solo se renombra a ``destino`` si todos
+    los trozos se han autenticado, así un archivo manipulado o truncado
+    nunca deja un resultado parcial que parezca válido.
+    """
+    temporal = destino + ".tmp"
+    total = 0
+    try:
+        with open(origen, "rb") as entrada, open(temporal, "wb") as salida, \
+                LectorCifrado(entrada, clave, hilos or hilos_por_defecto()) as lector:
+            while True:
+                datos = lector.read(TAMANO_LECTURA)
+                if not datos:
+                    break
+                salida.write(datos)
+                total += len(datos)
+    except BaseException:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        raise
+    os.replace(temporal, destino)
+    return total
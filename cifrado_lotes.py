@@ -0,0 +1,306 @@
+import base64
+import json
+import os
+import time
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from barrido import agrupar_en_lotes, mapear_lotes, recorrer_archivos
+from cifrado_flujo import EXTENSION, cargar_clave, cifrar_archivo, descifrar_archivo, generar_clave
+from linea_base import procesos_por_defecto
+
+
+FORMATO_MANIFIESTO = "manifiesto_claves"
+FORMATO_DIARIO = "diario_descifrado"
+VERSION = 1
+NOMBRE_MANIFIESTO = "claves.jsonl"
+NOMBRE_DIARIO = ".diario_descifrado.jsonl"
+INTERVALO_PROGRESO_S = 0.5
+
+
+def envolver_clave(clave_maestra, datos, contexto):
+    """Cifra ``datos`` con la clave maestra; ``contexto`` (p. ej. la ruta) queda autenticado."""
+    nonce = os.urandom(12)
+    cifrado = AESGCM(cargar_clave(clave_maestra)).encrypt(nonce, datos, contexto.encode("utf-8", "surrogateescape"))
+    return base64.b64encode(nonce + cifrado).decode()
+
+
+def desenvolver_clave(clave_maestra, envuelta, contexto):
+    datos = base64.b64decode(envuelta)
+    try:
+        return AESGCM(cargar_clave(clave_maestra)).decrypt(datos[:12], datos[12:],
+                                                            contexto.encode("utf-8", "surrogateescape"))
+    except InvalidTag:
+        raise ValueError("Clave maestra incorrecta o manifiesto manipulado.") from None
+
+
+def leer_diario(ruta, formato):
+    """Devuelve (cabecera, último registro de cada ruta, bytes válidos) o None si no es del ``formato``.
+
+    Una última línea a medias (escritura interrumpida) se ignora.
+    """
+    registros = {}
+    with open(ruta, "rb") as f:
+        try:
+            cabecera = json.loads(f.readline())
+        except ValueError:
+            return None
+        if not isinstance(cabecera, dict) or cabecera.get("formato") != formato:
+            return None
+        valido = f.tell()
+        for linea in f:
+            try:
+                registro = json.loads(linea)
+                registros[registro["ruta"]] = registro
+            except (ValueError, KeyError):
+                break
+            valido += len(linea)
+    return cabecera, registros, valido
+
+
+class Diario:
+    """Archivo JSONL de solo añadir (cabecera y un registro por archivo) que permite reanudar.
+
+    Cada registro se escribe en cuanto termina su archivo; al reanudar se
+    descarta la última línea si quedó a medias. ``registros`` guarda el
+    último registro de cada ruta, así un archivo que falló y se reintenta
+    con éxito queda con el registro bueno.
+    """
+
+    def __init__(self, ruta, cabecera, reanudar=True):
+        self.ruta = ruta
+        self.registros = {}
+        self.cabecera = None
+        if reanudar and os.path.exists(ruta):
+            self._recuperar(cabecera["formato"])
+        if self.cabecera is not None:
+            self._f = open(ruta, "a", encoding="utf-8")
+            return
+        self.cabecera = cabecera
+        self._f = open(ruta, "w", encoding="utf-8")
+        self.escribir(cabecera)
+        self.volcar()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cerrar()
+
+    def _recuperar(self, formato):
+        leido = leer_diario(self.ruta, formato)
+        if leido is None:
+            return
+        self.cabecera, self.registros, valido = leido
+        os.truncate(self.ruta, valido)
+
+    def escribir(self, registro):
+        # ensure_ascii: las rutas con bytes no UTF-8 (surrogateescape) no se pueden codificar tal cual
+        self._f.write(json.dumps(registro, separators=(",", ":")) + "\n")
+        if "ruta" in registro:
+            self.registros[registro["ruta"]] = registro
+
+    def volcar(self):
+        self._f.flush()
+
+    def cerrar(self):
+        if not self._f.closed:
+            self._f.close()
+
+
+def _comprobar_maestra(cabecera, clave_maestra):
+    desenvolver_clave(clave_maestra, cabecera["control"], FORMATO_MANIFIESTO)
+
+
+def cifrar_lote(lote, opciones):
+    """Cifra un lote de archivos, cada uno con su clave (se ejecuta en un proceso hijo).
+
+    Cada archivo se cifra en un temporal que se renombra al terminar; un
+    error solo afecta a su archivo.
+    """
+    resultados = []
+    for relativa, ruta, ruta_cifrada in lote:
+        temporal = ruta_cifrada + ".tmp"
+        try:
+            os.makedirs(os.path.dirname(ruta_cifrada), exist_ok=True)
+            clave = generar_clave()
+            tamano = cifrar_archivo(ruta, temporal, clave, hilos=1)
+            os.replace(temporal, ruta_cifrada)
+            resultados.append({"ruta": relativa, "clave": clave, "bytes": tamano})
+        except Exception as exc:
+            if os.path.exists(temporal):
+                os.remove(temporal)
+            resultados.append({"ruta": relativa, "error": str(exc)})
+    return resultados
+
+
+def descifrar_lote(lote, opciones):
+    """Descifra un lote de archivos con sus claves y les devuelve modo y fecha (proceso hijo)."""
+    resultados = []
+    for relativa, ruta_cifrada, ruta, clave, registro in lote:
+        try:
+            os.makedirs(os.path.dirname(ruta), exist_ok=True)
+            tamano = descifrar_archivo(ruta_cifrada, ruta, clave, hilos=1)
+            os.chmod(ruta, registro["modo"])
+            os.utime(ruta, ns=(registro["mtime_ns"], registro["mtime_ns"]))
+            resultados.append({"ruta": relativa, "ok": True, "bytes": tamano})
+        except Exception as exc:
+            resultados.append({"ruta": relativa, "error": str(exc)})
+    return resultados
+
+
+def _procesar(pendientes, funcion, procesos, al_resultado, al_progreso, diario):
+    """Reparte ``pendientes`` ((elemento, stat)) en el pool y avisa del progreso."""
+    pendientes = list(pendientes)
+    total_archivos = len(pendientes)
+    total_bytes = sum(st.st_size for _, st in pendientes)
+    archivos, bytes_hechos, errores = 0, 0, []
+    inicio = time.perf_counter()
+    ultimo_aviso = 0.0
+    for resultados in mapear_lotes(agrupar_en_lotes(pendientes), None, procesos, funcion):
+        for resultado in resultados:
+            try:
+                al_resultado(resultado)
+            except (OSError, ValueError) as exc:
+                # Sin registro en el diario el archivo no cuenta como hecho y se repite al reanudar
+                resultado = {"ruta": resultado["ruta"], "error": f"No se pudo anotar en el diario: {exc}"}
+            if "error" in resultado:
+                errores.append(resultado)
+            else:
+                archivos += 1
+                bytes_hechos += resultado["bytes"]
+        ahora = time.perf_counter()
+        if ahora - ultimo_aviso >= INTERVALO_PROGRESO_S:
+            ultimo_aviso = ahora
+            diario.volcar()
+            if al_progreso:
+                segundos = ahora - inicio
+                velocidad = bytes_hechos / segundos if segundos > 0 else 0.0
+                al_progreso({
+                    "archivos": archivos,
+                    "total_archivos": total_archivos,
+                    "bytes": bytes_hechos,
+                    "total_bytes": total_bytes,
+                    "errores": len(errores),
+                    "mb_s": velocidad / (1024 * 1024),
+                })
+    segundos = time.perf_counter() - inicio
+    return {"archivos": archivos, "bytes": bytes_hechos, "errores": errores, "segundos": segundos,
+            "mb_s": bytes_hechos / (1024 * 1024) / segundos if segundos > 0 else 0.0}
+
+
+def cifrar_directorio(origen, destino, clave_maestra, procesos=None, al_progreso=None):
+    """Cifra todos los archivos de ``origen`` en ``destino`` repartiéndolos en un pool de procesos.
+
+    Cada archivo se cifra con su propia clave (formato por trozos) como
+    ``<ruta>.enc``. Las claves se guardan en ``destino/claves.jsonl``,
+    cada una envuelta (AES-256-GCM) con la clave maestra y ligada a su
+    ruta, junto con el modo y la fecha del original. Como cada registro se
+    escribe al terminar su archivo, el manifiesto es también el diario: si
+    se interrumpe, la siguiente ejecución continúa con lo que falte (y
+    reintenta los archivos que fallaron o cuyo tamaño o fecha han cambiado
+    desde que se cifraron). Un error en un archivo se anota y no detiene
+    el lote.
+    """
+    origen = os.path.abspath(origen)
+    destino = os.path.abspath(destino)
+    if not os.path.isdir(origen):
+        raise NotADirectoryError("El directorio de origen no existe.")
+    os.makedirs(destino, exist_ok=True)
+    procesos = procesos or procesos_por_defecto([origen])
+    cabecera = {
+        "formato": FORMATO_MANIFIESTO,
+        "version": VERSION,
+        "origen": origen,
+        "control": envolver_clave(clave_maestra, os.urandom(32), FORMATO_MANIFIESTO),
+        "creado": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    errores_recorrido = []
+    with Diario(os.path.join(destino, NOMBRE_MANIFIESTO), cabecera) as manifiesto:
+        _comprobar_maestra(manifiesto.cabecera, clave_maestra)
+        hechos = {ruta: registro for ruta, registro in manifiesto.registros.items() if "clave" in registro}
+        estado = {}
+        reanudados = 0
+
+        def pendientes():
+            # No se recorre el destino si está dentro del origen
+            for ruta, st in recorrer_archivos(origen, errores_recorrido, lambda ruta: ruta == destino):
+                nonlocal reanudados
+                relativa = os.path.relpath(ruta, origen).replace(os.sep, "/")
+                hecho = hechos.get(relativa)
+                if hecho is not None and hecho.get("tamano_origen", hecho["tamano"]) == st.st_size \
+                        and hecho["mtime_ns"] == st.st_mtime_ns:
+                    reanudados += 1
+                    continue
+                estado[relativa] = st
+                yield (relativa, ruta, os.path.join(destino, relativa + EXTENSION)), st
+
+        def guardar(resultado):
+            st = estado.pop(resultado["ruta"])
+            if "error" in resultado:
+                manifiesto.escribir(resultado)
+                return
+            manifiesto.escribir({
+                "ruta": resultado["ruta"],
+                "clave": envolver_clave(clave_maestra, cargar_clave(resultado["clave"]), resultado["ruta"]),
+                "tamano": resultado["bytes"],
+                "tamano_origen": st.st_size,
+                "modo": st.st_mode & 0o7777,
+                "mtime_ns": st.st_mtime_ns,
+            })
+
+        resumen = _procesar(pendientes(), cifrar_lote, procesos, guardar, al_progreso, manifiesto)
+    resumen["errores"] = errores_recorrido + resumen["errores"]
+    resumen["reanudados"] = reanudados
+    resumen["manifiesto"] = manifiesto.ruta
+    return resumen
+
+
+def descifrar_directorio(origen, destino, clave_maestra, procesos=None, al_progreso=None):
+    """Descifra en ``destino`` un directorio cifrado con ``cifrar_directorio``.
+
+    Las claves se desenvuelven con la clave maestra a partir del
+    manifiesto de ``origen``. El progreso se anota en un diario dentro de
+    ``destino`` para poder reanudar; los archivos que fallan (falta el
+    cifrado, está dañado...) se anotan sin detener el lote.
+    """
+    origen = os.path.abspath(origen)
+    destino = os.path.abspath(destino)
+    ruta_manifiesto = os.path.join(origen, NOMBRE_MANIFIESTO)
+    if not os.path.isfile(ruta_manifiesto):
+        raise FileNotFoundError("No hay manifiesto de claves en el directorio cifrado.")
+    leido = leer_diario(ruta_manifiesto, FORMATO_MANIFIESTO)
+    if leido is None:
+        raise ValueError("El manifiesto de claves no es válido.")
+    cabecera_manifiesto, registros, _ = leido
+    _comprobar_maestra(cabecera_manifiesto, clave_maestra)
+    registros = {ruta: registro for ruta, registro in registros.items() if "clave" in registro}
+    os.makedirs(destino, exist_ok=True)
+    procesos = procesos or procesos_por_defecto([origen])
+    errores_previos = []
+    cabecera = {"formato": FORMATO_DIARIO, "version": VERSION, "origen": origen,
+                "creado": time.strftime("%Y-%m-%d %H:%M:%S")}
+    with Diario(os.path.join(destino, NOMBRE_DIARIO), cabecera) as diario:
+        hechos = {ruta for ruta, registro in diario.registros.items() if registro.get("ok")}
+
+        def pendientes():
+            for relativa, registro in registros.items():
+                if relativa in hechos:
+                    continue
+                ruta_cifrada = os.path.join(origen, relativa + EXTENSION)
+                try:
+                    st = os.stat(ruta_cifrada)
+                    clave = desenvolver_clave(clave_maestra, registro["clave"], relativa)
+                except (OSError, ValueError) as exc:
+                    error = {"ruta": relativa, "error": str(exc)}
+                    errores_previos.append(error)
+                    diario.escribir(error)
+                    continue
+                clave = base64.urlsafe_b64encode(clave).decode()
+                yield (relativa, ruta_cifrada, os.path.join(destino, relativa), clave, registro), st
+
+        resumen = _procesar(pendientes(), descifrar_lote, procesos, diario.escribir, al_progreso, diario)
+    resumen["errores"] = errores_previos + resumen["errores"]
+    resumen["reanudados"] = len(hechos)
+    return resumen
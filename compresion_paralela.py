@@ -0,0 +1,204 @@
+import bz2
+import lzma
+import os
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Cada bloque se comprime como un miembro (gzip) o flujo (bz2, xz)
+# independiente; la concatenación sigue siendo un archivo válido que
+# descomprimen gzip/bzip2/xz y los módulos de Python.
+CODECS = {
+    "gz": {"extension": ".gz", "nivel": 6, "niveles": range(1, 10), "bloque": 1024 * 1024},
+    "bz2": {"extension": ".bz2", "nivel": 9, "niveles": range(1, 10), "bloque": 900 * 1000},
+    "xz": {"extension": ".xz", "nivel": 6, "niveles": range(0, 10), "bloque": 8 * 1024 * 1024},
+    "ninguna": {"extension": "", "nivel": None, "niveles": (), "bloque": None},
+}
+TAMANO_LECTURA = 256 * 1024
+
+
+def comprimir_bloque(codec, nivel, datos):
+    """Comprime ``datos`` como un miembro/flujo completo del formato ``codec``."""
+    if codec == "gz":
+        compresor = zlib.compressobj(nivel, zlib.DEFLATED, 31)
+        return compresor.compress(datos) + compresor.flush()
+    if codec == "bz2":
+        return bz2.compress(datos, nivel)
+    if codec == "xz":
+        return lzma.compress(datos, preset=nivel)
+    return datos
+
+
+def validar_compresion(codec, nivel=None):
+    """Devuelve el nivel a usar para ``codec`` o lanza ValueError si no es válido."""
+    if codec not in CODECS:
+        raise ValueError(f"Compresión desconocida: {codec}")
+    if nivel is None:
+        return CODECS[codec]["nivel"]
+    if nivel not in CODECS[codec]["niveles"]:
+        raise ValueError(f"Nivel no válido para {codec}: {nivel}")
+    return nivel
+
+
+class EscritorComprimido:
+    """Archivo de solo escritura que comprime por bloques en varios hilos (como pigz).
+
+    Lo escrito se corta en bloques de tamaño fijo que se comprimen de forma
+    independiente en un pool de hilos (zlib, bz2 y lzma liberan el GIL) y
+    se escriben en ``f`` en orden. Como mucho hay ``2 * hilos`` bloques en
+    vuelo, así que la memoria está acotada. Con ``ninguna`` los datos pasan
+    sin comprimir.
+
+    ``bloques`` guarda la posición en ``f`` donde empieza cada bloque: el
+    bloque ``i`` contiene los bytes ``[i * tam_bloque, (i + 1) * tam_bloque)``
+    de la entrada y se puede descomprimir por separado.
+    """
+
+    def __init__(self, f, codec="gz", nivel=None, hilos=None):
+        self.nivel = validar_compresion(codec, nivel)
+        self.codec = codec
+        self.hilos = hilos or os.cpu_count() or 1
+        self.tam_bloque = CODECS[codec]["bloque"]
+        self.bytes_entrada = 0
+        self.bytes_salida = 0
+        self.bloques = []
+        self.closed = False
+        self._f = f
+        self._buffer = bytearray()
+        self._en_vuelo = deque()
+        self._pool = ThreadPoolExecutor(self.hilos) if codec != "ninguna" and self.hilos > 1 else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, tipo, *exc):
+        if tipo is None:
+            self.close()
+        elif self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+
+    def _salida(self, datos):
+        if self.tam_bloque is not None:
+            self.bloques.append(self.bytes_salida)
+        self._f.write(datos)
+        self.bytes_salida += len(datos)
+
+    def _enviar(self, bloque):
+        if self._pool is None:
+            self._salida(comprimir_bloque(self.codec, self.nivel, bloque))
+            return
+        self._en_vuelo.append(self._pool.submit(comprimir_bloque, self.codec, self.nivel, bloque))
+        while len(self._en_vuelo) > 2 * self.hilos:
+            self._salida(self._en_vuelo.popleft().result())
+
+    def write(self, datos):
+        self.bytes_entrada += len(datos)
+        if self.tam_bloque is None:
+            self._salida(datos)
+            return len(datos)
+        self._buffer += datos
+        while len(self._buffer) >= self.tam_bloque:
+            bloque = bytes(self._buffer[:self.tam_bloque])
+            del self._buffer[:self.tam_bloque]
+            self._enviar(bloque)
+        return len(datos)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        """Comprime lo pendiente y espera a los bloques en vuelo (no cierra ``f``)."""
+        if self.closed:
+            return
+        self.closed = True
+        if self._buffer:
+            self._enviar(bytes(self._buffer))
+            self._buffer.clear()
+        while self._en_vuelo:
+            self._salida(self._en_vuelo.popleft().result())
+        if self._pool is not None:
+            self._pool.shutdown()
+
+
+def codec_por_nombre(nombre):
+    """Codec de un archivo ``.tar[.gz|.bz2|.xz]`` según su extensión."""
+    for codec, datos in CODECS.items():
+        if datos["extension"] and nombre.endswith(".tar" + datos["extension"]):
+            return codec
+    return "ninguna"
+
+
+def _descompresor(codec):
+    if codec == "gz":
+        return zlib.decompressobj(31)
+    if codec == "bz2":
+        return bz2.BZ2Decompressor()
+    return lzma.LZMADecompressor()
+
+
+class LectorDescomprimido:
+    """Lectura en streaming de un archivo comprimido con varios miembros/flujos.
+
+    Admite la concatenación que produce EscritorComprimido (que el modo
+    stream de tarfile no acepta para gzip) y entrega como mucho ``n``
+    bytes por lectura, así que la memoria no depende del ratio de
+    compresión.
+    """
+
+    def __init__(self, f, codec="gz"):
+        validar_compresion(codec)
+        self._f = f
+        self.codec = codec
+        self._d = None
+        self._entrada = b""
+        self._terminado = False
+
+    def _leer_entrada(self):
+        datos = self._entrada or self._f.read(TAMANO_LECTURA)
+        self._entrada = b""
+        return datos
+
+    def _descomprimir(self, n):
+        """Devuelve hasta ``n`` bytes descomprimidos (b"" solo al final)."""
+        while True:
+            if self._d is None:
+                datos = self._leer_entrada()
+                if not datos:
+                    self._terminado = True
+                    return b""
+                self._d = _descompresor(self.codec)
+                self._entrada = datos
+            if self.codec == "gz":
+                # Sin entrada nueva, zlib aún puede tener salida pendiente
+                datos = self._leer_entrada()
+                salida = self._d.decompress(datos, n)
+                # Al terminar el miembro, lo que sobra está en unused_data
+                self._entrada = b"" if self._d.eof else self._d.unconsumed_tail
+                if not datos and not salida and not self._d.eof:
+                    raise EOFError("Archivo comprimido truncado.")
+            else:
+                datos = self._leer_entrada() if self._d.needs_input else b""
+                if self._d.needs_input and not datos:
+                    raise EOFError("Archivo comprimido truncado.")
+                salida = self._d.decompress(datos, n)
+            if self._d.eof:
+                # Fin de un miembro: lo que sobra es el principio del siguiente
+                self._entrada = self._d.unused_data + self._entrada
+                self._d = None
+            if salida:
+                return salida
+
+    def read(self, n=-1):
+        if self.codec == "ninguna":
+            return self._f.read(n)
+        if self._terminado:
+            return b""
+        if n >= 0:
+            return self._descomprimir(max(n, 1)) if n else b""
+        partes = []
+        while True:
+            datos = self._descomprimir(TAMANO_LECTURA)
+            if not datos:
+                return b"".join(partes)
+            partes.append(datos)
@@ -0,0 +1,584 @@
+import hashlib
+import io
+import json
+import os
+import stat
+import tarfile
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+
+from cache_hashes import VENTANA_MTIME_NS
+from cifrado_flujo import EXTENSION as EXTENSION_CIFRADO, EscritorCifrado, LectorCifrado, cargar_clave
+from compresion_paralela import CODECS, EscritorComprimido, LectorDescomprimido, codec_por_nombre, validar_compresion
+from indice_backup import SUFIJO_INDICE, EscritorIndice, abrir_indice, extraer_miembro as extraer_con_indice, \
+    verificar_con_indice
+from motor_hash import TAMANO_BUFFER
+from tuberia import EscritorEnHilo, LectorEnHilo
+
+
+FORMATO_MANIFIESTO = "manifiesto_backup"
+VERSION = 1
+ALGORITMO = "sha256"
+MODOS = ("completo", "incremental", "diferencial")
+SUFIJO_MANIFIESTO = ".manifiesto.jsonl"
+PRECARGA_HILOS = 4
+PRECARGA_BYTES = 64 * 1024 * 1024
+PRECARGA_ARCHIVOS = 512
+MAX_PRECARGA_ARCHIVO = 8 * 1024 * 1024
+
+
+class _LectorConHash:
+    """Envuelve un archivo abierto y calcula su hash mientras tarfile lo lee.
+
+    tarfile lee exactamente el tamaño de la cabecera; si el archivo ha
+    encogido desde entonces se rellena con ceros (para no dejar el tar
+    truncado) y ``cambiado`` queda a True.
+    """
+
+    def __init__(self, f):
+        self._f = f
+        self.hash = hashlib.new(ALGORITMO)
+        self.cambiado = False
+
+    def read(self, n=-1):
+        datos = self._f.read(n)
+        if 0 <= len(datos) < n:
+            self.cambiado = True
+            datos += bytes(n - len(datos))
+        self.hash.update(datos)
+        return datos
+
+
+def recorrer_arbol(origen, errores=None):
+    """Genera (ruta relativa con ``/``, ruta, stat) de todo lo que hay bajo ``origen``, ordenado.
+
+    Los directorios ilegibles y las entradas que no se pueden consultar se
+    anotan en ``errores`` (con su ruta relativa, ``.`` para el propio
+    ``origen``) y se saltan.
+    """
+    pendientes = [("", origen)]
+    while pendientes:
+        relativa, directorio = pendientes.pop()
+        try:
+            with os.scandir(directorio) as entradas:
+                entradas = sorted(entradas, key=lambda entrada: entrada.name)
+        except OSError as exc:
+            if errores is not None:
+                errores.append({"ruta": relativa or ".", "error": exc.strerror or str(exc)})
+            continue
+        subdirectorios = []
+        for entrada in entradas:
+            ruta_relativa = f"{relativa}/{entrada.name}" if relativa else entrada.name
+            try:
+                st = entrada.stat(follow_symlinks=False)
+            except OSError as exc:
+                if errores is not None:
+                    errores.append({"ruta": ruta_relativa, "error": exc.strerror or str(exc)})
+                continue
+            yield ruta_relativa, entrada.path, st
+            if stat.S_ISDIR(st.st_mode):
+                subdirectorios.append((ruta_relativa, entrada.path))
+        pendientes.extend(reversed(subdirectorios))
+
+
+def _escribir(f, datos):
+    # ensure_ascii: las rutas con bytes no UTF-8 (surrogateescape) no se pueden codificar tal cual
+    f.write(json.dumps(datos, separators=(",", ":")))
+    f.write("\n")
+
+
+def leer_manifiesto(ruta):
+    """Devuelve (cabecera, registros) de un manifiesto; los registros se leen en streaming."""
+    f = open(ruta, "r", encoding="utf-8")
+    cabecera = json.loads(f.readline())
+    if cabecera.get("formato") != FORMATO_MANIFIESTO:
+        f.close()
+        raise ValueError(f"No es un manifiesto de backup: {ruta}")
+
+    def registros():
+        with f:
+            for linea in f:
+                if linea.strip():
+                    yield json.loads(linea)
+
+    return cabecera, registros()
+
+
+def listar_copias(destino, origen=None):
+    """Copias con manifiesto que hay en ``destino`` (de ``origen``, si se indica), de la más antigua a la más reciente."""
+    origen = os.path.abspath(origen) if origen else None
+    copias = []
+    for nombre in os.listdir(destino):
+        if not nombre.endswith(SUFIJO_MANIFIESTO):
+            continue
+        ruta = os.path.join(destino, nombre)
+        try:
+            cabecera, registros = leer_manifiesto(ruta)
+            registros.close()
+        except (OSError, ValueError):
+            continue
+        if origen is None or cabecera["origen"] == origen:
+            copias.append({**cabecera, "manifiesto": ruta})
+    return sorted(copias, key=lambda copia: copia["creado_ns"])
+
+
+def _buscar_referencia(destino, origen, modo):
+    """Copia sobre la que se calcula una incremental (la última) o diferencial (la última completa)."""
+    copias = listar_copias(destino, origen)
+    if modo == "diferencial":
+        copias = [copia for copia in copias if copia["tipo"] == "completo"]
+    return copias[-1] if copias else None
+
+
+def _nombre_libre(destino, modo, extension):
+    """Nombre base sin tar, manifiesto ni índice (ni sus temporales) en ``destino``.
+
+    Dos copias en el mismo segundo con otro códec o una cifrada y otra no
+    tienen tar distinto pero compartirían manifiesto e índice.
+    """
+    nombre = "backup_" + datetime.now().strftime("%Y%m%d_%H%M%S")
+    if modo != "completo":
+        nombre += f"_{modo}"
+    base, contador = nombre, 1
+    while any(os.path.exists(os.path.join(destino, nombre + sufijo))
+              for sufijo in (extension, SUFIJO_MANIFIESTO, SUFIJO_MANIFIESTO + ".tmp", SUFIJO_INDICE,
+                             SUFIJO_INDICE + ".tmp")):
+        nombre = f"{base}_{contador}"
+        contador += 1
+    return nombre
+
+
+def sin_cambios(anterior, st, referencia_ns):
+    """Indica si un archivo sigue igual que en la copia de referencia según tamaño y mtime."""
+    if anterior.get("tipo") != "f" or anterior.get("cambiado") or anterior["tamano"] != st.st_size or anterior["mtime_ns"] != st.st_mtime_ns:
+        return False
+    # Modificado poco antes de la copia de referencia: un cambio posterior
+    # dentro de la misma marca de tiempo no movería mtime
+    return anterior["mtime_ns"] < referencia_ns - VENTANA_MTIME_NS
+
+
+def _leer(ruta):
+    with open(ruta, "rb") as f:
+        return f.read()
+
+
+def _precargar(entradas):
+    """Lee por adelantado, en hilos, los archivos pequeños que se van a guardar.
+
+    ``entradas`` genera ``(relativa, ruta, st, copiar)``; se devuelven en el
+    mismo orden junto con un futuro con el contenido (o None si el archivo
+    no se copia o es grande y se leerá en streaming). Lo precargado y no
+    consumido está acotado por ``PRECARGA_BYTES`` y ``PRECARGA_ARCHIVOS``.
+    """
+    with ThreadPoolExecutor(PRECARGA_HILOS) as pool:
+        ventana, bytes_ventana = deque(), 0
+        for entrada in entradas:
+            _, ruta, st, copiar = entrada
+            futuro = None
+            if copiar and st.st_size <= MAX_PRECARGA_ARCHIVO:
+                futuro = pool.submit(_leer, ruta)
+                bytes_ventana += st.st_size
+            ventana.append((entrada, futuro))
+            while ventana and (bytes_ventana > PRECARGA_BYTES or len(ventana) > PRECARGA_ARCHIVOS):
+                lista, futuro = ventana.popleft()
+                if futuro is not None:
+                    bytes_ventana -= lista[2].st_size
+                yield lista, futuro
+        while ventana:
+            yield ventana.popleft()
+
+
+def _guardar_archivo(tar, ruta, nombre_miembro, futuro):
+    """Añade un archivo al tar y devuelve (hash, tamaño guardado, si cambió durante la copia)."""
+    info = tar.gettarinfo(ruta, nombre_miembro)
+    if futuro is not None:
+        datos = futuro.result()
+        info.size = len(datos)
+        tar.addfile(info, io.BytesIO(datos))
+        return hashlib.new(ALGORITMO, datos).hexdigest(), len(datos), False
+    with open(ruta, "rb") as f:
+        lector = _LectorConHash(f)
+        tar.addfile(info, lector)
+        # Si ha crecido, lo añadido no entra en el tar
+        cambiado = lector.cambiado or f.read(1) != b""
+    return lector.hash.hexdigest(), info.size, cambiado
+
+
+@contextmanager
+def _tuberia_escritura(ruta, compresion, nivel, hilos, clave):
+    """Archivo donde escribir el tar: se comprime y, con ``clave``, se cifra en otro hilo."""
+    with open(ruta, "wb") as salida:
+        if clave is None:
+            with EscritorComprimido(salida, compresion, nivel, hilos) as comprimido:
+                yield comprimido
+            return
+        with EscritorCifrado(salida, clave) as cifrado, EscritorEnHilo(cifrado) as etapa, \
+                EscritorComprimido(etapa, compresion, nivel, hilos) as comprimido:
+            yield comprimido
+
+
+@contextmanager
+def _tuberia_lectura(ruta, clave):
+    """Flujo con el tar de un backup: se descifra y se descomprime, cada etapa en su hilo."""
+    nombre = os.path.basename(ruta)
+    cifrado = nombre.endswith(EXTENSION_CIFRADO)
+    if cifrado:
+        if clave is None:
+            raise ValueError(f"{nombre} está cifrado: hace falta la clave.")
+        nombre = nombre[:-len(EXTENSION_CIFRADO)]
+    with open(ruta, "rb") as entrada:
+        if cifrado:
+            with LectorEnHilo(LectorCifrado(entrada, clave)) as descifrado, \
+                    LectorEnHilo(LectorDescomprimido(descifrado, codec_por_nombre(nombre))) as flujo:
+                yield flujo
+        else:
+            with LectorEnHilo(LectorDescomprimido(entrada, codec_por_nombre(nombre))) as flujo:
+                yield flujo
+
+
+def crear_copia(origen, destino, modo="completo", al_archivo=None, compresion="gz", nivel=None, hilos=None,
+                clave=None):
+    """Crea un backup ``.tar.gz`` de ``origen`` en ``destino`` con su manifiesto.
+
+    El manifiesto (JSONL junto al tar) lista todo el árbol en ese momento:
+    por cada archivo, su tamaño, mtime, hash y en qué backup está su
+    contenido. En modo ``incremental`` solo se guardan los archivos nuevos
+    o cambiados desde la última copia y en ``diferencial`` desde la última
+    completa; los demás apuntan al backup anterior que los contiene y los
+    borrados quedan anotados con un registro ``eliminado``. Si no hay copia
+    de referencia se hace una completa. ``al_archivo`` recibe la ruta
+    relativa de cada archivo guardado.
+
+    El tar se comprime por bloques en ``hilos`` hilos (``compresion`` es
+    ``gz``, ``bz2``, ``xz`` o ``ninguna``, con su ``nivel``) mientras otros
+    hilos leen por adelantado los archivos siguientes.
+
+    Con ``clave`` (ver cifrado_flujo.generar_clave) el tar comprimido se
+    cifra en trozos autenticados según se genera, sin pasar por disco en
+    claro; el manifiesto, que solo tiene metadatos, queda sin cifrar para
+    poder encadenar incrementales.
+
+    Los backups sin cifrar llevan además un índice (``.indice.sqlite``) con
+    la posición de cada archivo y de cada bloque comprimido, para extraer
+    o verificar archivos sueltos sin descomprimir todo el tar.
+    """
+    if modo not in MODOS:
+        raise ValueError(f"Modo de backup desconocido: {modo}")
+    nivel = validar_compresion(compresion, nivel)
+    if clave is not None:
+        cargar_clave(clave)
+    if not os.path.isdir(origen):
+        raise NotADirectoryError("El directorio de origen no existe.")
+    origen = os.path.abspath(origen)
+    os.makedirs(destino, exist_ok=True)
+    inicio = time.perf_counter()
+
+    referencia = _buscar_referencia(destino, origen, modo) if modo != "completo" else None
+    if referencia is None:
+        modo = "completo"
+        anteriores, referencia_ns = {}, 0
+    else:
+        _, registros = leer_manifiesto(referencia["manifiesto"])
+        anteriores = {registro["ruta"]: registro for registro in registros if not registro.get("eliminado")}
+        referencia_ns = referencia["creado_ns"]
+
+    extension = ".tar" + CODECS[compresion]["extension"] + (EXTENSION_CIFRADO if clave is not None else "")
+    nombre = _nombre_libre(destino, modo, extension)
+    archivo = nombre + extension
+    ruta_tar = os.path.join(destino, archivo)
+    ruta_manifiesto = os.path.join(destino, nombre + SUFIJO_MANIFIESTO)
+    raiz = os.path.basename(origen)
+    if clave is None:
+        indice = EscritorIndice(os.path.join(destino, nombre + SUFIJO_INDICE), archivo, raiz, compresion, ALGORITMO)
+    else:
+        indice = nullcontext()
+    archivos, copiados, bytes_copiados, eliminados = 0, 0, 0, 0
+    errores = []
+    ilegibles = []
+    vistos = {}
+
+    def planificar():
+        for relativa, ruta, st in recorrer_arbol(origen, ilegibles):
+            anterior = vistos[relativa] = anteriores.pop(relativa, None)
+            copiar = stat.S_ISREG(st.st_mode) and not (anterior is not None and sin_cambios(anterior, st, referencia_ns))
+            yield relativa, ruta, st, copiar
+
+    # El índice se cierra el último, cuando ya se conocen todos los bloques
+    with indice, _tuberia_escritura(ruta_tar, compresion, nivel, hilos, clave) as comprimido, \
+            tarfile.open(fileobj=comprimido, mode="w|") as tar, \
+            open(ruta_manifiesto + ".tmp", "w", encoding="utf-8") as manifiesto:
+        if clave is None:
+            indice.asociar(comprimido)
+        _escribir(manifiesto, {
+            "formato": FORMATO_MANIFIESTO,
+            "version": VERSION,
+            "tipo": modo,
+            "origen": origen,
+            "raiz": raiz,
+            "archivo": archivo,
+            "compresion": compresion,
+            "nivel": nivel,
+            "cifrado": "aes-256-gcm" if clave is not None else None,
+            "referencia": os.path.basename(referencia["manifiesto"]) if referencia else None,
+            "algoritmo": ALGORITMO,
+            "creado": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "creado_ns": time.time_ns(),
+        })
+        tar.add(origen, arcname=raiz, recursive=False)
+        for (relativa, ruta, st, copiar), futuro in _precargar(planificar()):
+            anterior = vistos.pop(relativa)
+            registro = {"ruta": relativa, "modo": stat.S_IMODE(st.st_mode), "mtime_ns": st.st_mtime_ns}
+            nombre_miembro = f"{raiz}/{relativa}"
+            if stat.S_ISDIR(st.st_mode) or stat.S_ISLNK(st.st_mode):
+                # tarfile consulta la entrada antes de escribir nada, así que un fallo no deja el tar a medias
+                try:
+                    if stat.S_ISDIR(st.st_mode):
+                        registro["tipo"] = "d"
+                    else:
+                        registro.update(tipo="l", destino=os.readlink(ruta))
+                    tar.add(ruta, arcname=nombre_miembro, recursive=False)
+                except OSError as exc:
+                    errores.append({"ruta": relativa, "error": exc.strerror or str(exc)})
+                    continue
+            elif stat.S_ISREG(st.st_mode):
+                archivos += 1
+                registro.update(tipo="f", tamano=st.st_size)
+                if not copiar:
+                    registro.update(hash=anterior["hash"], archivo=anterior["archivo"])
+                else:
+                    cabecera = tar.offset
+                    try:
+                        digest, registro["tamano"], cambiado = _guardar_archivo(tar, ruta, nombre_miembro, futuro)
+                    except OSError as exc:
+                        errores.append({"ruta": relativa, "error": exc.strerror or str(exc)})
+                        # Solo se conserva la versión anterior si también era un archivo
+                        if anterior is not None and anterior.get("tipo") == "f":
+                            _escribir(manifiesto, anterior)
+                        continue
+                    registro.update(hash=digest, archivo=archivo)
+                    if cambiado:
+                        # Lo guardado puede mezclar dos versiones: se anota y la siguiente copia lo repite
+                        registro["cambiado"] = True
+                        errores.append({"ruta": relativa, "error": "El archivo cambió durante la copia"})
+                    if clave is None:
+                        # tar.offset queda tras el relleno de los datos hasta múltiplo de 512
+                        datos = tar.offset - -(-registro["tamano"] // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+                        indice.anadir(relativa, cabecera, datos, registro["tamano"], registro["modo"],
+                                      registro["mtime_ns"], digest)
+                    copiados += 1
+                    bytes_copiados += registro["tamano"]
+                    if al_archivo:
+                        al_archivo(relativa)
+            else:
+                continue
+            _escribir(manifiesto, registro)
+        # Lo que queda de la referencia ya no existe, salvo lo que no se ha podido leer, que se mantiene
+        errores.extend(ilegibles)
+        no_leidas = [error["ruta"] for error in ilegibles]
+        for relativa, anterior in anteriores.items():
+            if any(ilegible == "." or relativa == ilegible or relativa.startswith(ilegible + "/")
+                   for ilegible in no_leidas):
+                _escribir(manifiesto, anterior)
+            else:
+                _escribir(manifiesto, {"ruta": relativa, "eliminado": True})
+                eliminados += 1
+    os.replace(ruta_manifiesto + ".tmp", ruta_manifiesto)
+
+    segundos = time.perf_counter() - inicio
+    return {
+        "archivo": ruta_tar,
+        "manifiesto": ruta_manifiesto,
+        "indice": indice.ruta if clave is None else None,
+        "tipo": modo,
+        "referencia": referencia["manifiesto"] if referencia else None,
+        "archivos": archivos,
+        "copiados": copiados,
+        "bytes_copiados": bytes_copiados,
+        "bytes_comprimidos": comprimido.bytes_salida,
+        "eliminados": eliminados,
+        "errores": errores,
+        "segundos": segundos,
+        "mb_s": bytes_copiados / (1024 * 1024) / segundos if segundos > 0 else 0.0,
+    }
+
+
+def _ruta_destino(destino, relativa):
+    partes = relativa.split("/")
+    if any(parte in ("", ".", "..") for parte in partes):
+        raise ValueError(f"Ruta no válida en el manifiesto: {relativa}")
+    return os.path.join(destino, *partes)
+
+
+def _extraer(tar, miembro, ruta, registro):
+    """Escribe un miembro del tar en ``ruta`` comprobando su hash."""
+    digest = hashlib.new(ALGORITMO)
+    origen = tar.extractfile(miembro)
+    with open(ruta, "wb") as f:
+        while True:
+            bloque = origen.read(TAMANO_BUFFER)
+            if not bloque:
+                break
+            digest.update(bloque)
+            f.write(bloque)
+    os.chmod(ruta, registro["modo"])
+    os.utime(ruta, ns=(registro["mtime_ns"], registro["mtime_ns"]))
+    return digest.hexdigest() == registro["hash"]
+
+
+def restaurar_copia(manifiesto, destino, al_archivo=None, clave=None):
+    """Reconstruye en ``destino`` el árbol tal como estaba en la copia de ``manifiesto``.
+
+    Cada archivo se saca del backup de la cadena que contiene su versión
+    (cada tar se lee una sola vez, en streaming: descifrado con ``clave``
+    si está cifrado, descompresión y extracción en hilos distintos) y se
+    comprueba su hash. Devuelve los archivos restaurados y los errores.
+    """
+    cabecera, registros = leer_manifiesto(manifiesto)
+    directorio_copias = os.path.dirname(os.path.abspath(manifiesto))
+    raiz = cabecera["raiz"]
+    os.makedirs(destino, exist_ok=True)
+    por_archivo, directorios, errores = {}, [], []
+    restaurados, total_bytes = 0, 0
+
+    for registro in registros:
+        if registro.get("eliminado"):
+            continue
+        ruta = _ruta_destino(destino, registro["ruta"])
+        if registro["tipo"] == "d":
+            os.makedirs(ruta, exist_ok=True)
+            directorios.append((ruta, registro))
+        elif registro["tipo"] == "l":
+            if os.path.lexists(ruta):
+                os.remove(ruta)
+            os.symlink(registro["destino"], ruta)
+        else:
+            por_archivo.setdefault(registro["archivo"], {})[f"{raiz}/{registro['ruta']}"] = (ruta, registro)
+
+    if clave is None and any(archivo.endswith(EXTENSION_CIFRADO) for archivo in por_archivo):
+        raise ValueError("La copia está cifrada: hace falta la clave.")
+    for archivo, miembros in por_archivo.items():
+        try:
+            with _tuberia_lectura(os.path.join(directorio_copias, archivo), clave) as flujo, \
+                    tarfile.open(fileobj=flujo, mode="r|") as tar:
+                for miembro in tar:
+                    pendiente = miembros.pop(miembro.name, None)
+                    if pendiente is None or not miembro.isfile():
+                        continue
+                    ruta, registro = pendiente
+                    if not _extraer(tar, miembro, ruta, registro):
+                        errores.append({"ruta": registro["ruta"], "error": "El hash no coincide"})
+                    restaurados += 1
+                    total_bytes += registro["tamano"]
+                    if al_archivo:
+                        al_archivo(registro["ruta"])
+                    if not miembros:
+                        break
+        except (OSError, EOFError, ValueError, tarfile.TarError) as exc:
+            errores.append({"ruta": archivo, "error": str(exc)})
+        for _, registro in miembros.values():
+            errores.append({"ruta": registro["ruta"], "error": f"No está en {archivo}"})
+
+    # Al final, para que crear los archivos no cambie la fecha de los directorios
+    for ruta, registro in reversed(directorios):
+        os.chmod(ruta, registro["modo"])
+        os.utime(ruta, ns=(registro["mtime_ns"], registro["mtime_ns"]))
+    return {"archivos": restaurados, "bytes": total_bytes, "errores": errores, "tipo": cabecera["tipo"],
+            "creado": cabecera["creado"]}
+
+
+def _miembro_de_tar(miembro):
+    return {"ruta": miembro.name.partition("/")[2], "tamano": miembro.size, "modo": miembro.mode,
+            "mtime_ns": int(miembro.mtime * 1_000_000_000)}
+
+
+def listar_miembros(archivo, clave=None):
+    """Archivos guardados en un backup: del índice si lo tiene o recorriendo el tar."""
+    indice = abrir_indice(archivo)
+    if indice is not None:
+        with indice:
+            return indice.miembros()
+    with _tuberia_lectura(archivo, clave) as flujo, tarfile.open(fileobj=flujo, mode="r|") as tar:
+        return [_miembro_de_tar(miembro) for miembro in tar if miembro.isfile()]
+
+
+def extraer_miembro(archivo, ruta, destino, clave=None):
+    """Extrae un único archivo de un backup en ``destino`` (con su ruta relativa).
+
+    Con índice se salta directamente al bloque comprimido donde empiezan
+    sus datos y se comprueba su hash; sin índice (backups cifrados o
+    antiguos) se recorre el tar hasta encontrarlo.
+    """
+    inicio = time.perf_counter()
+    indice = abrir_indice(archivo)
+    if indice is not None:
+        with indice:
+            miembro = indice.buscar(ruta)
+            if miembro is None:
+                raise FileNotFoundError(f"{ruta} no está en el backup.")
+            ruta_salida = _ruta_destino(destino, miembro["ruta"])
+            os.makedirs(os.path.dirname(ruta_salida), exist_ok=True)
+            hash_correcto = extraer_con_indice(indice, miembro, ruta_salida)
+        return {"ruta": ruta_salida, "bytes": miembro["tamano"], "hash_correcto": hash_correcto,
+                "indice": True, "segundos": time.perf_counter() - inicio}
+    with _tuberia_lectura(archivo, clave) as flujo, tarfile.open(fileobj=flujo, mode="r|") as tar:
+        for miembro in tar:
+            relativa = miembro.name.partition("/")[2]
+            if not miembro.isfile() or ruta not in (relativa, miembro.name):
+                continue
+            ruta_salida = _ruta_destino(destino, relativa)
+            os.makedirs(os.path.dirname(ruta_salida), exist_ok=True)
+            with open(ruta_salida, "wb") as f:
+                origen = tar.extractfile(miembro)
+                while True:
+                    bloque = origen.read(TAMANO_BUFFER)
+                    if not bloque:
+                        break
+                    f.write(bloque)
+            os.chmod(ruta_salida, miembro.mode)
+            os.utime(ruta_salida, (miembro.mtime, miembro.mtime))
+            return {"ruta": ruta_salida, "bytes": miembro.size, "hash_correcto": None,
+                    "indice": False, "segundos": time.perf_counter() - inicio}
+    raise FileNotFoundError(f"{ruta} no está en el backup.")
+
+
+def verificar_copia(archivo, hilos=None, clave=None):
+    """Comprueba el hash de cada archivo de un backup.
+
+    Con índice los archivos se reparten entre varios hilos que leen cada
+    uno su tramo del tar; sin índice se recorre el tar una vez y se
+    compara con los hashes del manifiesto.
+    """
+    indice = abrir_indice(archivo)
+    if indice is not None:
+        with indice:
+            return verificar_con_indice(indice, hilos)
+    inicio = time.perf_counter()
+    nombre = os.path.basename(archivo)
+    _, registros = leer_manifiesto(archivo[:archivo.rindex(".tar")] + SUFIJO_MANIFIESTO)
+    esperados = {registro["ruta"]: registro["hash"] for registro in registros
+                 if registro.get("tipo") == "f" and registro.get("archivo") == nombre}
+    errores, miembros, total = [], 0, 0
+    with _tuberia_lectura(archivo, clave) as flujo, tarfile.open(fileobj=flujo, mode="r|") as tar:
+        for miembro in tar:
+            relativa = miembro.name.partition("/")[2]
+            if not miembro.isfile() or relativa not in esperados:
+                continue
+            digest = hashlib.new(ALGORITMO)
+            origen = tar.extractfile(miembro)
+            while True:
+                bloque = origen.read(TAMANO_BUFFER)
+                if not bloque:
+                    break
+                digest.update(bloque)
+            if digest.hexdigest() != esperados.pop(relativa):
+                errores.append({"ruta": relativa, "error": "El hash no coincide"})
+            miembros += 1
+            total += miembro.size
+    for relativa in esperados:
+        errores.append({"ruta": relativa, "error": f"No está en {nombre}"})
+    segundos = time.perf_counter() - inicio
+    return {"miembros": miembros, "bytes": total, "errores": errores, "segundos": segundos,
+            "mb_s": total / (1024 * 1024) / segundos if segundos > 0 else 0.0}
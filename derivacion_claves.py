@@ -0,0 +1,204 @@
+import hashlib
+import json
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+
+KDF_SCRYPT = 1
+KDF_PBKDF2 = 2
+NOMBRES_KDF = {"scrypt": KDF_SCRYPT, "pbkdf2": KDF_PBKDF2}
+RUTA_CALIBRACION = os.path.join(os.path.dirname(os.path.abspath(__file__)), "calibracion_kdf.json")
+LATENCIA_OBJETIVO_S = 0.5
+# Valores por defecto (y mínimos aceptados) sin calibrar
+SCRYPT_POR_DEFECTO = {"coste": 17, "r": 8, "p": 1}
+PBKDF2_POR_DEFECTO = {"coste": 600_000, "r": 0, "p": 0}
+SCRYPT_LOG2_MIN, SCRYPT_LOG2_MAX = 14, 22
+SCRYPT_MEMORIA_MAX = 1024 * 1024 * 1024
+PBKDF2_MIN, PBKDF2_MAX = 100_000, 100_000_000
+PBKDF2_MUESTRA = 100_000
+DURACION_CACHE_S = 300
+MAX_EN_CACHE = 16
+
+# Parámetros guardados en la cabecera del archivo cifrado: algoritmo, sal,
+# coste (log2 de N en scrypt, iteraciones en PBKDF2-SHA256), r y p.
+PARAMETROS_KDF = struct.Struct(">B16sIBB")
+
+
+def _memoria_scrypt(coste, r, p):
+    return 128 * r * ((1 << coste) + p + 2)
+
+
+def _comprobar(kdf, coste, r, p):
+    """Rechaza parámetros absurdos (una cabecera manipulada no debe poder agotar la memoria o la CPU)."""
+    if kdf == KDF_SCRYPT:
+        if not SCRYPT_LOG2_MIN <= coste <= SCRYPT_LOG2_MAX or not 1 <= r <= 32 or not 1 <= p <= 16 \
+                or _memoria_scrypt(coste, r, p) > SCRYPT_MEMORIA_MAX:
+            raise ValueError(f"Parámetros de scrypt no válidos: N=2^{coste}, r={r}, p={p}")
+    elif kdf == KDF_PBKDF2:
+        if not PBKDF2_MIN <= coste <= PBKDF2_MAX:
+            raise ValueError(f"Iteraciones de PBKDF2 no válidas: {coste}")
+    else:
+        raise ValueError(f"Función de derivación desconocida: {kdf}")
+
+
+def crear_parametros(kdf="scrypt", coste=None, r=None, p=None):
+    """Parámetros de derivación (bytes para la cabecera) con una sal nueva.
+
+    Sin ``coste`` se usan los de la calibración guardada o, si no hay, los
+    valores por defecto.
+    """
+    base = parametros_por_defecto(kdf)
+    kdf_id = NOMBRES_KDF[kdf]
+    coste = base["coste"] if coste is None else coste
+    r = base["r"] if r is None else r
+    p = base["p"] if p is None else p
+    _comprobar(kdf_id, coste, r, p)
+    return PARAMETROS_KDF.pack(kdf_id, os.urandom(16), coste, r, p)
+
+
+def describir_parametros(parametros):
+    kdf, _, coste, r, p = PARAMETROS_KDF.unpack(parametros)
+    if kdf == KDF_SCRYPT:
+        return f"scrypt N=2^{coste} r={r} p={p}"
+    return f"pbkdf2-sha256 {coste} iteraciones"
+
+
+def derivar(frase, parametros):
+    """Deriva una clave de 32 bytes de ``frase`` (bytes) con los ``parametros`` de la cabecera."""
+    kdf, sal, coste, r, p = PARAMETROS_KDF.unpack(parametros)
+    _comprobar(kdf, coste, r, p)
+    if kdf == KDF_SCRYPT:
+        return hashlib.scrypt(frase, salt=sal, n=1 << coste, r=r, p=p, dklen=32,
+                              maxmem=_memoria_scrypt(coste, r, p) + 1024 * 1024)
+    return hashlib.pbkdf2_hmac("sha256", frase, sal, coste, dklen=32)
+
+
+class CacheDerivadas:
+    """Caché en memoria, con caducidad, de claves ya derivadas.
+
+    Se indexa por un resumen de la frase y los parámetros (que incluyen la
+    sal), así que solo se reutiliza una derivación idéntica. Las claves se
+    guardan en ``bytearray`` y se sobrescriben con ceros al caducar, al
+    salir por LRU o al vaciar la caché.
+    """
+
+    def __init__(self, duracion=DURACION_CACHE_S, max_entradas=MAX_EN_CACHE):
+        self.duracion = duracion
+        self.max_entradas = max_entradas
+        self.aciertos = 0
+        self.fallos = 0
+        self._entradas = OrderedDict()
+        self._cerrojo = threading.Lock()
+
+    def _indice(self, frase, parametros):
+        return hashlib.sha256(len(parametros).to_bytes(2, "big") + parametros + frase).digest()
+
+    def _expulsar(self, indice):
+        clave, _ = self._entradas.pop(indice)
+        clave[:] = bytes(len(clave))
+
+    def _purgar(self, ahora):
+        for indice in [indice for indice, (_, caduca) in self._entradas.items() if caduca <= ahora]:
+            self._expulsar(indice)
+
+    def obtener(self, frase, parametros):
+        """Clave derivada (``bytearray``; no la guardes, puede ponerse a cero al caducar)."""
+        indice = self._indice(frase, parametros)
+        with self._cerrojo:
+            self._purgar(time.monotonic())
+            if indice in self._entradas:
+                self._entradas.move_to_end(indice)
+                self.aciertos += 1
+                return self._entradas[indice][0]
+        # La derivación se hace fuera del cerrojo (scrypt y PBKDF2 liberan el GIL)
+        clave = bytearray(derivar(frase, parametros))
+        with self._cerrojo:
+            self.fallos += 1
+            if indice in self._entradas:
+                self._expulsar(indice)
+            self._entradas[indice] = (clave, time.monotonic() + self.duracion)
+            while len(self._entradas) > self.max_entradas:
+                self._expulsar(next(iter(self._entradas)))
+        return clave
+
+    def vaciar(self):
+        with self._cerrojo:
+            for indice in list(self._entradas):
+                self._expulsar(indice)
+
+
+CACHE = CacheDerivadas()
+
+
+class ClaveFrase:
+    """Frase de paso para cifrar o descifrar con cifrado_flujo (formato versión 3).
+
+    Al cifrar, todos los archivos cifrados con el mismo objeto comparten
+    sal y parámetros, así que la frase se deriva una sola vez; la clave de
+    datos de cada archivo es aleatoria y va envuelta con la derivada.
+    """
+
+    def __init__(self, frase, kdf="scrypt", coste=None, cache=CACHE):
+        if not frase:
+            raise ValueError("La frase de paso no puede estar vacía.")
+        self._frase = frase.encode("utf-8") if isinstance(frase, str) else bytes(frase)
+        self._kdf = kdf
+        self._coste = coste
+        self._parametros = None
+        self._cache = cache
+
+    def parametros(self):
+        """Parámetros (con la sal) que se usarán al cifrar."""
+        if self._parametros is None:
+            self._parametros = crear_parametros(self._kdf, self._coste)
+        return self._parametros
+
+    def derivar(self, parametros):
+        return self._cache.obtener(self._frase, parametros)
+
+
+def parametros_por_defecto(kdf="scrypt", ruta=RUTA_CALIBRACION):
+    """Costes calibrados para ``kdf`` (ver ``calibrar``) o los valores por defecto."""
+    if os.path.exists(ruta):
+        with open(ruta, encoding="utf-8") as f:
+            calibrados = json.load(f)
+        if kdf in calibrados:
+            return calibrados[kdf]
+    return dict(SCRYPT_POR_DEFECTO if kdf == "scrypt" else PBKDF2_POR_DEFECTO)
+
+
+def _cronometrar(kdf, coste, r, p):
+    parametros = PARAMETROS_KDF.pack(NOMBRES_KDF[kdf], os.urandom(16), coste, r, p)
+    inicio = time.perf_counter()
+    derivar(b"calibracion", parametros)
+    return time.perf_counter() - inicio
+
+
+def calibrar(objetivo_s=LATENCIA_OBJETIVO_S, ruta=RUTA_CALIBRACION, guardar=True):
+    """Elige los costes de scrypt y PBKDF2 que tardan como mucho ``objetivo_s`` en esta máquina.
+
+    scrypt dobla N (con r=8, p=1) mientras quepa en el objetivo y en
+    SCRYPT_MEMORIA_MAX; PBKDF2 escala linealmente a partir de una muestra.
+    Nunca se baja de los mínimos. El resultado se guarda en ``ruta`` y
+    pasa a ser el valor por defecto al cifrar con frase de paso.
+    """
+    r, p = SCRYPT_POR_DEFECTO["r"], SCRYPT_POR_DEFECTO["p"]
+    coste = SCRYPT_LOG2_MIN
+    segundos = _cronometrar("scrypt", coste, r, p)
+    while coste < SCRYPT_LOG2_MAX and _memoria_scrypt(coste + 1, r, p) <= SCRYPT_MEMORIA_MAX \
+            and segundos * 2 <= objetivo_s:
+        coste += 1
+        segundos = _cronometrar("scrypt", coste, r, p)
+    scrypt = {"coste": coste, "r": r, "p": p, "segundos": segundos,
+              "memoria_mb": _memoria_scrypt(coste, r, p) / (1024 * 1024)}
+    muestra = _cronometrar("pbkdf2", PBKDF2_MUESTRA, 0, 0)
+    iteraciones = min(PBKDF2_MAX, max(PBKDF2_MIN, int(PBKDF2_MUESTRA * objetivo_s / muestra)))
+    pbkdf2 = {"coste": iteraciones, "r": 0, "p": 0, "segundos": muestra * iteraciones / PBKDF2_MUESTRA}
+    resultado = {"objetivo_s": objetivo_s, "scrypt": scrypt, "pbkdf2": pbkdf2}
+    if guardar:
+        with open(ruta, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, indent=2)
+    return resultado
@@ -0,0 +1,340 @@
+import os
+import re
+from array import array
+from collections import deque
+
+from motor_hash import TAMANO_BUFFER
+
+
+CADENA_EICAR = rb"X5O!P%@AP[4\PZX54(P^)7CC)7}$EICAR-STANDARD-ANTIVIRUS-TEST-FILE!$H+H*"
+# Con 16384 estados la tabla densa (estados x 256 enteros de 4 bytes) ocupa 16 MB
+MAX_ESTADOS_TABLA_DENSA = 16384
+MAX_BYTES_INICIALES_SALTO = 32
+MAX_OFFSETS_GUARDADOS = 16
+RUTA_REGLAS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "reglas_contenido.txt")
+
+
+class Patron:
+    """Secuencia de bytes de una regla, con restricciones opcionales.
+
+    ``rango`` limita los offsets válidos del inicio de la coincidencia
+    (``(inicio, fin)`` inclusivo) y ``minimo`` es el número de apariciones
+    necesario para que el patrón cuente como encontrado.
+    """
+
+    def __init__(self, identificador, datos, rango=None, minimo=1):
+        if not datos:
+            raise ValueError(f"El patrón {identificador} está vacío.")
+        self.identificador = identificador
+        self.datos = bytes(datos)
+        self.rango = rango
+        self.minimo = minimo
+
+
+class Regla:
+    """Conjunto de patrones con una condición al estilo YARA.
+
+    ``condicion`` puede ser ``"any"`` (algún patrón), ``"all"`` (todos) o un
+    entero ``n`` (al menos n patrones).
+    """
+
+    def __init__(self, nombre, patrones, condicion="any"):
+        if not patrones:
+            raise ValueError(f"La regla {nombre} no tiene patrones.")
+        self.nombre = nombre
+        self.patrones = list(patrones)
+        self.condicion = condicion
+
+    def cumple(self, encontrados):
+        necesarios = len(self.patrones)
+        if self.condicion == "any":
+            necesarios = 1
+        elif isinstance(self.condicion, int):
+            necesarios = self.condicion
+        return encontrados >= necesarios
+
+
+REGLAS_POR_DEFECTO = [Regla("EICAR", [Patron("$eicar", CADENA_EICAR)])]
+
+
+class Automata:
+    """Autómata de Aho-Corasick que busca todos los patrones en una pasada.
+
+    El coste por byte no depende del número de patrones. Si el autómata no
+    pasa de ``MAX_ESTADOS_TABLA_DENSA`` estados se usa una tabla de
+    transiciones densa (estados x 256), que se construye en el primer
+    escaneo; si no, el trie con enlaces de fallo.
+    """
+
+    def __init__(self, reglas):
+        self.reglas = list(reglas)
+        self.patrones = [(regla, patron) for regla in self.reglas for patron in regla.patrones]
+        hijos = [{}]
+        salidas = [[]]
+        for indice, (_, patron) in enumerate(self.patrones):
+            estado = 0
+            for byte in patron.datos:
+                siguiente = hijos[estado].get(byte)
+                if siguiente is None:
+                    siguiente = len(hijos)
+                    hijos[estado][byte] = siguiente
+                    hijos.append({})
+                    salidas.append([])
+                estado = siguiente
+            salidas[estado].append(indice)
+
+        fallos = [0] * len(hijos)
+        orden = []
+        cola = deque(hijos[0].values())
+        while cola:
+            estado = cola.popleft()
+            orden.append(estado)
+            for byte, hijo in hijos[estado].items():
+                fallo = fallos[estado]
+                while fallo and byte not in hijos[fallo]:
+                    fallo = fallos[fallo]
+                destino = hijos[fallo].get(byte, 0)
+                fallos[hijo] = destino if destino != hijo else 0
+                salidas[hijo] = salidas[hijo] + salidas[fallos[hijo]]
+                cola.append(hijo)
+
+        self.num_estados = len(hijos)
+        self._hijos = hijos
+        self._fallos = fallos
+        self._salidas = [tuple(s) for s in salidas]
+        self._finales = bytearray(1 if s else 0 for s in salidas)
+        self._orden = orden
+        self._delta = None
+
+        # Desde el estado inicial solo se avanza con el primer byte de algún
+        # patrón; si son pocos, re salta en C hasta el siguiente candidato.
+        primeros = sorted(self._hijos[0])
+        self._buscar_inicio = None
+        if len(primeros) <= MAX_BYTES_INICIALES_SALTO:
+            clase = b"".join(re.escape(bytes([byte])) for byte in primeros)
+            self._buscar_inicio = re.compile(b"[" + clase + b"]").search
+
+    def tabla_densa(self):
+        """Tabla densa de transiciones (la construye la primera vez) o None si hay demasiados estados."""
+        if self._delta is None and self.num_estados <= MAX_ESTADOS_TABLA_DENSA:
+            self._delta = self._tabla_densa(self._orden)
+        return self._delta
+
+    def _tabla_densa(self, orden):
+        """Tabla estado*256+byte -> siguiente estado premultiplicado por 256.
+
+        Las transiciones hacia estados con salidas se guardan complementadas
+        (``~destino``, negativas) para detectar coincidencias con una sola
+        comparación por byte. Cada fila parte de una copia de la de su
+        estado de fallo (ya hecha, por ir en orden de anchura) y solo se
+        escriben los hijos propios.
+        """
+        delta = array("i", bytes(self.num_estados * 256 * array("i").itemsize))
+
+        def codificar(hijo):
+            return ~(hijo * 256) if self._finales[hijo] else hijo * 256
+
+        for byte, hijo in self._hijos[0].items():
+            delta[byte] = codificar(hijo)
+        for estado in orden:
+            base = estado * 256
+            base_fallo = self._fallos[estado] * 256
+            delta[base:base + 256] = delta[base_fallo:base_fallo + 256]
+            for byte, hijo in self._hijos[estado].items():
+                delta[base + byte] = codificar(hijo)
+        return delta
+
+    def nuevo_escaneo(self):
+        return Escaneo(self)
+
+
+class Escaneo:
+    """Estado de un escaneo en streaming; se alimenta con bloques sucesivos.
+
+    El estado del autómata se conserva entre bloques, así que las
+    coincidencias que cruzan el límite entre dos bloques también se detectan.
+    Puede usarse como observador de ``motor_hash.hash_stream``.
+    """
+
+    def __init__(self, automata):
+        self.automata = automata
+        self.estado = 0
+        self.posicion = 0
+        self.apariciones = [0] * len(automata.patrones)
+        self.offsets = [[] for _ in automata.patrones]
+
+    def _registrar(self, estado, fin):
+        for indice in self.automata._salidas[estado]:
+            patron = self.automata.patrones[indice][1]
+            inicio = fin - len(patron.datos) + 1
+            if patron.rango and not (patron.rango[0] <= inicio <= patron.rango[1]):
+                continue
+            self.apariciones[indice] += 1
+            if len(self.offsets[indice]) < MAX_OFFSETS_GUARDADOS:
+                self.offsets[indice].append(inicio)
+
+    def __call__(self, bloque):
+        delta = self.automata.tabla_densa()
+        if delta is not None:
+            self.estado = self._recorrer_denso(bloque, delta)
+        else:
+            self.estado = self._recorrer_trie(bloque)
+        self.posicion += len(bloque)
+
+    def _recorrer_denso(self, bloque, delta):
+        buscar_inicio = self.automata._buscar_inicio
+        base = self.posicion
+        estado = self.estado * 256
+        vista = memoryview(bloque)
+        inicio, total = 0, len(vista)
+        while inicio < total:
+            if buscar_inicio is not None and estado == 0:
+                candidato = buscar_inicio(vista, inicio)
+                if candidato is None:
+                    break
+                inicio = candidato.start()
+            siguiente = total
+            for i, byte in enumerate(vista[inicio:], inicio):
+                estado = delta[estado + byte]
+                if estado < 0:
+                    estado = ~estado
+                    self._registrar(estado >> 8, base + i)
+                elif estado == 0 and buscar_inicio is not None:
+                    siguiente = i + 1
+                    break
+            inicio = siguiente
+        return estado >> 8
+
+    def _recorrer_trie(self, bloque):
+        hijos, fallos = self.automata._hijos, self.automata._fallos
+        finales = self.automata._finales
+        base = self.posicion
+        estado = self.estado
+        for i, byte in enumerate(bloque):
+            while estado and byte not in hijos[estado]:
+                estado = fallos[estado]
+            estado = hijos[estado].get(byte, 0)
+            if finales[estado]:
+                self._registrar(estado, base + i)
+        return estado
+
+    def resultado(self):
+        """Lista de reglas que se cumplen con los patrones encontrados."""
+        coincidencias = []
+        indice = 0
+        for regla in self.automata.reglas:
+            patrones = {}
+            for patron in regla.patrones:
+                if self.apariciones[indice] >= patron.minimo:
+                    patrones[patron.identificador] = {
+                        "apariciones": self.apariciones[indice],
+                        "offsets": list(self.offsets[indice]),
+                    }
+                indice += 1
+            if regla.cumple(len(patrones)):
+                coincidencias.append({"regla": regla.nombre, "patrones": patrones})
+        return coincidencias
+
+
+def escanear_stream(f, automata, tam_buffer=TAMANO_BUFFER):
+    """Pasa un objeto binario abierto por el autómata en bloques grandes."""
+    escaneo = automata.nuevo_escaneo()
+    while True:
+        bloque = f.read(tam_buffer)
+        if not bloque:
+            break
+        escaneo(bloque)
+    return escaneo.resultado()
+
+
+def escanear_archivo(path, automata=None):
+    """Devuelve las reglas que se cumplen en el contenido de un fichero."""
+    automata = automata if automata is not None else automata_por_defecto()
+    with open(path, "rb") as f:
+        return escanear_stream(f, automata)
+
+
+_automatas = {}
+
+
+def automata_por_defecto(ruta_reglas=RUTA_REGLAS):
+    """Autómata con las reglas por defecto y las de ``ruta_reglas`` (si existe).
+
+    Se compila una vez y se reutiliza mientras el fichero de reglas no cambie.
+    """
+    version = os.stat(ruta_reglas).st_mtime_ns if ruta_reglas and os.path.isfile(ruta_reglas) else None
+    guardado = _automatas.get(ruta_reglas)
+    if guardado is None or guardado[0] != version:
+        guardado = (version, cargar_automata(ruta_reglas))
+        _automatas[ruta_reglas] = guardado
+    return guardado[1]
+
+
+_PATRON_LINEA = re.compile(
+    r'^\$(?P<id>\w+)\s*=\s*(?:"(?P<texto>(?:[^"\\]|\\.)*)"|\{(?P<hex>[0-9a-fA-F\s]+)\})'
+    r'(?:\s+@(?P<desde>\d+)(?:-(?P<hasta>\d+))?)?(?:\s+\*(?P<minimo>\d+))?\s*(?:#.*)?$'
+)
+
+
+def _decodificar_texto(texto):
+    return texto.encode("latin-1").decode("unicode_escape").encode("latin-1")
+
+
+def cargar_reglas(ruta):
+    """Carga reglas desde un fichero de texto con este formato::
+
+        regla NOMBRE [any|all|N]
+          $a = "texto con \\x00 escapes"
+          $b = { 4D 5A 90 00 } @0        # solo en el offset 0
+          $c = "cmd.exe" @0-4096 *2      # en los primeros 4 KB, 2 veces
+
+    Las líneas vacías y las que empiezan por ``#`` se ignoran; en las
+    demás, un ``#`` después del patrón (fuera de las comillas) empieza un
+    comentario.
+    """
+    reglas, nombre, condicion, patrones = [], None, "any", []
+
+    def cerrar_regla():
+        if nombre is not None:
+            reglas.append(Regla(nombre, patrones, condicion))
+
+    with open(ruta, "r", encoding="utf-8") as f:
+        for numero, linea in enumerate(f, start=1):
+            # El comentario se quita al analizar el patrón: un "#" entre comillas es parte del texto
+            linea = linea.strip()
+            if not linea or linea.startswith("#"):
+                continue
+            partes = linea.split("#", 1)[0].split()
+            if partes[0] == "regla":
+                cerrar_regla()
+                nombre = partes[1] if len(partes) > 1 else f"regla_{numero}"
+                texto_condicion = partes[2] if len(partes) > 2 else "any"
+                condicion = int(texto_condicion) if texto_condicion.isdigit() else texto_condicion
+                if condicion not in ("any", "all") and not isinstance(condicion, int):
+                    raise ValueError(f"Línea {numero}: condición no válida '{texto_condicion}'.")
+                patrones = []
+                continue
+            coincidencia = _PATRON_LINEA.match(linea)
+            if nombre is None or coincidencia is None:
+                raise ValueError(f"Línea {numero}: no se reconoce '{linea}'.")
+            if coincidencia.group("hex") is not None:
+                datos = bytes.fromhex(coincidencia.group("hex"))
+            else:
+                datos = _decodificar_texto(coincidencia.group("texto"))
+            rango = None
+            if coincidencia.group("desde") is not None:
+                desde = int(coincidencia.group("desde"))
+                hasta = int(coincidencia.group("hasta")) if coincidencia.group("hasta") else desde
+                rango = (desde, hasta)
+            minimo = int(coincidencia.group("minimo") or 1)
+            patrones.append(Patron("$" + coincidencia.group("id"), datos, rango, minimo))
+    cerrar_regla()
+    return reglas
+
+
+def cargar_automata(ruta_reglas=None):
+    """Autómata con las reglas por defecto más las del fichero indicado (si existe)."""
+    reglas = list(REGLAS_POR_DEFECTO)
+    if ruta_reglas and os.path.isfile(ruta_reglas):
+        reglas.extend(cargar_reglas(ruta_reglas))
+    return Automata(reglas)
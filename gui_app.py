@@ -2,12 +2,17 @@ import threading
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 
+from barrido import formatear_resumen
 from mod_0486 import (
     analizar_eicar_core,
+    barrido_eicar_core,
     hardening_sistema_info,
     politicas_contrasenas_info,
     backup_directorio_core,
+    restaurar_backup_core,
+    MODOS_BACKUP,
 )
+from compresion_paralela import CODECS
 from mod_0487 import (
     ejecutar_nmap,
     simulacion_auditoria_info,
@@ -108,12 +113,24 @@ class SecurityAppGUI(tk.Tk):
         origen_var = tk.StringVar()
         ttk.Entry(frame, textvariable=origen_var).grid(row=3, column=1, sticky="ew", padx=5, pady=(15, 0))
         ttk.Button(frame, text="Seleccionar", command=lambda: self._seleccionar_directorio(origen_var)).grid(row=3, column=2, pady=(15, 0))
+        modo_var = tk.StringVar(value=MODOS_BACKUP[0])
+        ttk.Combobox(frame, textvariable=modo_var, values=MODOS_BACKUP, state="readonly", width=12).grid(row=3, column=3, padx=5, pady=(15, 0))
+        compresion_var = tk.StringVar(value="gz")
+        ttk.Combobox(frame, textvariable=compresion_var, values=list(CODECS), state="readonly", width=8).grid(row=3, column=4, pady=(15, 0))
 
         ttk.Label(frame, text="Destino backup").grid(row=4, column=0, sticky="w")
         destino_var = tk.StringVar()
         ttk.Entry(frame, textvariable=destino_var).grid(row=4, column=1, sticky="ew", padx=5)
         ttk.Button(frame, text="Seleccionar", command=lambda: self._seleccionar_directorio(destino_var)).grid(row=4, column=2)
-        ttk.Button(frame, text="Crear backup", command=lambda: self._crear_backup(origen_var.get(), destino_var.get())).grid(row=4, column=3, padx=5)
+        ttk.Button(frame, text="Crear backup", command=lambda: self._crear_backup(origen_var.get(), destino_var.get(), modo_var.get(), compresion_var.get())).grid(row=4, column=3, padx=5)
+        ttk.Button(frame, text="Restaurar backup", command=self._restaurar_backup_gui).grid(row=4, column=4)
+
+        # Barrido recursivo
+        ttk.Label(frame, text="Directorio a barrer (malware)").grid(row=5, column=0, sticky="w", pady=(15, 0))
+        barrido_var = tk.StringVar()
+        ttk.Entry(frame, textvariable=barrido_var).grid(row=5, column=1, sticky="ew", padx=5, pady=(15, 0))
+        ttk.Button(frame, text="Seleccionar", command=lambda: self._seleccionar_directorio(barrido_var)).grid(row=5, column=2, pady=(15, 0))
+        ttk.Button(frame, text="Barrer", command=lambda: self._barrido_eicar_gui(barrido_var.get())).grid(row=5, column=3, padx=5, pady=(15, 0))
 
     def _analizar_eicar_gui(self, ruta):
         if not ruta:
@@ -123,27 +140,75 @@ class SecurityAppGUI(tk.Tk):
             resultado = analizar_eicar_core(ruta)
             if resultado["es_eicar"]:
                 self.log(f"[ALERTA] {ruta} coincide con la firma EICAR. MD5: {resultado['md5']}")
+            elif resultado["firma"]:
+                self.log(f"[ALERTA] {ruta} está en la base de firmas: {resultado['firma']}. MD5: {resultado['md5']}")
             else:
                 self.log(f"[OK] {ruta} no coincide con EICAR. MD5: {resultado['md5']}")
+            for coincidencia in resultado["contenido"]:
+                self.log(f"[ALERTA] {ruta}: el contenido coincide con la regla {coincidencia['regla']}")
+            if resultado["comprimido"]:
+                for miembro in resultado["comprimido"]["detecciones"]:
+                    motivo = miembro.get("firma") or ", ".join(c["regla"] for c in miembro["contenido"])
+                    self.log(f"[ALERTA] Miembro {miembro['ruta']}: {motivo}")
+                for alerta in resultado["comprimido"]["alertas"]:
+                    self.log(f"[ALERTA] {alerta}")
+            self.log(f"Lectura: {resultado['rendimiento']}")
         except Exception as exc:
             messagebox.showerror("Error", str(exc))
 
+    def _barrido_eicar_gui(self, directorio):
+        if not directorio:
+            messagebox.showwarning("Dato requerido", "Selecciona un directorio para analizar.")
+            return
+
+        def mostrar(resultado):
+            if "deteccion" in resultado:
+                self.log(f"[ALERTA] {resultado['ruta']} coincide con {resultado['deteccion']['descripcion']}")
+
+        def tarea():
+            try:
+                resumen = barrido_eicar_core(directorio, al_resultado=mostrar)
+                self.log(f"[OK] Barrido terminado: {formatear_resumen(resumen)}")
+            except Exception as exc:
+                messagebox.showerror("Error", str(exc))
+
+        threading.Thread(target=tarea, daemon=True).start()
+
     def _mostrar_hardening(self):
         self.log(hardening_sistema_info())
 
     def _mostrar_politicas(self):
         self.log(politicas_contrasenas_info())
 
-    def _crear_backup(self, origen, destino):
+    def _crear_backup(self, origen, destino, modo="completo", compresion="gz"):
         if not origen or not destino:
             messagebox.showwarning("Datos requeridos", "Selecciona el directorio de origen y destino.")
             return
         try:
-            archivo = backup_directorio_core(origen, destino)
-            self.log(f"[OK] Backup creado en: {archivo}")
+            archivo = backup_directorio_core(origen, destino, modo, compresion)
+            self.log(f"[OK] Backup {modo} creado en: {archivo}")
         except Exception as exc:
             messagebox.showerror("Error", str(exc))
 
+    def _restaurar_backup_gui(self):
+        manifiesto = filedialog.askopenfilename(
+            title="Seleccionar manifiesto del backup",
+            filetypes=[("Manifiestos de backup", "*.manifiesto.jsonl"), ("Instantáneas", "*.json"), ("Todos", "*")],
+        )
+        if not manifiesto:
+            return
+        destino = filedialog.askdirectory(title="Directorio donde restaurar")
+        if not destino:
+            return
+        try:
+            resultado = restaurar_backup_core(manifiesto, destino)
+        except Exception as exc:
+            messagebox.showerror("Error", str(exc))
+            return
+        for error in resultado["errores"]:
+            self.log(f"[ERROR] {error['ruta']}: {error['error']}")
+        self.log(f"[OK] Restaurados {resultado['archivos']} archivos en {destino}")
+
     # ------------------------------------------------------------------
     # Pestaña 0487
     # ------------------------------------------------------------------
@@ -0,0 +1,404 @@
+import os
+import sqlite3
+import threading
+
+from base_firmas import DIRECTORIO_FIRMAS, leer_csv_firmas
+from motor_hash import TAMANO_BUFFER
+
+
+ALGORITMO_SIMILITUD = "ssdeep"
+TAMANO_BLOQUE_MINIMO = 3
+LONGITUD_FIRMA = 64
+VENTANA = 7
+NUM_TAMANOS_BLOQUE = 31
+ESTADO_INICIAL = 0x27
+PRIMO_FNV = 0x01000193
+BASE64 = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/"
+MAX_BYTES_SIMILITUD = 8 * 1024 * 1024
+UMBRAL_SIMILITUD = 70
+MAX_CANDIDATOS = 500
+RUTA_INDICE_SIMILITUD = os.path.join(DIRECTORIO_FIRMAS, "similitud.sqlite")
+
+_MASCARA = 0xFFFFFFFF
+# El hash de cada trozo es FNV, pero solo se usan sus 6 bits bajos, que no
+# dependen del resto: basta una permutación de 64 estados por byte.
+_TABLAS_SUMA = [bytes(((h * PRIMO_FNV) ^ c) & 63 for h in range(256)) for c in range(256)]
+_IDENTIDAD = bytes(range(64))
+_VALOR_BASE64 = {caracter: indice for indice, caracter in enumerate(BASE64)}
+
+
+class HashSimilitud:
+    """Hash por trozos disparado por contexto (CTPH), compatible con ssdeep.
+
+    Se alimenta con bloques sucesivos, así que puede usarse como observador
+    de ``motor_hash.hash_stream`` junto con los digests exactos. Como la
+    versión en streaming de libfuzzy, calcula a la vez las firmas de todos
+    los tamaños de bloque candidatos y descarta los pequeños cuando ya no
+    pueden elegirse, de modo que no necesita conocer el tamaño de antemano.
+
+    El hash de los trozos no se actualiza por separado para cada tamaño de
+    bloque: se acumula una única permutación de estados desde el último
+    corte y se aplica a todos en cada corte.
+    """
+
+    def __init__(self, max_bytes=MAX_BYTES_SIMILITUD):
+        self.max_bytes = max_bytes
+        self.total = 0
+        self.excedido = False
+        self._h1 = self._h2 = self._h3 = 0
+        self._ventana = bytes(VENTANA)
+        self._segmento = _IDENTIDAD
+        self._inicio, self._fin = 0, 1
+        self._estados = [ESTADO_INICIAL] * NUM_TAMANOS_BLOQUE
+        self._estados_mitad = [ESTADO_INICIAL] * NUM_TAMANOS_BLOQUE
+        self._firmas = [[] for _ in range(NUM_TAMANOS_BLOQUE)]
+        self._ultimo = [None] * NUM_TAMANOS_BLOQUE
+        self._ultimo_mitad = [None] * NUM_TAMANOS_BLOQUE
+
+    def __call__(self, bloque):
+        if self.excedido:
+            return
+        if self.total + len(bloque) > self.max_bytes:
+            self.excedido = True
+            return
+        self.total += len(bloque)
+        datos = self._ventana + bloque
+        vista = memoryview(datos)
+        tablas, mascara, ventana = _TABLAS_SUMA, _MASCARA, VENTANA
+        h1, h2, h3 = self._h1, self._h2, self._h3
+        segmento = self._segmento
+        tamano = TAMANO_BLOQUE_MINIMO << self._inicio
+        objetivo = tamano - 1
+        # Cada byte nuevo entra en la ventana y sale el de VENTANA posiciones antes
+        for byte, saliente in zip(vista[ventana:], vista):
+            h2 += ventana * byte - h1
+            h1 += byte - saliente
+            h3 = ((h3 << 5) ^ byte) & mascara
+            segmento = segmento.translate(tablas[byte])
+            rolling = (h1 + h2 + h3) & mascara
+            if rolling % tamano == objetivo:
+                self._cortar(rolling, segmento)
+                segmento = _IDENTIDAD
+                tamano = TAMANO_BLOQUE_MINIMO << self._inicio
+                objetivo = tamano - 1
+        self._h1, self._h2, self._h3 = h1, h2, h3
+        self._segmento = segmento
+        self._ventana = bytes(vista[-VENTANA:])
+
+    def _aplicar_segmento(self, segmento):
+        for i in range(self._inicio, self._fin):
+            self._estados[i] = segmento[self._estados[i]]
+            self._estados_mitad[i] = segmento[self._estados_mitad[i]]
+
+    def _cortar(self, rolling, segmento):
+        """Cierra un trozo en todos los tamaños de bloque cuyo disparador se cumple."""
+        self._aplicar_segmento(segmento)
+        i = self._inicio
+        while i < self._fin:
+            tamano = TAMANO_BLOQUE_MINIMO << i
+            if rolling % tamano != tamano - 1:
+                break
+            firma = self._firmas[i]
+            if not firma:
+                self._bifurcar()
+            caracter = BASE64[self._estados[i]]
+            self._ultimo_mitad[i] = BASE64[self._estados_mitad[i]]
+            if len(firma) < LONGITUD_FIRMA - 1:
+                firma.append(caracter)
+                self._estados[i] = ESTADO_INICIAL
+                if len(firma) < LONGITUD_FIRMA // 2:
+                    self._estados_mitad[i] = ESTADO_INICIAL
+                    self._ultimo_mitad[i] = None
+            else:
+                # Firma llena: el último carácter sigue acumulando hasta el final
+                self._ultimo[i] = caracter
+                self._reducir()
+            i += 1
+
+    def _bifurcar(self):
+        """Empieza a calcular el siguiente tamaño de bloque a partir del último."""
+        if self._fin >= NUM_TAMANOS_BLOQUE:
+            return
+        anterior, nuevo = self._fin - 1, self._fin
+        self._estados[nuevo] = self._estados[anterior]
+        self._estados_mitad[nuevo] = self._estados_mitad[anterior]
+        self._firmas[nuevo] = []
+        self._ultimo[nuevo] = self._ultimo_mitad[nuevo] = None
+        self._fin += 1
+
+    def _reducir(self):
+        """Descarta el tamaño de bloque más pequeño si ya no puede elegirse."""
+        if self._fin - self._inicio < 2:
+            return
+        if (TAMANO_BLOQUE_MINIMO << self._inicio) * LONGITUD_FIRMA >= self.total:
+            return
+        if len(self._firmas[self._inicio + 1]) < LONGITUD_FIRMA // 2:
+            return
+        self._inicio += 1
+
+    def digest(self):
+        """Firma ``tamaño:firma:firma_doble`` o None si se superó ``max_bytes``."""
+        if self.excedido:
+            return None
+        rolling = (self._h1 + self._h2 + self._h3) & _MASCARA
+        estados = [self._segmento[estado] for estado in self._estados]
+        estados_mitad = [self._segmento[estado] for estado in self._estados_mitad]
+        i = self._inicio
+        while (TAMANO_BLOQUE_MINIMO << i) * LONGITUD_FIRMA < self.total:
+            i += 1
+        i = min(i, self._fin - 1)
+        while i > self._inicio and len(self._firmas[i]) < LONGITUD_FIRMA // 2:
+            i -= 1
+
+        primera = "".join(self._firmas[i])
+        if rolling:
+            primera += BASE64[estados[i]]
+        elif self._ultimo[i]:
+            primera += self._ultimo[i]
+        segunda = ""
+        if i < self._fin - 1:
+            siguiente = i + 1
+            segunda = "".join(self._firmas[siguiente][:LONGITUD_FIRMA // 2 - 1])
+            if rolling:
+                segunda += BASE64[estados_mitad[siguiente]]
+            elif self._ultimo_mitad[siguiente]:
+                segunda += self._ultimo_mitad[siguiente]
+        elif rolling:
+            segunda = BASE64[estados[i]]
+        return f"{TAMANO_BLOQUE_MINIMO << i}:{primera}:{segunda}"
+
+
+def hash_similitud_stream(f, tam_buffer=TAMANO_BUFFER, max_bytes=MAX_BYTES_SIMILITUD):
+    observador = HashSimilitud(max_bytes)
+    while not observador.excedido:
+        bloque = f.read(tam_buffer)
+        if not bloque:
+            break
+        observador(bloque)
+    return observador.digest()
+
+
+def hash_similitud_archivo(path, max_bytes=MAX_BYTES_SIMILITUD):
+    """Firma ssdeep de un fichero (None si es mayor que ``max_bytes``)."""
+    if os.path.getsize(path) > max_bytes:
+        return None
+    with open(path, "rb") as f:
+        return hash_similitud_stream(f, max_bytes=max_bytes)
+
+
+def es_firma_similitud(texto):
+    """Indica si ``texto`` tiene el formato ``tamaño:firma:firma``."""
+    partes = texto.strip().split(":")
+    if len(partes) != 3 or not partes[0].isdigit():
+        return False
+    return all(caracter in _VALOR_BASE64 for caracter in partes[1] + partes[2].split(",")[0])
+
+
+def _separar(firma):
+    tamano, primera, segunda = firma.strip().split(":", 2)
+    return int(tamano), primera, segunda.split(",", 1)[0]
+
+
+def _eliminar_secuencias(texto):
+    """Acorta las repeticiones de más de 3 caracteres iguales (no aportan información)."""
+    resultado = []
+    for caracter in texto:
+        if len(resultado) >= 3 and resultado[-1] == resultado[-2] == resultado[-3] == caracter:
+            continue
+        resultado.append(caracter)
+    return "".join(resultado)
+
+
+def _ngramas(texto):
+    return {texto[i:i + VENTANA] for i in range(len(texto) - VENTANA + 1)}
+
+
+def _distancia_edicion(a, b):
+    """Distancia de edición con inserción/borrado de coste 1 y sustitución de coste 2."""
+    anterior = list(range(len(b) + 1))
+    for i, caracter_a in enumerate(a, start=1):
+        actual = [i]
+        for j, caracter_b in enumerate(b, start=1):
+            sustitucion = anterior[j - 1] + (0 if caracter_a == caracter_b else 2)
+            actual.append(min(anterior[j] + 1, actual[j - 1] + 1, sustitucion))
+        anterior = actual
+    return anterior[-1]
+
+
+def _puntuar(a, b, tamano):
+    if len(a) > LONGITUD_FIRMA or len(b) > LONGITUD_FIRMA:
+        return 0
+    # Sin una subcadena común del tamaño de la ventana la similitud es casual
+    if not _ngramas(a) & _ngramas(b):
+        return 0
+    puntuacion = _distancia_edicion(a, b) * LONGITUD_FIRMA // (len(a) + len(b))
+    puntuacion = 100 * puntuacion // LONGITUD_FIRMA
+    if puntuacion >= 100:
+        return 0
+    puntuacion = 100 - puntuacion
+    # Con bloques pequeños las firmas cortas coinciden por casualidad
+    if tamano >= (99 + VENTANA) // VENTANA * TAMANO_BLOQUE_MINIMO:
+        return puntuacion
+    return min(puntuacion, tamano // TAMANO_BLOQUE_MINIMO * min(len(a), len(b)))
+
+
+def comparar(firma1, firma2):
+    """Puntuación de similitud entre dos firmas ssdeep (0 a 100)."""
+    tamano1, a1, b1 = _separar(firma1)
+    tamano2, a2, b2 = _separar(firma2)
+    if tamano1 != tamano2 and tamano1 != tamano2 * 2 and tamano2 != tamano1 * 2:
+        return 0
+    a1, b1, a2, b2 = (_eliminar_secuencias(texto) for texto in (a1, b1, a2, b2))
+    if tamano1 == tamano2 and a1 == a2 and b1 == b2:
+        return 100
+    if tamano1 == tamano2:
+        return max(_puntuar(a1, a2, tamano1), _puntuar(b1, b2, tamano1 * 2))
+    if tamano1 == tamano2 * 2:
+        return _puntuar(a1, b2, tamano1)
+    return _puntuar(b1, a2, tamano2)
+
+
+def claves_ngramas(firma):
+    """Claves de cubeta de una firma: (tamaño de bloque, 7-grama) empaquetados en un entero.
+
+    Dos firmas solo pueden puntuar por encima de 0 si comparten un 7-grama
+    en partes del mismo tamaño de bloque, así que estas cubetas no pierden
+    ningún candidato. Cada carácter ocupa 6 bits y el exponente del tamaño
+    de bloque va por encima, por lo que no hay colisiones.
+    """
+    tamano, primera, segunda = _separar(firma)
+    claves = set()
+    for tamano_parte, parte in ((tamano, primera), (tamano * 2, segunda)):
+        exponente = (tamano_parte // TAMANO_BLOQUE_MINIMO).bit_length()
+        for ngrama in _ngramas(_eliminar_secuencias(parte)):
+            clave = exponente
+            for caracter in ngrama:
+                clave = (clave << 6) | _VALOR_BASE64[caracter]
+            claves.add(clave)
+    return claves
+
+
+class IndiceSimilitud:
+    """Índice persistente (SQLite) de firmas ssdeep con cubetas de 7-gramas.
+
+    Una consulta solo compara la muestra con las firmas que comparten alguna
+    cubeta, ordenadas por número de cubetas comunes, en lugar de recorrer
+    todo el corpus por parejas.
+    """
+
+    def __init__(self, ruta=RUTA_INDICE_SIMILITUD):
+        directorio = os.path.dirname(ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        self.ruta = ruta
+        self._lock = threading.Lock()
+        self._conexion = sqlite3.connect(ruta, check_same_thread=False)
+        self._conexion.execute("PRAGMA journal_mode=WAL")
+        self._conexion.execute("PRAGMA synchronous=NORMAL")
+        self._conexion.execute(
+            """CREATE TABLE IF NOT EXISTS firmas (
+                id INTEGER PRIMARY KEY,
+                firma TEXT NOT NULL UNIQUE,
+                descripcion TEXT NOT NULL
+            )"""
+        )
+        self._conexion.execute(
+            """CREATE TABLE IF NOT EXISTS cubetas (
+                clave INTEGER NOT NULL,
+                firma INTEGER NOT NULL,
+                PRIMARY KEY (clave, firma)
+            ) WITHOUT ROWID"""
+        )
+        self._conexion.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cerrar()
+
+    def __len__(self):
+        with self._lock:
+            return self._conexion.execute("SELECT COUNT(*) FROM firmas").fetchone()[0]
+
+    def _anadir(self, firma, descripcion):
+        cursor = self._conexion.execute(
+            "INSERT OR IGNORE INTO firmas (firma, descripcion) VALUES (?, ?)", (firma, descripcion)
+        )
+        if not cursor.rowcount:
+            return False
+        identificador = cursor.lastrowid
+        self._conexion.executemany(
+            "INSERT OR IGNORE INTO cubetas VALUES (?, ?)",
+            ((clave, identificador) for clave in claves_ngramas(firma)),
+        )
+        return True
+
+    def anadir(self, firma, descripcion=""):
+        """Añade una firma al índice; devuelve False si ya estaba."""
+        firma = firma.strip()
+        with self._lock:
+            anadida = self._anadir(firma, descripcion or "Firma sin descripción")
+            self._conexion.commit()
+        return anadida
+
+    def importar(self, pares):
+        """Importa pares (firma, descripción) en una sola transacción."""
+        importadas, ignoradas = 0, 0
+        with self._lock:
+            for firma, descripcion in pares:
+                firma = firma.strip()
+                if not es_firma_similitud(firma):
+                    ignoradas += 1
+                elif self._anadir(firma, " ".join(descripcion.split()) or "Firma sin descripción"):
+                    importadas += 1
+            self._conexion.commit()
+        return {"importadas": importadas, "ignoradas": ignoradas, "total": len(self)}
+
+    def buscar(self, firma, umbral=UMBRAL_SIMILITUD, maximo=10, max_candidatos=MAX_CANDIDATOS):
+        """Firmas del índice con similitud >= ``umbral``, de mayor a menor.
+
+        Solo se puntúan los ``max_candidatos`` que más cubetas comparten
+        con la muestra.
+        """
+        claves = list(claves_ngramas(firma))
+        if not claves:
+            return []
+        marcadores = ",".join("?" * len(claves))
+        with self._lock:
+            candidatos = self._conexion.execute(
+                f"""SELECT f.firma, f.descripcion FROM firmas f JOIN (
+                        SELECT firma, COUNT(*) AS comunes FROM cubetas
+                        WHERE clave IN ({marcadores}) GROUP BY firma
+                        ORDER BY comunes DESC LIMIT ?
+                    ) c ON c.firma = f.id""",
+                (*claves, max_candidatos),
+            ).fetchall()
+        resultados = []
+        for candidata, descripcion in candidatos:
+            puntuacion = comparar(firma, candidata)
+            if puntuacion >= umbral:
+                resultados.append({"firma": candidata, "descripcion": descripcion, "puntuacion": puntuacion})
+        resultados.sort(key=lambda resultado: resultado["puntuacion"], reverse=True)
+        return resultados[:maximo]
+
+    def cerrar(self):
+        with self._lock:
+            if self._conexion is not None:
+                self._conexion.close()
+                self._conexion = None
+
+
+def abrir_indice_similitud(ruta=RUTA_INDICE_SIMILITUD):
+    """Abre el índice si existe; si no, devuelve None (no hay corpus)."""
+    if not os.path.isfile(ruta):
+        return None
+    return IndiceSimilitud(ruta)
+
+
+def importar_csv_similitud(ruta_csv, ruta=RUTA_INDICE_SIMILITUD, columna_hash=0, columna_descripcion=1):
+    """Importa las firmas ssdeep de un feed CSV (las demás filas se ignoran)."""
+    if not os.path.isfile(ruta_csv):
+        raise FileNotFoundError("El archivo no existe.")
+    with IndiceSimilitud(ruta) as indice:
+        return indice.importar(leer_csv_firmas(ruta_csv, columna_hash, columna_descripcion))
@@ -0,0 +1,278 @@
+import hashlib
+import lzma
+import os
+import sqlite3
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from compresion_paralela import LectorDescomprimido
+from motor_hash import TAMANO_BUFFER
+
+
+SUFIJO_INDICE = ".indice.sqlite"
+REGISTROS_POR_TANDA = 5000
+GRUPOS_POR_HILO = 4
+
+_ESQUEMA = (
+    """CREATE TABLE IF NOT EXISTS miembros (
+        ruta TEXT PRIMARY KEY,
+        cabecera INTEGER NOT NULL,
+        datos INTEGER NOT NULL,
+        tamano INTEGER NOT NULL,
+        modo INTEGER NOT NULL,
+        mtime_ns INTEGER NOT NULL,
+        hash TEXT NOT NULL
+    ) WITHOUT ROWID""",
+    "CREATE TABLE IF NOT EXISTS bloques (numero INTEGER PRIMARY KEY, desplazamiento INTEGER NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS metadatos (clave TEXT PRIMARY KEY, valor TEXT NOT NULL)",
+)
+_COLUMNAS = ("ruta", "cabecera", "datos", "tamano", "modo", "mtime_ns", "hash")
+
+
+# SQLite no admite en TEXT las rutas con bytes no UTF-8 (surrogateescape), así que se
+# guardan como BLOB; los índices anteriores las tienen como TEXT y también se leen.
+def _codificar_ruta(ruta):
+    return ruta.encode("utf-8", "surrogateescape")
+
+
+def _miembro(fila):
+    miembro = dict(zip(_COLUMNAS, fila))
+    if isinstance(miembro["ruta"], bytes):
+        miembro["ruta"] = miembro["ruta"].decode("utf-8", "surrogateescape")
+    return miembro
+
+
+def ruta_indice(ruta_archivo):
+    """Índice que acompaña a un ``backup_*.tar[.gz|.bz2|.xz]``."""
+    return ruta_archivo[:ruta_archivo.rindex(".tar")] + SUFIJO_INDICE
+
+
+class EscritorIndice:
+    """Escribe el índice de miembros de un tar mientras se genera.
+
+    Por cada archivo se guarda la posición de su cabecera y de sus datos
+    dentro del tar sin comprimir; la tabla de bloques (ver
+    EscritorComprimido.bloques) traduce esas posiciones a posiciones en el
+    archivo comprimido. Se escribe en un temporal que solo se publica al
+    salir del ``with`` sin errores, cuando el compresor ya está cerrado.
+    """
+
+    def __init__(self, ruta, archivo, raiz, compresion, algoritmo):
+        self.ruta = ruta
+        self._metadatos = {"archivo": archivo, "raiz": raiz, "compresion": compresion, "algoritmo": algoritmo}
+        self._comprimido = None
+        self._tanda = []
+        if os.path.exists(ruta + ".tmp"):
+            os.remove(ruta + ".tmp")
+        self._conexion = sqlite3.connect(ruta + ".tmp")
+        self._conexion.execute("PRAGMA journal_mode=OFF")
+        self._conexion.execute("PRAGMA synchronous=OFF")
+        for sentencia in _ESQUEMA:
+            self._conexion.execute(sentencia)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, tipo, *exc):
+        if tipo is None:
+            self.cerrar()
+        else:
+            self._conexion.close()
+            os.remove(self.ruta + ".tmp")
+
+    def asociar(self, comprimido):
+        """Compresor (EscritorComprimido) del que se tomará la tabla de bloques al cerrar."""
+        self._comprimido = comprimido
+
+    def anadir(self, ruta, cabecera, datos, tamano, modo, mtime_ns, digest):
+        self._tanda.append((_codificar_ruta(ruta), cabecera, datos, tamano, modo, mtime_ns, digest))
+        if len(self._tanda) >= REGISTROS_POR_TANDA:
+            self._volcar()
+
+    def _volcar(self):
+        self._conexion.executemany("INSERT OR REPLACE INTO miembros VALUES (?, ?, ?, ?, ?, ?, ?)", self._tanda)
+        self._tanda.clear()
+
+    def cerrar(self):
+        self._volcar()
+        self._conexion.executemany("INSERT INTO bloques VALUES (?, ?)", enumerate(self._comprimido.bloques))
+        self._metadatos["tam_bloque"] = self._comprimido.tam_bloque or 0
+        self._conexion.executemany("INSERT INTO metadatos VALUES (?, ?)",
+                                   ((clave, str(valor)) for clave, valor in self._metadatos.items()))
+        self._conexion.commit()
+        self._conexion.close()
+        os.replace(self.ruta + ".tmp", self.ruta)
+
+
+class IndiceBackup:
+    """Índice de miembros de un backup abierto en solo lectura."""
+
+    def __init__(self, ruta_archivo):
+        self.ruta_archivo = ruta_archivo
+        self._conexion = sqlite3.connect(f"file:{ruta_indice(ruta_archivo)}?mode=ro", uri=True,
+                                         check_same_thread=False)
+        self.metadatos = dict(self._conexion.execute("SELECT clave, valor FROM metadatos"))
+        self.compresion = self.metadatos["compresion"]
+        self.tam_bloque = int(self.metadatos["tam_bloque"])
+        self.raiz = self.metadatos["raiz"]
+        self._bloques = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cerrar()
+
+    def cerrar(self):
+        self._conexion.close()
+
+    def buscar(self, ruta):
+        """Miembro por su ruta relativa (se admite también con la carpeta raíz delante)."""
+        consulta = f"SELECT {', '.join(_COLUMNAS)} FROM miembros WHERE ruta IN (?, ?)"
+        candidatas = [ruta]
+        if ruta.startswith(self.raiz + "/"):
+            candidatas.append(ruta[len(self.raiz) + 1:])
+        for candidata in candidatas:
+            codificada = _codificar_ruta(candidata)
+            texto = codificada.decode("utf-8", "replace")
+            fila = self._conexion.execute(consulta, (codificada, texto)).fetchone()
+            if fila is not None:
+                return _miembro(fila)
+        return None
+
+    def miembros(self):
+        """Todos los miembros en el orden en que están en el tar."""
+        filas = self._conexion.execute(f"SELECT {', '.join(_COLUMNAS)} FROM miembros ORDER BY datos")
+        return [_miembro(fila) for fila in filas]
+
+    def cargar_bloques(self):
+        """Lleva la tabla de bloques a memoria (necesario antes de leer desde varios hilos)."""
+        filas = self._conexion.execute("SELECT desplazamiento FROM bloques ORDER BY numero")
+        self._bloques = [fila[0] for fila in filas]
+
+    def bloque(self, numero):
+        """Posición en el archivo comprimido donde empieza el bloque ``numero``."""
+        if self._bloques is not None:
+            return self._bloques[numero]
+        return self._conexion.execute("SELECT desplazamiento FROM bloques WHERE numero = ?", (numero,)).fetchone()[0]
+
+
+def abrir_indice(ruta_archivo):
+    """IndiceBackup de ``ruta_archivo`` o None si el backup no tiene índice."""
+    if ".tar" not in os.path.basename(ruta_archivo) or not os.path.isfile(ruta_indice(ruta_archivo)):
+        return None
+    return IndiceBackup(ruta_archivo)
+
+
+class _LectorPosicionado:
+    """Lee rangos del tar sin comprimir saltando al bloque comprimido que los contiene.
+
+    Si el siguiente rango está poco más adelante se sigue descomprimiendo
+    en lugar de volver a saltar.
+    """
+
+    def __init__(self, indice):
+        self._indice = indice
+        self._f = open(indice.ruta_archivo, "rb")
+        self._lector = None
+        self._posicion = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._f.close()
+
+    def reiniciar(self):
+        """Descarta el flujo actual (tras un error); la siguiente lectura vuelve a saltar."""
+        self._lector = None
+
+    def _situar(self, inicio):
+        if self._indice.compresion == "ninguna":
+            self._f.seek(inicio)
+            self._lector, self._posicion = self._f, inicio
+            return
+        tam_bloque = self._indice.tam_bloque
+        if self._lector is None or not self._posicion <= inicio < self._posicion + tam_bloque:
+            numero = inicio // tam_bloque
+            self._f.seek(self._indice.bloque(numero))
+            self._lector = LectorDescomprimido(self._f, self._indice.compresion)
+            self._posicion = numero * tam_bloque
+        while self._posicion < inicio:
+            saltados = len(self._lector.read(min(TAMANO_BUFFER, inicio - self._posicion)))
+            if not saltados:
+                raise EOFError("El backup es más corto de lo que indica su índice.")
+            self._posicion += saltados
+
+    def leer(self, inicio, tamano):
+        """Genera el contenido de ``[inicio, inicio + tamano)`` en bloques."""
+        self._situar(inicio)
+        while tamano > 0:
+            datos = self._lector.read(min(TAMANO_BUFFER, tamano))
+            if not datos:
+                raise EOFError("El backup es más corto de lo que indica su índice.")
+            self._posicion += len(datos)
+            tamano -= len(datos)
+            yield datos
+
+
+def extraer_miembro(indice, miembro, ruta):
+    """Escribe en ``ruta`` el contenido de ``miembro`` y devuelve si su hash coincide."""
+    digest = hashlib.new(indice.metadatos["algoritmo"])
+    with _LectorPosicionado(indice) as lector, open(ruta, "wb") as f:
+        for datos in lector.leer(miembro["datos"], miembro["tamano"]):
+            digest.update(datos)
+            f.write(datos)
+    os.chmod(ruta, miembro["modo"])
+    os.utime(ruta, ns=(miembro["mtime_ns"], miembro["mtime_ns"]))
+    return digest.hexdigest() == miembro["hash"]
+
+
+def _verificar_grupo(indice, miembros):
+    errores, total = [], 0
+    with _LectorPosicionado(indice) as lector:
+        for miembro in miembros:
+            digest = hashlib.new(indice.metadatos["algoritmo"])
+            try:
+                for datos in lector.leer(miembro["datos"], miembro["tamano"]):
+                    digest.update(datos)
+            except (OSError, EOFError, zlib.error, lzma.LZMAError) as exc:
+                errores.append({"ruta": miembro["ruta"], "error": str(exc)})
+                lector.reiniciar()
+                continue
+            if digest.hexdigest() != miembro["hash"]:
+                errores.append({"ruta": miembro["ruta"], "error": "El hash no coincide"})
+            total += miembro["tamano"]
+    return errores, total
+
+
+def verificar_con_indice(indice, hilos=None):
+    """Comprueba el hash de todos los miembros repartiéndolos entre ``hilos`` hilos.
+
+    Los miembros se agrupan en tramos consecutivos del tar de tamaño
+    parecido y cada hilo descomprime los suyos saltando directamente al
+    primer bloque del tramo (zlib, bz2, lzma y hashlib liberan el GIL).
+    """
+    inicio = time.perf_counter()
+    hilos = hilos or os.cpu_count() or 1
+    miembros = indice.miembros()
+    indice.cargar_bloques()
+    objetivo = sum(miembro["tamano"] for miembro in miembros) / (hilos * GRUPOS_POR_HILO) or 1
+    grupos, actual, acumulado = [], [], 0
+    for miembro in miembros:
+        actual.append(miembro)
+        acumulado += miembro["tamano"]
+        if acumulado >= objetivo:
+            grupos.append(actual)
+            actual, acumulado = [], 0
+    if actual:
+        grupos.append(actual)
+    errores, total = [], 0
+    with ThreadPoolExecutor(hilos) as pool:
+        for errores_grupo, bytes_grupo in pool.map(lambda grupo: _verificar_grupo(indice, grupo), grupos):
+            errores.extend(errores_grupo)
+            total += bytes_grupo
+    segundos = time.perf_counter() - inicio
+    return {"miembros": len(miembros), "bytes": total, "errores": errores, "segundos": segundos,
+            "mb_s": total / (1024 * 1024) / segundos if segundos > 0 else 0.0}
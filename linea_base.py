@@ -0,0 +1,568 @@
+import fnmatch
+import hashlib
+import json
+import os
+import stat
+import time
+
+from barrido import agrupar_en_lotes, hashear_lote, mapear_lotes, recorrer_archivos
+from cache_hashes import VENTANA_MTIME_NS, cache_por_defecto, calcular_hashes_cacheado, clave_stat
+from motor_hash import TAMANO_BUFFER, calcular_hashes
+
+
+FORMATO = "linea_base"
+VERSION = 1
+ALGORITMO = "sha256"
+RUTA_LINEA_BASE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.jsonl")
+CAMPOS_STAT = ("tamano", "mtime_ns", "ctime_ns", "inodo", "modo")
+PROCESOS_DISCO_ROTACIONAL = 2
+TAMANO_BLOQUE = 4 * 1024 * 1024
+UMBRAL_BLOQUES = 64 * 1024 * 1024
+INTERVALO_PROGRESO_S = 0.5
+
+
+def metadatos(st):
+    """Campos del stat que se guardan en la línea base para cada archivo."""
+    return {
+        "tamano": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+        "ctime_ns": st.st_ctime_ns,
+        "inodo": st.st_ino,
+        "modo": st.st_mode,
+    }
+
+
+def hashear(ruta, usar_cache=True):
+    calcular = calcular_hashes_cacheado if usar_cache else calcular_hashes
+    resultado = calcular(ruta, (ALGORITMO,))
+    return resultado["hashes"][ALGORITMO], resultado["bytes"]
+
+
+class HashBloques:
+    """Observador de ``hash_stream`` que calcula un hash por bloque de tamaño fijo."""
+
+    def __init__(self, tam_bloque=TAMANO_BLOQUE):
+        self.tam_bloque = tam_bloque
+        self.bloques = []
+        self._actual = hashlib.new(ALGORITMO)
+        self._llenos = 0
+
+    def __call__(self, datos):
+        posicion = 0
+        while posicion < len(datos):
+            parte = datos[posicion:posicion + self.tam_bloque - self._llenos]
+            self._actual.update(parte)
+            self._llenos += len(parte)
+            posicion += len(parte)
+            if self._llenos == self.tam_bloque:
+                self.bloques.append(self._actual.hexdigest())
+                self._actual = hashlib.new(ALGORITMO)
+                self._llenos = 0
+
+    def digest(self):
+        """Lista de hashes por bloque (el último puede ser parcial)."""
+        if self._llenos:
+            self.bloques.append(self._actual.hexdigest())
+            self._actual = hashlib.new(ALGORITMO)
+            self._llenos = 0
+        return self.bloques
+
+
+def hashear_bloques(ruta, tam_bloque=TAMANO_BLOQUE):
+    """Devuelve (digest, bytes leídos, hashes por bloque) leyendo el archivo una vez."""
+    bloques = HashBloques(tam_bloque)
+    resultado = calcular_hashes(ruta, (ALGORITMO,), observadores=(bloques,))
+    return resultado["hashes"][ALGORITMO], resultado["bytes"], bloques.digest()
+
+
+def hashear_lote_bloques(rutas, algoritmos):
+    """Como ``barrido.hashear_lote``, pero los archivos grandes llevan también sus hashes por bloque."""
+    resultados = []
+    for ruta in rutas:
+        try:
+            st = os.stat(ruta)
+            if st.st_size < UMBRAL_BLOQUES:
+                resultados.extend(hashear_lote([ruta], algoritmos))
+                continue
+            digest, leidos, bloques = hashear_bloques(ruta)
+            resultado = {"ruta": ruta, "hashes": {ALGORITMO: digest}, "bytes": leidos, "bloques": bloques}
+            if clave_stat(os.stat(ruta)) == clave_stat(st):
+                resultado["clave"] = clave_stat(st)
+            resultados.append(resultado)
+        except OSError as exc:
+            resultados.append({"ruta": ruta, "error": str(exc)})
+    return resultados
+
+
+def _hash_rango(ruta, inicio, fin):
+    digest = hashlib.new(ALGORITMO)
+    with open(ruta, "rb") as f:
+        f.seek(inicio)
+        pendiente = fin - inicio
+        while pendiente > 0:
+            bloque = f.read(min(TAMANO_BUFFER, pendiente))
+            if not bloque:
+                break
+            digest.update(bloque)
+            pendiente -= len(bloque)
+    return digest.hexdigest()
+
+
+def rangos_cambiados(originales, actuales, tam_bloque, tamano_original, tamano_actual):
+    """Rangos de bytes ``[inicio, fin)`` cuyos bloques difieren, con los contiguos unidos."""
+    rangos = []
+    fin_total = max(tamano_original, tamano_actual)
+    for indice in range(max(len(originales), len(actuales))):
+        if indice < len(originales) and indice < len(actuales) and originales[indice] == actuales[indice]:
+            continue
+        inicio = indice * tam_bloque
+        fin = min(inicio + tam_bloque, fin_total)
+        if rangos and rangos[-1][1] == inicio:
+            rangos[-1][1] = fin
+        else:
+            rangos.append([inicio, fin])
+    return rangos
+
+
+class EscritorLineaBase:
+    """Escribe una línea base en JSONL: una cabecera y un registro por archivo.
+
+    Cada registro es una línea JSON independiente, así que el fichero se
+    escribe y se lee en streaming sin cargarlo entero en memoria. Al
+    terminar, ``terminar`` añade una línea final que marca la línea base
+    como completa.
+
+    Con ``reanudar`` se continúa una línea base interrumpida (sin esa
+    marca; una completa se vuelve a crear desde cero): se descarta la
+    última línea si quedó a medias, y también los registros de archivos
+    cuyo tamaño o mtime ya no coinciden, que se volverán a hashear.
+    ``hechas`` contiene las rutas que se conservan.
+    """
+
+    def __init__(self, ruta=RUTA_LINEA_BASE, reanudar=False):
+        self.ruta = ruta
+        self.registros = 0
+        self.hechas = set()
+        if reanudar and os.path.exists(ruta) and self._recuperar():
+            self._f = open(ruta, "a", encoding="utf-8")
+            return
+        self.creada_ns = time.time_ns()
+        self._f = open(ruta, "w", encoding="utf-8")
+        self._escribir({
+            "formato": FORMATO,
+            "version": VERSION,
+            "algoritmo": ALGORITMO,
+            "creada": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "creada_ns": self.creada_ns,
+        })
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cerrar()
+
+    def _recuperar(self):
+        """Reescribe una línea base interrumpida con sus registros completos y aún válidos.
+
+        Devuelve False si no es una línea base, o si está terminada.
+        """
+        with open(self.ruta, "rb") as f, open(self.ruta + ".tmp", "wb") as salida:
+            primera = f.readline()
+            try:
+                cabecera = json.loads(primera)
+            except ValueError:
+                cabecera = None
+            if not isinstance(cabecera, dict) or cabecera.get("formato") != FORMATO:
+                salida.close()
+                os.remove(self.ruta + ".tmp")
+                return False
+            salida.write(primera)
+            hechas = set()
+            for linea in f:
+                try:
+                    registro = json.loads(linea)
+                    if registro.get("fin"):
+                        salida.close()
+                        os.remove(self.ruta + ".tmp")
+                        return False
+                    ruta = registro["ruta"]
+                except (ValueError, KeyError, AttributeError):
+                    break
+                if not linea.endswith(b"\n"):
+                    break
+                if ruta in hechas or not self._sigue_igual(registro):
+                    continue
+                hechas.add(ruta)
+                salida.write(linea)
+        os.replace(self.ruta + ".tmp", self.ruta)
+        self.hechas = hechas
+        self.creada_ns = cabecera["creada_ns"]
+        self.registros = len(self.hechas)
+        return True
+
+    @staticmethod
+    def _sigue_igual(registro):
+        try:
+            st = os.stat(registro["ruta"])
+        except OSError:
+            return False
+        return st.st_size == registro.get("tamano") and st.st_mtime_ns == registro.get("mtime_ns")
+
+    def _escribir(self, datos):
+        # ensure_ascii: las rutas con bytes no UTF-8 (surrogateescape) no se pueden codificar tal cual;
+        # json.loads las devuelve igual que las da os.scandir, así que reanudar y verificar las comparan sin más
+        self._f.write(json.dumps(datos, separators=(",", ":")))
+        self._f.write("\n")
+
+    def anadir(self, ruta, digest, st, bloques=None):
+        registro = {"ruta": ruta, "hash": digest, **metadatos(st)}
+        if bloques is not None:
+            registro["tam_bloque"] = TAMANO_BLOQUE
+            registro["bloques"] = bloques
+        self._escribir(registro)
+        self.registros += 1
+
+    def terminar(self):
+        """Marca la línea base como completa (ya no se reanudará)."""
+        self._escribir({"fin": True, "registros": self.registros, "terminada": time.strftime("%Y-%m-%d %H:%M:%S")})
+
+    def volcar(self):
+        self._f.flush()
+
+    def cerrar(self):
+        if not self._f.closed:
+            self._f.close()
+
+
+def leer_linea_base(ruta=RUTA_LINEA_BASE):
+    """Devuelve (cabecera, registros) de una línea base; los registros se leen en streaming.
+
+    También acepta el formato antiguo (un único objeto JSON ruta -> hash),
+    cuyos registros no tienen metadatos y por tanto se rehashean siempre.
+    """
+    f = open(ruta, "r", encoding="utf-8")
+    primera = f.readline()
+    try:
+        cabecera = json.loads(primera)
+    except json.JSONDecodeError:
+        cabecera = None
+    if not isinstance(cabecera, dict) or cabecera.get("formato") != FORMATO:
+        f.seek(0)
+        with f:
+            antigua = json.load(f)
+        registros = ({"ruta": ruta_archivo, "hash": info["hash"]} for ruta_archivo, info in antigua.items())
+        return {"formato": "json", "algoritmo": ALGORITMO, "creada_ns": None}, registros
+
+    def registros():
+        with f:
+            for linea in f:
+                if linea.strip():
+                    registro = json.loads(linea)
+                    if not registro.get("fin"):
+                        yield registro
+
+    return cabecera, registros()
+
+
+def crear_linea_base_core(rutas, ruta_salida=RUTA_LINEA_BASE, al_resultado=None, bloques=False):
+    """Hashea los archivos indicados y guarda su hash y metadatos en ``ruta_salida``.
+
+    Con ``bloques``, de los archivos de al menos ``UMBRAL_BLOQUES`` se guarda
+    también un hash por cada bloque de ``TAMANO_BLOQUE``. Cada resultado
+    (``{"ruta", "hash"}`` o ``{"ruta", "error"}``) se entrega a
+    ``al_resultado``. Devuelve el número de archivos guardados y los errores.
+    """
+    errores = []
+    with EscritorLineaBase(ruta_salida) as escritor:
+        for ruta in rutas:
+            try:
+                st = os.stat(ruta)
+                if not stat.S_ISREG(st.st_mode):
+                    raise FileNotFoundError
+                if bloques and st.st_size >= UMBRAL_BLOQUES:
+                    digest, _, hashes_bloques = hashear_bloques(ruta)
+                else:
+                    (digest, _), hashes_bloques = hashear(ruta), None
+                escritor.anadir(ruta, digest, st, hashes_bloques)
+                resultado = {"ruta": ruta, "hash": digest}
+            except FileNotFoundError:
+                resultado = {"ruta": ruta, "error": "No encontrado"}
+                errores.append(resultado)
+            except OSError as exc:
+                resultado = {"ruta": ruta, "error": exc.strerror or str(exc)}
+                errores.append(resultado)
+            if al_resultado:
+                al_resultado(resultado)
+        escritor.terminar()
+        return {"archivos": escritor.registros, "errores": errores}
+
+
+def _es_rotacional(ruta):
+    """Indica si ``ruta`` está en un disco rotacional (None si no se sabe)."""
+    try:
+        dispositivo = os.stat(ruta).st_dev
+        base = f"/sys/dev/block/{os.major(dispositivo)}:{os.minor(dispositivo)}"
+        for cola in (f"{base}/queue/rotational", f"{base}/../queue/rotational"):
+            if os.path.exists(cola):
+                with open(cola) as f:
+                    return f.read().strip() == "1"
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def procesos_por_defecto(raices):
+    """Procesos de hasheo adecuados al almacenamiento de ``raices``.
+
+    En discos rotacionales más lectores concurrentes solo añaden saltos del
+    cabezal, así que se usan pocos; en SSD/NVMe (o si no se sabe) uno por CPU.
+    """
+    if any(_es_rotacional(raiz) for raiz in raices):
+        return PROCESOS_DISCO_ROTACIONAL
+    return os.cpu_count() or 1
+
+
+def _coincide(ruta, patrones):
+    nombre = os.path.basename(ruta)
+    return any(fnmatch.fnmatch(ruta, patron) or fnmatch.fnmatch(nombre, patron) for patron in patrones)
+
+
+def _archivos_seleccionados(raices, incluir, excluir, hechas, errores):
+    """Genera (ruta, stat) de los archivos bajo ``raices`` que pasan los filtros.
+
+    Los patrones glob se comparan con la ruta completa y con el nombre; un
+    directorio excluido no se recorre.
+    """
+    descartar = (lambda ruta: _coincide(ruta, excluir)) if excluir else None
+    for raiz in raices:
+        for ruta, st in recorrer_archivos(raiz, errores, descartar):
+            if ruta in hechas:
+                continue
+            if incluir and not _coincide(ruta, incluir):
+                continue
+            if excluir and _coincide(ruta, excluir):
+                continue
+            yield ruta, st
+
+
+def crear_linea_base_directorios_core(raices, ruta_salida=RUTA_LINEA_BASE, incluir=(), excluir=(),
+                                      procesos=None, reanudar=False, al_progreso=None, bloques=False):
+    """Crea la línea base de todos los archivos bajo ``raices`` en paralelo.
+
+    Primero se cuentan los archivos y bytes (solo ``stat``) para poder dar
+    el progreso y la hora estimada de fin; después se hashean por lotes en
+    un pool de procesos (ver ``procesos_por_defecto``), reutilizando la
+    caché de hashes. Los registros se escriben según terminan, así que con
+    ``reanudar`` una ejecución interrumpida continúa donde se quedó (los
+    archivos que han cambiado desde entonces se vuelven a hashear); sin
+    ``reanudar``, o si la línea base anterior terminó, se crea de nuevo.
+    ``al_progreso`` recibe como mucho cada medio segundo un diccionario con
+    archivos, bytes, totales, MB/s y segundos restantes. ``bloques`` es como
+    en ``crear_linea_base_core``.
+    """
+    raices = sorted({os.path.abspath(os.path.expanduser(raiz)) for raiz in raices})
+    for raiz in raices:
+        if not os.path.isdir(raiz):
+            raise NotADirectoryError(f"El directorio no existe: {raiz}")
+    # Una raíz dentro de otra ya se recorre con ella
+    raices = [raiz for raiz in raices
+              if not any(raiz.startswith(otra.rstrip(os.sep) + os.sep) for otra in raices if otra != raiz)]
+    procesos = procesos or procesos_por_defecto(raices)
+    cache = cache_por_defecto()
+    errores = []
+
+    with EscritorLineaBase(ruta_salida, reanudar) as escritor:
+        reanudados = escritor.registros
+        total_archivos, total_bytes = 0, 0
+        for _, st in _archivos_seleccionados(raices, incluir, excluir, escritor.hechas, []):
+            total_archivos += 1
+            total_bytes += st.st_size
+
+        archivos, bytes_hechos, bytes_leidos = 0, 0, 0
+        inicio = time.perf_counter()
+        ultimo_aviso = 0.0
+        # stat de los archivos en vuelo, para guardar los metadatos de cada resultado
+        en_vuelo = {}
+
+        def seleccionados():
+            for ruta, st in _archivos_seleccionados(raices, incluir, excluir, escritor.hechas, errores):
+                en_vuelo[ruta] = st
+                yield ruta, st
+
+        if bloques:
+            # La caché solo guarda el hash completo: los archivos grandes se leen siempre
+            lotes = agrupar_en_lotes(seleccionados(), (ALGORITMO,), cache,
+                                     sin_cache=lambda st: st.st_size >= UMBRAL_BLOQUES)
+            hashear_lotes = hashear_lote_bloques
+        else:
+            lotes = agrupar_en_lotes(seleccionados(), (ALGORITMO,), cache)
+            hashear_lotes = hashear_lote
+        for resultados in mapear_lotes(lotes, (ALGORITMO,), procesos, hashear_lotes):
+            for resultado in resultados:
+                st = en_vuelo.pop(resultado["ruta"], None)
+                if st is None:
+                    # Misma ruta dos veces (p. ej. por un enlace entre raíces): ya se ha guardado
+                    continue
+                if "error" in resultado:
+                    errores.append(resultado)
+                    continue
+                if not resultado.get("cache"):
+                    bytes_leidos += resultado["bytes"]
+                    if "clave" in resultado:
+                        cache.guardar(resultado.pop("clave"), resultado["hashes"])
+                escritor.anadir(resultado["ruta"], resultado["hashes"][ALGORITMO], st, resultado.get("bloques"))
+                archivos += 1
+                bytes_hechos += st.st_size
+            ahora = time.perf_counter()
+            if ahora - ultimo_aviso >= INTERVALO_PROGRESO_S:
+                ultimo_aviso = ahora
+                escritor.volcar()
+                if al_progreso:
+                    segundos = ahora - inicio
+                    velocidad = bytes_hechos / segundos if segundos > 0 else 0.0
+                    al_progreso({
+                        "archivos": archivos,
+                        "total_archivos": total_archivos,
+                        "bytes": bytes_hechos,
+                        "total_bytes": total_bytes,
+                        "mb_s": velocidad / (1024 * 1024),
+                        "eta_s": (total_bytes - bytes_hechos) / velocidad if velocidad > 0 else None,
+                    })
+        escritor.terminar()
+
+    segundos = time.perf_counter() - inicio
+    return {
+        "archivos": archivos,
+        "reanudados": reanudados,
+        "bytes": bytes_hechos,
+        "bytes_leidos": bytes_leidos,
+        "errores": errores,
+        "segundos": segundos,
+        "archivos_s": archivos / segundos if segundos > 0 else 0.0,
+        "mb_s": bytes_hechos / (1024 * 1024) / segundos if segundos > 0 else 0.0,
+    }
+
+
+def _cambio_metadatos(registro, st, creada_ns):
+    """Indica si hay que rehashear el archivo según sus metadatos."""
+    if any(campo not in registro for campo in CAMPOS_STAT):
+        return True
+    if max(registro["mtime_ns"], registro["ctime_ns"]) >= creada_ns - VENTANA_MTIME_NS:
+        # Modificado poco antes de crear la línea base: un cambio posterior
+        # dentro de la misma marca de tiempo no movería mtime
+        return True
+    return metadatos(st) != {campo: registro[campo] for campo in CAMPOS_STAT}
+
+
+def _comprobar_crecimiento(registro, st):
+    """Detecta si un archivo con hashes por bloque solo ha crecido por el final.
+
+    Basta con releer el último bloque original: si coincide, lo añadido
+    empieza justo donde acababa el archivo. Los bloques anteriores no se
+    releen (el modo paranoico sí lo hace). Devuelve ``(cambio, bytes_leidos)``
+    o None si no es un crecimiento por el final.
+    """
+    original, bloques = registro["tamano"], registro["bloques"]
+    if st.st_size <= original or not bloques:
+        return None
+    inicio = (len(bloques) - 1) * registro["tam_bloque"]
+    if _hash_rango(registro["ruta"], inicio, original) != bloques[-1]:
+        return None
+    return {
+        "ruta": registro["ruta"],
+        "tipo": "crecido",
+        "tamano_original": original,
+        "tamano_actual": st.st_size,
+        "rangos": [[original, st.st_size]],
+    }, original - inicio
+
+
+def comprobar_registro(registro, creada_ns, paranoico=False):
+    """Compara un archivo con su registro de la línea base.
+
+    Devuelve ``(cambio, bytes_leidos)``: ``cambio`` es None si no hay
+    diferencias y ``bytes_leidos`` es None si bastó con el ``stat``. Si el
+    registro tiene hashes por bloque, un archivo que solo ha crecido se
+    avisa como ``crecido`` sin leerlo entero y en los modificados se
+    indican los rangos de bytes que han cambiado.
+    """
+    ruta = registro["ruta"]
+    try:
+        st = os.stat(ruta)
+    except FileNotFoundError:
+        return {"ruta": ruta, "tipo": "eliminado"}, None
+    except OSError as exc:
+        return {"ruta": ruta, "tipo": "error", "error": exc.strerror or str(exc)}, None
+    if not paranoico and not _cambio_metadatos(registro, st, creada_ns):
+        return None, None
+    try:
+        if "bloques" in registro:
+            crecimiento = None if paranoico else _comprobar_crecimiento(registro, st)
+            if crecimiento is not None:
+                return crecimiento
+            digest, leidos, bloques = hashear_bloques(ruta, registro["tam_bloque"])
+        else:
+            (digest, leidos), bloques = hashear(ruta, usar_cache=not paranoico), None
+    except OSError as exc:
+        return {"ruta": ruta, "tipo": "error", "error": exc.strerror or str(exc)}, None
+    if digest != registro["hash"]:
+        cambio = {"ruta": ruta, "tipo": "modificado", "hash_original": registro["hash"], "hash_actual": digest}
+        if bloques is not None:
+            cambio["rangos"] = rangos_cambiados(registro["bloques"], bloques, registro["tam_bloque"],
+                                                registro["tamano"], st.st_size)
+        return cambio, leidos
+    if "modo" in registro and registro["modo"] != st.st_mode:
+        return {
+            "ruta": ruta,
+            "tipo": "permisos",
+            "modo_original": stat.filemode(registro["modo"]),
+            "modo_actual": stat.filemode(st.st_mode),
+        }, leidos
+    return None, leidos
+
+
+def verificar_linea_base_core(ruta=RUTA_LINEA_BASE, paranoico=False, al_cambio=None):
+    """Compara los archivos con la línea base haciendo primero solo un ``stat``.
+
+    Solo se rehashean los archivos cuyo tamaño, mtime, ctime, inodo o modo
+    han cambiado; con ``paranoico`` se rehashean todos. Los cambios
+    (``eliminado``, ``modificado``, ``crecido``, ``permisos`` o ``error``)
+    se entregan a ``al_cambio`` según se detectan. Devuelve un resumen con
+    los cambios y cuántos archivos se han tenido que leer.
+    """
+    cabecera, registros = leer_linea_base(ruta)
+    creada_ns = cabecera.get("creada_ns") or 0
+    cambios = []
+    archivos, rehasheados, bytes_leidos = 0, 0, 0
+    inicio = time.perf_counter()
+
+    for registro in registros:
+        archivos += 1
+        cambio, leidos = comprobar_registro(registro, creada_ns, paranoico)
+        if leidos is not None:
+            rehasheados += 1
+            bytes_leidos += leidos
+        if cambio is not None:
+            cambios.append(cambio)
+            if al_cambio:
+                al_cambio(cambio)
+
+    segundos = time.perf_counter() - inicio
+    return {
+        "archivos": archivos,
+        "rehasheados": rehasheados,
+        "bytes_leidos": bytes_leidos,
+        "cambios": cambios,
+        "segundos": segundos,
+        "archivos_s": archivos / segundos if segundos > 0 else 0.0,
+    }
+
+
+def formatear_resumen(resumen):
+    """Texto con el resumen de una verificación."""
+    return (
+        f"{resumen['archivos']} archivos comprobados en {resumen['segundos']:.2f} s "
+        f"({resumen['archivos_s']:.0f} archivos/s); rehasheados: {resumen['rehasheados']} "
+        f"({resumen['bytes_leidos'] / (1024 * 1024):.2f} MB leídos). Cambios: {len(resumen['cambios'])}"
+    )
@@ -1,17 +1,79 @@
 import os
-import hashlib
-import tarfile
-from datetime import datetime
 import platform
 
+from archivos_comprimidos import analizar_archivo_comprimido, es_archivo_comprimido
+from barrido import barrido_malware_core, formatear_resumen
+from base_firmas import abrir_firmas
+from cache_hashes import cache_por_defecto, calcular_hashes_cacheado
+from cifrado_flujo import generar_clave
+from compresion_paralela import CODECS
+from copias_seguridad import (
+    MODOS,
+    crear_copia,
+    extraer_miembro,
+    listar_copias,
+    listar_miembros,
+    restaurar_copia,
+    verificar_copia,
+)
+from escaner_contenido import automata_por_defecto
+from motor_hash import calcular_hashes, formatear_rendimiento
+from repositorio_dedup import abrir_repositorio, es_repositorio
+
+
+HASH_EICAR = "44d88612fea8a8f36de82e1278abb02f"
+FIRMAS_EICAR = {HASH_EICAR: "EICAR Test File"}
+MODOS_BACKUP = MODOS + ("deduplicado",)
+
+
+def buscar_en_firmas(hashes, firmas=None):
+    """Busca los hashes en la base de firmas en disco (si existe) y en EICAR."""
+    if firmas is None:
+        with abrir_firmas(extra=FIRMAS_EICAR) as firmas:
+            return buscar_en_firmas(hashes, firmas)
+    for valor in hashes.values():
+        descripcion = firmas.get(valor)
+        if descripcion is not None:
+            return descripcion
+    return None
+
 
 def analizar_eicar_core(path):
-    """Devuelve el hash MD5 del archivo y si coincide con EICAR."""
+    """Devuelve los hashes del archivo y si coincide con EICAR.
+
+    En la misma lectura se pasa el contenido por el escáner de firmas de
+    bytes, que encuentra la cadena EICAR (y las reglas de
+    reglas_contenido.txt) aunque esté incrustada en un archivo mayor. Si es
+    un tar/zip/gz/bz2/xz, sus miembros se analizan también en memoria.
+    """
     if not os.path.isfile(path):
         raise FileNotFoundError("El archivo no existe.")
-    hash_eicar = "44d88612fea8a8f36de82e1278abb02f"
-    md5 = file_hash(path)
-    return {"md5": md5, "es_eicar": md5 == hash_eicar}
+    automata = automata_por_defecto()
+    escaneo = automata.nuevo_escaneo()
+    resultado = calcular_hashes_cacheado(path, ("md5", "sha1", "sha256"), observadores=(escaneo,))
+    hashes = resultado["hashes"]
+    comprimido = None
+    with abrir_firmas(extra=FIRMAS_EICAR) as firmas:
+        if es_archivo_comprimido(path):
+            comprimido = analizar_archivo_comprimido(path, ("md5", "sha1", "sha256"), firmas, automata)
+        firma = buscar_en_firmas(hashes, firmas)
+    return {
+        "firma": firma,
+        "comprimido": comprimido,
+        "contenido": escaneo.resultado(),
+        "md5": hashes["md5"],
+        "sha1": hashes["sha1"],
+        "sha256": hashes["sha256"],
+        "es_eicar": hashes["md5"] == HASH_EICAR,
+        "rendimiento": formatear_rendimiento(resultado),
+    }
+
+
+def barrido_eicar_core(directorio, procesos=None, al_resultado=None):
+    """Analiza recursivamente un directorio en paralelo buscando EICAR y las firmas de la base."""
+    with abrir_firmas(extra=FIRMAS_EICAR) as firmas:
+        return barrido_malware_core(directorio, firmas, ("md5", "sha1", "sha256"), procesos, al_resultado,
+                                    cache_por_defecto())
 
 
 def hardening_sistema_info():
@@ -58,40 +120,136 @@ def politicas_contrasenas_info():
     return "\n".join(lineas)
 
 
-def backup_directorio_core(origen, destino):
-    """Crea un backup comprimido y devuelve la ruta generada."""
-    if not os.path.isdir(origen):
-        raise NotADirectoryError("El directorio de origen no existe.")
-    os.makedirs(destino, exist_ok=True)
-    fecha = datetime.now().strftime("%Y%m%d_%H%M%S")
-    backup_file = os.path.join(destino, f"backup_{fecha}.tar.gz")
-    with tarfile.open(backup_file, "w:gz") as tar:
-        tar.add(origen, arcname=os.path.basename(origen))
-    return backup_file
+def backup_directorio_core(origen, destino, modo="completo", compresion="gz", nivel=None):
+    """Crea un backup comprimido y devuelve la ruta generada.
+
+    ``modo`` es ``completo``, ``incremental`` (solo lo cambiado desde la
+    última copia) o ``diferencial`` (desde la última completa); junto al
+    tar se guarda un manifiesto con el que se puede restaurar cada copia.
+    Con ``deduplicado``, ``destino`` es un repositorio de trozos
+    deduplicados y se devuelve la ruta de la instantánea creada.
+
+    El tar se comprime en paralelo con ``compresion`` (``gz``, ``bz2``,
+    ``xz`` o ``ninguna``) y ``nivel`` (None = el del formato).
+    """
+    if modo == "deduplicado":
+        with abrir_repositorio(destino) as repositorio:
+            return repositorio.crear_instantanea(origen)["ruta"]
+    return crear_copia(origen, destino, modo, compresion=compresion, nivel=nivel)["archivo"]
+
+
+def backup_cifrado_core(origen, destino, modo="completo", compresion="gz", nivel=None, clave=None):
+    """Crea un backup comprimido y cifrado en un solo paso, sin tar en claro en disco.
+
+    El tar, la compresión y el cifrado (AES-256-GCM por trozos) se
+    encadenan en streaming con memoria acotada. Sin ``clave`` se genera
+    una nueva; para encadenar incrementales conviene reutilizar la misma.
+    """
+    if modo not in MODOS:
+        raise ValueError(f"Modo no válido para un backup cifrado: {modo}")
+    clave = clave or generar_clave()
+    resultado = crear_copia(origen, destino, modo, compresion=compresion, nivel=nivel, clave=clave)
+    return {"archivo": resultado["archivo"], "clave": clave}
+
+
+def listar_backups_core(destino):
+    """Devuelve las copias de ``destino`` (manifiestos o instantáneas), de la más antigua a la más reciente."""
+    if not os.path.isdir(destino):
+        raise NotADirectoryError("El directorio de backups no existe.")
+    if es_repositorio(destino):
+        with abrir_repositorio(destino, crear=False) as repositorio:
+            return [
+                {**instantanea, "tipo": "deduplicado", "archivo": instantanea["id"],
+                 "manifiesto": os.path.join(destino, "instantaneas", instantanea["id"] + ".json")}
+                for instantanea in repositorio.instantaneas()
+            ]
+    return listar_copias(destino)
+
+
+def restaurar_backup_core(manifiesto, destino, clave=None):
+    """Restaura en ``destino`` el directorio tal como estaba en la copia de ``manifiesto``.
+
+    ``manifiesto`` puede ser el manifiesto de un tar.gz o el archivo de una
+    instantánea de un repositorio deduplicado (``instantaneas/<id>.json``).
+    Las copias cifradas necesitan su ``clave``.
+    """
+    if not os.path.isfile(manifiesto):
+        raise FileNotFoundError("El manifiesto no existe.")
+    directorio, nombre = os.path.split(os.path.abspath(manifiesto))
+    if os.path.basename(directorio) == "instantaneas" and es_repositorio(os.path.dirname(directorio)):
+        with abrir_repositorio(os.path.dirname(directorio), crear=False) as repositorio:
+            return repositorio.restaurar(nombre[:-len(".json")], destino)
+    return restaurar_copia(manifiesto, destino, clave=clave)
+
+
+def mantenimiento_repositorio_core(ruta, accion, identificador=None):
+    """Comprueba (``comprobar``/``comprobar_datos``) o purga (``purgar``) un repositorio deduplicado.
+
+    Con ``olvidar`` se borra la instantánea ``identificador`` y a
+    continuación se purgan los trozos que solo usaba ella.
+    """
+    with abrir_repositorio(ruta, crear=False) as repositorio:
+        if accion in ("comprobar", "comprobar_datos"):
+            return repositorio.comprobar(leer_datos=accion == "comprobar_datos")
+        if accion == "olvidar":
+            repositorio.olvidar(identificador)
+        elif accion != "purgar":
+            raise ValueError(f"Acción desconocida: {accion}")
+        return repositorio.purgar()
 
 # ---------------------------
 # 1. Análisis de malware (EICAR)
 # ---------------------------
-def file_hash(path):
-    """Calcula el hash MD5 de un fichero"""
-    h = hashlib.md5()
-    with open(path, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            h.update(chunk)
-    return h.hexdigest()
+def file_hash(path, algoritmo="md5", usar_cache=False):
+    """Calcula el hash (MD5 por defecto) de un fichero"""
+    algoritmo = algoritmo.lower()
+    calcular = calcular_hashes_cacheado if usar_cache else calcular_hashes
+    return calcular(path, (algoritmo,))["hashes"][algoritmo]
 
 def analizar_eicar():
     path = input("Ruta del archivo a analizar (ej: muestras/eicar.com): ").strip()
     try:
         resultado = analizar_eicar_core(path)
         print("MD5 calculado:", resultado["md5"])
+        print("SHA256 calculado:", resultado["sha256"])
+        print("Lectura:", resultado["rendimiento"])
+        for coincidencia in resultado["contenido"]:
+            offsets = ", ".join(
+                f"{patron}@{datos['offsets'][0]}" for patron, datos in coincidencia["patrones"].items()
+            )
+            print(f"[ALERTA] El contenido coincide con la regla {coincidencia['regla']} ({offsets})")
         if resultado["es_eicar"]:
             print("[ALERTA] Archivo coincide con la firma EICAR (debe ser detectado por el antivirus).")
-        else:
+        elif resultado["firma"]:
+            print(f"[ALERTA] Archivo presente en la base de firmas: {resultado['firma']}")
+        elif not resultado["contenido"]:
             print("[OK] Archivo no coincide con EICAR.")
+        comprimido = resultado["comprimido"]
+        if comprimido:
+            print(f"Contenedor {comprimido['tipo']}: {len(comprimido['miembros'])} miembros analizados en memoria.")
+            for miembro in comprimido["detecciones"]:
+                motivo = miembro.get("firma") or ", ".join(c["regla"] for c in miembro["contenido"])
+                print(f"[ALERTA] Miembro {miembro['ruta']}: {motivo}")
+            for alerta in comprimido["alertas"]:
+                print(f"[ALERTA] {alerta}")
     except FileNotFoundError as exc:
         print(f"[ERROR] {exc}")
 
+def barrido_eicar():
+    directorio = input("Directorio a analizar recursivamente: ").strip()
+
+    def mostrar(resultado):
+        if "deteccion" in resultado:
+            print(f"[ALERTA] {resultado['ruta']} coincide con {resultado['deteccion']['descripcion']}")
+        elif "error" in resultado:
+            print(f"[ERROR] {resultado['ruta']}: {resultado['error']}")
+
+    try:
+        resumen = barrido_eicar_core(directorio, al_resultado=mostrar)
+        print("[OK] Barrido terminado:", formatear_resumen(resumen))
+    except NotADirectoryError as exc:
+        print(f"[ERROR] {exc}")
+
 # ---------------------------
 # 2. Hardening del sistema
 # ---------------------------
@@ -110,15 +268,126 @@ def politicas_contrasenas():
 def backup_directorio():
     origen = input("Ruta del directorio a respaldar: ").strip()
     destino = input("Ruta donde guardar el backup: ").strip()
+    modo = input(f"Modo ({'/'.join(MODOS_BACKUP)}) [completo]: ").strip().lower() or "completo"
+    if modo not in MODOS_BACKUP:
+        print("[ERROR] Modo no válido.")
+        return
+    compresion, nivel = "gz", None
+    if modo != "deduplicado":
+        compresion = input(f"Compresión ({'/'.join(CODECS)}) [gz]: ").strip().lower() or "gz"
+        if compresion not in CODECS:
+            print("[ERROR] Compresión no válida.")
+            return
+        if CODECS[compresion]["niveles"]:
+            niveles = CODECS[compresion]["niveles"]
+            texto = input(f"Nivel ({niveles[0]}-{niveles[-1]}) [{CODECS[compresion]['nivel']}]: ").strip()
+            if texto and (not texto.isdigit() or int(texto) not in niveles):
+                print("[ERROR] Nivel no válido.")
+                return
+            nivel = int(texto) if texto else None
+    cifrar = modo != "deduplicado" and input("¿Cifrar el backup? (s/N): ").strip().lower() == "s"
     try:
-        backup_file = backup_directorio_core(origen, destino)
-        print(f"[OK] Backup creado en: {backup_file}")
+        if cifrar:
+            clave = input("Clave (vacía para generar una nueva): ").strip() or None
+            resultado = backup_cifrado_core(origen, destino, modo, compresion, nivel, clave)
+            print(f"[OK] Backup cifrado creado en: {resultado['archivo']}")
+            if clave is None:
+                print(f"Clave para descifrado: {resultado['clave']} (guárdala en lugar seguro)")
+        else:
+            backup_file = backup_directorio_core(origen, destino, modo, compresion, nivel)
+            print(f"[OK] Backup creado en: {backup_file}")
         print("👉 Para automatizar, añade este script a cron (Linux) o al Programador de Tareas (Windows).")
     except NotADirectoryError as exc:
         print(f"[ERROR] {exc}")
     except Exception as exc:
         print(f"[ERROR] No se pudo crear el backup: {exc}")
 
+def restaurar_backup():
+    directorio = input("Ruta donde están los backups: ").strip()
+    try:
+        copias = listar_backups_core(directorio)
+    except NotADirectoryError as exc:
+        print(f"[ERROR] {exc}")
+        return
+    if not copias:
+        print("[ERROR] No hay backups con manifiesto en ese directorio.")
+        return
+    for indice, copia in enumerate(copias, 1):
+        print(f"{indice}. {copia['creado']} - {copia['tipo']} - {copia['origen']} ({copia['archivo']})")
+    eleccion = input("Número de la copia a restaurar: ").strip()
+    if not eleccion.isdigit() or not 1 <= int(eleccion) <= len(copias):
+        print("[ERROR] Opción no válida.")
+        return
+    copia = copias[int(eleccion) - 1]
+    destino = input("Directorio donde restaurar: ").strip()
+    clave = input("Clave de descifrado: ").strip() if copia.get("cifrado") else None
+    try:
+        resultado = restaurar_backup_core(copia["manifiesto"], destino, clave)
+    except Exception as exc:
+        print(f"[ERROR] No se pudo restaurar el backup: {exc}")
+        return
+    for error in resultado["errores"]:
+        print(f"[ERROR] {error['ruta']}: {error['error']}")
+    print(f"[OK] Restaurados {resultado['archivos']} archivos en {destino}")
+
+def mantenimiento_repositorio():
+    ruta = input("Ruta del repositorio deduplicado: ").strip()
+    print("1. Comprobar índice e instantáneas")
+    print("2. Comprobar leyendo todos los datos")
+    print("3. Olvidar una instantánea y purgar")
+    print("4. Purgar trozos sin usar")
+    acciones = {"1": "comprobar", "2": "comprobar_datos", "3": "olvidar", "4": "purgar"}
+    accion = acciones.get(input("Selecciona una opción: ").strip())
+    if accion is None:
+        print("[ERROR] Opción no válida.")
+        return
+    identificador = input("Identificador de la instantánea: ").strip() if accion == "olvidar" else None
+    try:
+        resultado = mantenimiento_repositorio_core(ruta, accion, identificador)
+    except Exception as exc:
+        print(f"[ERROR] {exc}")
+        return
+    if accion.startswith("comprobar"):
+        for error in resultado["errores"]:
+            print(f"[ERROR] {error}")
+        print(f"[OK] {resultado['instantaneas']} instantáneas, {resultado['paquetes']} paquetes, "
+              f"{resultado['trozos']} trozos; errores: {len(resultado['errores'])}")
+    else:
+        print(f"[OK] Liberados {resultado['trozos']} trozos ({resultado['bytes'] / (1024 * 1024):.2f} MB), "
+              f"{resultado['paquetes']} paquetes reescritos o borrados")
+
+def explorar_backup():
+    archivo = input("Ruta del backup (.tar.*): ").strip()
+    if not os.path.isfile(archivo):
+        print("[ERROR] El archivo no existe.")
+        return
+    clave = input("Clave de descifrado: ").strip() if archivo.endswith(".enc") else None
+    print("Órdenes: listar | extraer <ruta> [destino] | verificar | salir")
+    while True:
+        orden, _, argumentos = input("backup> ").strip().partition(" ")
+        try:
+            if orden == "listar":
+                for miembro in listar_miembros(archivo, clave):
+                    print(f"{miembro['tamano']:>12}  {miembro['ruta']}")
+            elif orden == "extraer" and argumentos:
+                ruta, _, destino = argumentos.strip().partition(" ")
+                resultado = extraer_miembro(archivo, ruta, destino.strip() or ".", clave)
+                if resultado["hash_correcto"] is False:
+                    print(f"[ERROR] El hash de {ruta} no coincide con el del backup.")
+                print(f"[OK] {resultado['ruta']} ({resultado['bytes']} bytes, {resultado['segundos']:.2f} s)")
+            elif orden == "verificar":
+                resultado = verificar_copia(archivo, clave=clave)
+                for error in resultado["errores"]:
+                    print(f"[ERROR] {error['ruta']}: {error['error']}")
+                print(f"[OK] {resultado['miembros']} archivos comprobados a {resultado['mb_s']:.1f} MB/s; "
+                      f"errores: {len(resultado['errores'])}")
+            elif orden == "salir":
+                return
+            else:
+                print("[ERROR] Orden no válida.")
+        except Exception as exc:
+            print(f"[ERROR] {exc}")
+
 # ---------------------------
 # Menú principal
 # ---------------------------
@@ -129,7 +398,11 @@ def menu():
         print("2. Hardening del sistema operativo")
         print("3. Políticas de contraseñas")
         print("4. Copia de seguridad de directorio")
-        print("5. Volver al menú principal")
+        print("5. Barrido recursivo de malware (directorio)")
+        print("6. Restaurar copia de seguridad")
+        print("7. Mantenimiento del repositorio deduplicado")
+        print("8. Explorar backup (listar, extraer un archivo, verificar)")
+        print("9. Volver al menú principal")
 
         opcion = input("Selecciona una opción: ").strip()
 
@@ -142,6 +415,14 @@ def menu():
         elif opcion == "4":
             backup_directorio()
         elif opcion == "5":
+            barrido_eicar()
+        elif opcion == "6":
+            restaurar_backup()
+        elif opcion == "7":
+            mantenimiento_repositorio()
+        elif opcion == "8":
+            explorar_backup()
+        elif opcion == "9":
             os.system('cls' if os.name == 'nt' else 'clear')
             print("Volviendo al menú principal...")
             break
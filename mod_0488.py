@@ -1,7 +1,8 @@
-import re
 from datetime import datetime
 import os
 
+from analisis_logs import analizar_auth_log
+
 
 def phishing_analisis_core(ruta):
     if not os.path.isfile(ruta):
@@ -28,13 +29,15 @@ def registro_incidente_core(titulo, descripcion, archivo):
 
 
 def analisis_forense_core(log_path):
+    """IPs con intentos de acceso fallidos y su número, de más a menos."""
+    return dict(analisis_auth_log_core(log_path)["fallos_por_ip"].most_common())
+
+
+def analisis_auth_log_core(log_path):
+    """Resumen completo de un auth.log leído en streaming (ver analisis_logs.analizar_auth_log)."""
     if not os.path.isfile(log_path):
         raise FileNotFoundError("El archivo no existe.")
-    with open(log_path, "r", encoding="utf-8", errors="ignore") as f:
-        logs = f.read()
-    fallos = re.findall(r"Failed password.*from (\d+\.\d+\.\d+\.\d+)", logs)
-    conteo = {ip: fallos.count(ip) for ip in set(fallos)}
-    return conteo
+    return analizar_auth_log(log_path)
 
 
 def plan_respuesta_core(archivo):
@@ -84,15 +87,32 @@ def analisis_forense():
     print("\n--- Análisis forense básico ---")
     log_path = input("Ruta del archivo de logs (ej: auth.log): ").strip()
     try:
-        conteo = analisis_forense_core(log_path)
-        if conteo:
-            print("IPs con intentos de acceso fallidos:")
-            for ip, cantidad in conteo.items():
-                print(f"- {ip} ({cantidad} intentos)")
-        else:
-            print("[OK] No se detectaron intentos fallidos en los logs.")
+        resumen = analisis_auth_log_core(log_path)
     except FileNotFoundError as exc:
         print(f"[ERROR] {exc}")
+        return
+    except OSError as exc:
+        print(f"[ERROR] No se pudo leer el archivo: {exc}")
+        return
+    print(f"{resumen['lineas']} líneas, {resumen['eventos']} eventos de autenticación "
+          f"({resumen['primera_fecha'] or '-'} a {resumen['ultima_fecha'] or '-'})")
+    if resumen["fallos_por_ip"]:
+        print("IPs con intentos de acceso fallidos:")
+        for ip, cantidad in resumen["fallos_por_ip"].most_common(20):
+            fechas = resumen["fechas_por_ip"][ip]
+            print(f"- {ip} ({cantidad} intentos, {fechas['primera'] or '-'} a {fechas['ultima'] or '-'})")
+        print("Usuarios con más fallos: " + ", ".join(
+            f"{usuario} ({cantidad})" for usuario, cantidad in resumen["fallos_por_usuario"].most_common(10)))
+    else:
+        print("[OK] No se detectaron intentos fallidos en los logs.")
+    if resumen["usuarios_invalidos"]:
+        print("Usuarios inexistentes probados: " + ", ".join(
+            f"{usuario} ({cantidad})" for usuario, cantidad in resumen["usuarios_invalidos"].most_common(10)))
+    if resumen["accesos_por_usuario"]:
+        print("Accesos aceptados: " + ", ".join(
+            f"{usuario} ({cantidad})" for usuario, cantidad in resumen["accesos_por_usuario"].most_common(10)))
+    for acceso, cantidad in resumen["accesos_tras_fallos"].most_common():
+        print(f"[ALERTA] Acceso aceptado de {acceso} desde una IP con intentos fallidos ({cantidad})")
 
 # ---------------------------
 # 4. Plan de respuesta
@@ -1,46 +1,254 @@
+import getpass
+import hashlib
+import json
 import os
+import tempfile
+import time
 from cryptography.fernet import Fernet
 
+from almacen_claves import RUTA_ALMACEN, AlmacenClaves, rotar_claves
+from benchmark_cifrado import (
+    TAMANOS_POR_DEFECTO,
+    ejecutar_benchmark,
+    formatear_tabla,
+    formatear_tamano,
+    interpretar_tamano,
+)
+from cifrado_flujo import (
+    ArchivoCifradoAleatorio,
+    cifrar_archivo,
+    descifrar_archivo,
+    es_cifrado_por_trozos,
+    generar_clave,
+    hilos_por_defecto,
+    usa_frase,
+    usa_sobre,
+)
+from cifrado_lotes import cifrar_directorio, descifrar_directorio
+from derivacion_claves import CACHE, ClaveFrase, calibrar
 
-def cifrar_archivo_core(ruta):
+# ClaveFrase por frase de paso (indexada por su SHA-256) para cifrar en esta sesión
+_FRASES_CIFRADO = {}
+
+
+def _clave_frase(frase):
+    """Misma ClaveFrase, y por tanto misma sal, para todo lo que se cifre con ``frase`` en esta sesión."""
+    indice = hashlib.sha256(frase.encode("utf-8")).digest()
+    if indice not in _FRASES_CIFRADO:
+        _FRASES_CIFRADO[indice] = ClaveFrase(frase)
+    return _FRASES_CIFRADO[indice]
+
+
+def cifrar_archivo_core(ruta, hilos=None, almacen=None, frase=None):
+    """Cifra ``ruta`` en ``ruta.enc`` con una clave nueva y devuelve ambas.
+
+    Se usa el formato por trozos de cifrado_flujo (cabecera versionada y
+    AES-256-GCM por trozo de 1 MB), que cifra en streaming con memoria
+    constante sea cual sea el tamaño del archivo. Los trozos se cifran
+    en ``hilos`` hilos (por defecto, uno por CPU).
+
+    Con ``almacen`` (ruta de un almacén de claves) se usa cifrado de
+    sobre: la clave del archivo va en su cabecera, envuelta con la KEK
+    activa del almacén, y no hay que guardarla aparte (``clave`` es None).
+    Con ``frase`` (texto o ClaveFrase) la clave se deriva de la frase de
+    paso con scrypt y los parámetros quedan en la cabecera. Los archivos
+    cifrados con la misma frase en una sesión comparten sal, así que la
+    frase solo se deriva una vez al cifrarlos y al descifrarlos juntos.
+    """
     if not os.path.isfile(ruta):
         raise FileNotFoundError("El archivo no existe.")
-    key = Fernet.generate_key()
-    cipher = Fernet(key)
-    with open(ruta, "rb") as f:
-        data = f.read()
-    token = cipher.encrypt(data)
     archivo_cifrado = ruta + ".enc"
-    with open(archivo_cifrado, "wb") as f:
-        f.write(token)
-    return {"archivo": archivo_cifrado, "clave": key.decode()}
+    if frase:
+        frase = frase if isinstance(frase, ClaveFrase) else _clave_frase(frase)
+        cifrar_archivo(ruta, archivo_cifrado, frase, hilos=hilos)
+        return {"archivo": archivo_cifrado, "clave": None}
+    if almacen:
+        almacen = AlmacenClaves(almacen, crear=True)
+        cifrar_archivo(ruta, archivo_cifrado, almacen, hilos=hilos)
+        return {"archivo": archivo_cifrado, "clave": None, "kek": almacen.id_activa}
+    clave = generar_clave()
+    cifrar_archivo(ruta, archivo_cifrado, clave, hilos=hilos)
+    return {"archivo": archivo_cifrado, "clave": clave}
+
+
+def _clave_o_almacen(ruta, clave, almacen):
+    """Para archivos con cifrado de sobre la clave sale del almacén y ``clave`` se ignora.
+
+    En archivos cifrados con frase de paso ``clave`` es la frase.
+    """
+    if usa_sobre(ruta):
+        return AlmacenClaves(almacen or RUTA_ALMACEN, crear=False)
+    if usa_frase(ruta) and not isinstance(clave, ClaveFrase):
+        return ClaveFrase(clave)
+    return clave
 
 
-def descifrar_archivo_core(ruta, clave):
+def descifrar_archivo_core(ruta, clave, hilos=None, almacen=None):
+    """Descifra ``ruta`` en ``.dec``; admite el formato por trozos (con clave, frase o almacén) y el Fernet antiguo.
+
+    Las claves derivadas de frases de paso quedan unos minutos en una
+    caché en memoria, así que los archivos con la misma frase y la misma
+    sal (cifrados en la misma sesión) solo pagan la derivación una vez;
+    cada sal distinta necesita su propia derivación.
+    """
     if not os.path.isfile(ruta):
         raise FileNotFoundError("El archivo no existe.")
+    archivo_descifrado = ruta.replace(".enc", ".dec")
+    if es_cifrado_por_trozos(ruta):
+        descifrar_archivo(ruta, archivo_descifrado, _clave_o_almacen(ruta, clave, almacen), hilos=hilos)
+        return archivo_descifrado
+    # Formato antiguo: un único token Fernet con todo el archivo
     cipher = Fernet(clave.encode() if isinstance(clave, str) else clave)
     with open(ruta, "rb") as f:
         data = f.read()
     original = cipher.decrypt(data)
-    archivo_descifrado = ruta.replace(".enc", ".dec")
     with open(archivo_descifrado, "wb") as f:
         f.write(original)
     return archivo_descifrado
 
 
+def leer_rango_cifrado_core(ruta, clave, desplazamiento, longitud, almacen=None):
+    """Lee ``longitud`` bytes desde ``desplazamiento`` de un archivo cifrado sin descifrarlo entero.
+
+    Solo se descifran los trozos de 1 MB que cubren el rango; se devuelven
+    los datos, el tamaño en claro del archivo y los trozos descifrados.
+    """
+    if not os.path.isfile(ruta):
+        raise FileNotFoundError("El archivo no existe.")
+    if not es_cifrado_por_trozos(ruta):
+        raise ValueError("El acceso aleatorio solo es posible en el formato por trozos.")
+    with ArchivoCifradoAleatorio(ruta, _clave_o_almacen(ruta, clave, almacen)) as archivo:
+        archivo.seek(desplazamiento)
+        datos = archivo.read(longitud)
+        return {"datos": datos, "tamano": archivo.tamano, "trozos_descifrados": archivo.trozos_descifrados,
+                "trozos": archivo.trozos}
+
+
+def cifrar_directorio_core(origen, destino, clave_maestra=None, procesos=None, al_progreso=None):
+    """Cifra un árbol de directorios en paralelo con una clave por archivo.
+
+    Las claves quedan en ``destino/claves.jsonl`` envueltas con
+    ``clave_maestra`` (se genera una si no se indica); repetir la orden con
+    la misma clave maestra reanuda un cifrado interrumpido.
+    """
+    clave_maestra = clave_maestra or generar_clave()
+    resultado = cifrar_directorio(origen, destino, clave_maestra, procesos, al_progreso)
+    resultado["clave_maestra"] = clave_maestra
+    return resultado
+
+
+def descifrar_directorio_core(origen, destino, clave_maestra, procesos=None, al_progreso=None):
+    """Descifra en ``destino`` un directorio cifrado en lote con su clave maestra."""
+    if not os.path.isdir(origen):
+        raise NotADirectoryError("El directorio cifrado no existe.")
+    return descifrar_directorio(origen, destino, clave_maestra, procesos, al_progreso)
+
+
+def rotar_claves_core(rutas, almacen=RUTA_ALMACEN, hilos=None, retirar_anteriores=False):
+    """Rota la KEK del almacén y reenvuelve la clave de los archivos de ``rutas``.
+
+    Solo se reescribe la cabecera de cada archivo (76 bytes), en paralelo;
+    los datos cifrados no se leen ni se tocan.
+    """
+    for ruta in rutas:
+        if not os.path.exists(ruta):
+            raise FileNotFoundError(f"No existe: {ruta}")
+    return rotar_claves(rutas, AlmacenClaves(almacen, crear=False), hilos=hilos,
+                        retirar_anteriores=retirar_anteriores)
+
+
+def comparar_cifrados_core(tamanos=TAMANOS_POR_DEFECTO, hilos=(1, None), ruta_json=None, al_resultado=None):
+    """Compara Fernet, AES-256-GCM, ChaCha20-Poly1305 y AES-CTR+HMAC (ver benchmark_cifrado).
+
+    Mide cifrado y descifrado por tamaño de mensaje, mensaje entero frente
+    a trozos en streaming y uno frente a varios hilos: MB/s, percentiles
+    de latencia y pico de memoria. El resultado se guarda en ``ruta_json``
+    (por defecto ``benchmark_cifrado_<fecha>.json``).
+    """
+    informe = ejecutar_benchmark(tamanos=tamanos, hilos=hilos, al_resultado=al_resultado)
+    informe["fecha"] = time.strftime("%Y-%m-%d %H:%M:%S")
+    informe["json"] = ruta_json or time.strftime("benchmark_cifrado_%Y%m%d_%H%M%S.json")
+    with open(informe["json"], "w", encoding="utf-8") as f:
+        json.dump(informe, f, indent=2)
+    return informe
+
+
+def calibrar_kdf_core(objetivo_ms=500):
+    """Mide scrypt y PBKDF2 en esta máquina y guarda los costes que tardan ``objetivo_ms``."""
+    if objetivo_ms <= 0:
+        raise ValueError("El objetivo debe ser positivo.")
+    resultado = calibrar(objetivo_ms / 1000)
+    # Los siguientes cifrados con frase usan los costes nuevos (y otra sal)
+    _FRASES_CIFRADO.clear()
+    return resultado
+
+
 def generar_mfa_key():
     return Fernet.generate_key().decode()
 
+
+def benchmark_cifrado_core(tamano_mb=1024, hilos=None, directorio=None):
+    """Mide MB/s al cifrar y descifrar un archivo aleatorio de ``tamano_mb`` MB.
+
+    Se repite con cada número de hilos de ``hilos`` (por defecto 1, 2, 4...
+    hasta el número de CPUs) para ver cómo escala; la aceleración es
+    respecto a la primera medida. El archivo de prueba se crea en
+    ``directorio`` (o en el temporal del sistema) y se borra al terminar.
+    """
+    if hilos is None:
+        hilos, n = [], 1
+        while n < hilos_por_defecto():
+            hilos.append(n)
+            n *= 2
+        hilos.append(hilos_por_defecto())
+    clave = generar_clave()
+    resultados = []
+    with tempfile.TemporaryDirectory(dir=directorio) as temporal:
+        original = os.path.join(temporal, "original.bin")
+        cifrado = os.path.join(temporal, "original.bin.enc")
+        with open(original, "wb") as f:
+            for _ in range(tamano_mb):
+                f.write(os.urandom(1024 * 1024))
+        for n in hilos:
+            inicio = time.perf_counter()
+            cifrar_archivo(original, cifrado, clave, hilos=n)
+            segundos_cifrar = time.perf_counter() - inicio
+            inicio = time.perf_counter()
+            descifrar_archivo(cifrado, os.path.join(temporal, "descifrado.bin"), clave, hilos=n)
+            segundos_descifrar = time.perf_counter() - inicio
+            resultados.append({
+                "hilos": n,
+                "cifrar_mb_s": tamano_mb / segundos_cifrar,
+                "descifrar_mb_s": tamano_mb / segundos_descifrar,
+            })
+    for resultado in resultados:
+        resultado["aceleracion"] = resultado["cifrar_mb_s"] / resultados[0]["cifrar_mb_s"]
+    return resultados
+
 # ---------------------------
-# 1. Cifrado de archivos con Fernet
+# 1. Cifrado de archivos (AES-256-GCM por trozos)
 # ---------------------------
 def cifrado_archivo():
     ruta = input("Ruta del archivo a cifrar: ").strip()
+    tipo = input(f"Clave: 1) aleatoria, 2) almacén local {RUTA_ALMACEN}, 3) frase de paso [1]: ").strip() or "1"
+    if tipo not in ("1", "2", "3"):
+        print("[ERROR] Opción no válida.")
+        return
+    frase = None
+    if tipo == "3":
+        frase = getpass.getpass("Frase de paso: ")
+        if frase != getpass.getpass("Repite la frase de paso: "):
+            print("[ERROR] Las frases no coinciden.")
+            return
     try:
-        resultado = cifrar_archivo_core(ruta)
+        resultado = cifrar_archivo_core(ruta, almacen=RUTA_ALMACEN if tipo == "2" else None, frase=frase)
         print(f"[OK] Archivo cifrado guardado en {resultado['archivo']}")
-        print(f"Clave para descifrado: {resultado['clave']} (guárdala en lugar seguro)")
+        if tipo == "2":
+            print(f"Clave del archivo envuelta con la KEK {resultado['kek']} del almacén")
+        elif tipo == "3":
+            print("Para descifrarlo hará falta la frase de paso.")
+        else:
+            print(f"Clave para descifrado: {resultado['clave']} (guárdala en lugar seguro)")
     except FileNotFoundError as exc:
         print(f"[ERROR] {exc}")
     except Exception as exc:
@@ -50,15 +258,26 @@ def cifrado_archivo():
 # 2. Descifrado de archivos
 # ---------------------------
 def descifrado_archivo():
-    ruta = input("Ruta del archivo cifrado: ").strip()
-    key_input = input("Introduce la clave de descifrado: ").strip()
-    try:
-        archivo_descifrado = descifrar_archivo_core(ruta, key_input)
-        print(f"[OK] Archivo descifrado guardado en {archivo_descifrado}")
-    except FileNotFoundError as exc:
-        print(f"[ERROR] {exc}")
-    except Exception as exc:
-        print(f"[ERROR] No se pudo descifrar el archivo: {exc}")
+    rutas = input("Ruta del archivo cifrado (o varias separadas por comas): ").strip()
+    rutas = [ruta.strip() for ruta in rutas.split(",") if ruta.strip()]
+    existentes = [ruta for ruta in rutas if os.path.isfile(ruta)]
+    key_input = None
+    if any(usa_frase(ruta) for ruta in existentes):
+        # Una sola frase para todos; la derivación se reutiliza entre los que comparten sal
+        key_input = ClaveFrase(getpass.getpass("Frase de paso: "))
+    elif len(existentes) < len(rutas) or not all(usa_sobre(ruta) for ruta in existentes):
+        key_input = input("Introduce la clave de descifrado: ").strip()
+    aciertos = CACHE.aciertos
+    for ruta in rutas:
+        try:
+            archivo_descifrado = descifrar_archivo_core(ruta, key_input)
+            print(f"[OK] Archivo descifrado guardado en {archivo_descifrado}")
+        except FileNotFoundError as exc:
+            print(f"[ERROR] {ruta}: {exc}")
+        except Exception as exc:
+            print(f"[ERROR] No se pudo descifrar {ruta}: {exc}")
+    if CACHE.aciertos > aciertos:
+        print(f"Derivaciones de la frase reutilizadas desde la caché: {CACHE.aciertos - aciertos}")
 
 # ---------------------------
 # 3. Generación de clave para autenticación multifactor
@@ -69,16 +288,194 @@ def generacion_mfa():
     print(f"Clave generada para MFA (simulada): {key}")
     print("Se puede usar para integrar con Google Authenticator u otra app TOTP.")
 
+# ---------------------------
+# 4. Benchmark de cifrado en paralelo
+# ---------------------------
+def benchmark_cifrado():
+    tipo = input("1) Escalado con hilos del cifrado de archivos, 2) Comparativa de algoritmos [1]: ").strip() or "1"
+    if tipo == "2":
+        comparativa_cifrados()
+        return
+    if tipo != "1":
+        print("[ERROR] Opción no válida.")
+        return
+    texto = input("Tamaño del archivo de prueba en MB [1024]: ").strip()
+    if texto and not texto.isdigit():
+        print("[ERROR] Tamaño no válido.")
+        return
+    print(f"CPUs disponibles: {hilos_por_defecto()}")
+    try:
+        resultados = benchmark_cifrado_core(int(texto) if texto else 1024)
+    except Exception as exc:
+        print(f"[ERROR] No se pudo ejecutar el benchmark: {exc}")
+        return
+    print(f"{'Hilos':>5} {'Cifrar MB/s':>12} {'Descifrar MB/s':>15} {'Aceleración':>12}")
+    for resultado in resultados:
+        print(f"{resultado['hilos']:>5} {resultado['cifrar_mb_s']:>12.1f} {resultado['descifrar_mb_s']:>15.1f} "
+              f"{resultado['aceleracion']:>11.2f}x")
+
+def comparativa_cifrados():
+    texto = input("Tamaños de mensaje separados por comas [1K,64K,1M,64M,1G]: ").strip()
+    try:
+        tamanos = [interpretar_tamano(t) for t in texto.split(",") if t.strip()] if texto else TAMANOS_POR_DEFECTO
+    except ValueError as exc:
+        print(f"[ERROR] {exc}")
+        return
+    print(f"CPUs disponibles: {hilos_por_defecto()}. Cada caso se mide en un proceso aparte.")
+    try:
+        informe = comparar_cifrados_core(
+            tamanos, al_resultado=lambda r: print(f"\r{r['algoritmo']} {r['operacion']} {r['modo']} "
+                                                   f"{formatear_tamano(r['tamano'])} x{r['hilos']}: "
+                                                   f"{r['mb_s']:.1f} MB/s".ljust(70), end="", flush=True))
+    except Exception as exc:
+        print(f"\n[ERROR] No se pudo ejecutar el benchmark: {exc}")
+        return
+    print()
+    print(formatear_tabla(informe["resultados"]))
+    for omitido in informe["omitidos"]:
+        print(f"Omitido (mensaje entero demasiado grande): {omitido['algoritmo']} "
+              f"{formatear_tamano(omitido['tamano'])} x{omitido['hilos']}")
+    print(f"[OK] Resultados completos (con p90 y máximos) en {informe['json']}")
+
+# ---------------------------
+# 5. Lectura de un rango de un archivo cifrado
+# ---------------------------
+def leer_rango_cifrado():
+    ruta = input("Ruta del archivo cifrado: ").strip()
+    clave = None
+    if os.path.isfile(ruta) and usa_frase(ruta):
+        clave = getpass.getpass("Frase de paso: ")
+    elif not os.path.isfile(ruta) or not usa_sobre(ruta):
+        clave = input("Introduce la clave de descifrado: ").strip()
+    desplazamiento = input("Desde el byte [0]: ").strip() or "0"
+    longitud = input("Número de bytes [256]: ").strip() or "256"
+    if not desplazamiento.isdigit() or not longitud.isdigit():
+        print("[ERROR] Valores no válidos.")
+        return
+    try:
+        resultado = leer_rango_cifrado_core(ruta, clave, int(desplazamiento), int(longitud))
+    except FileNotFoundError as exc:
+        print(f"[ERROR] {exc}")
+        return
+    except Exception as exc:
+        print(f"[ERROR] No se pudo leer el archivo: {exc}")
+        return
+    print(resultado["datos"].decode("utf-8", errors="replace"))
+    print(f"[OK] {len(resultado['datos'])} bytes de {resultado['tamano']}; descifrados "
+          f"{resultado['trozos_descifrados']} de {resultado['trozos']} trozos")
+
+# ---------------------------
+# 6 y 7. Cifrado y descifrado de directorios en lote
+# ---------------------------
+def _mostrar_progreso(progreso):
+    print(f"\r{progreso['archivos']}/{progreso['total_archivos']} archivos, "
+          f"{progreso['mb_s']:.1f} MB/s, errores: {progreso['errores']}", end="", flush=True)
+
+
+def _mostrar_resumen_lote(resultado):
+    print()
+    for error in resultado["errores"]:
+        print(f"[ERROR] {error['ruta']}: {error['error']}")
+    print(f"[OK] {resultado['archivos']} archivos ({resultado['bytes'] / (1024 * 1024):.1f} MB) en "
+          f"{resultado['segundos']:.1f} s, {resultado['mb_s']:.1f} MB/s; ya hechos antes: {resultado['reanudados']}; "
+          f"errores: {len(resultado['errores'])}")
+
+
+def cifrado_directorio():
+    origen = input("Directorio a cifrar: ").strip()
+    destino = input("Directorio donde guardar los cifrados: ").strip()
+    clave_maestra = input("Clave maestra (vacía para generar una nueva): ").strip() or None
+    try:
+        resultado = cifrar_directorio_core(origen, destino, clave_maestra, al_progreso=_mostrar_progreso)
+    except NotADirectoryError as exc:
+        print(f"[ERROR] {exc}")
+        return
+    except Exception as exc:
+        print(f"[ERROR] No se pudo cifrar el directorio: {exc}")
+        return
+    _mostrar_resumen_lote(resultado)
+    print(f"Manifiesto de claves: {resultado['manifiesto']}")
+    if clave_maestra is None:
+        print(f"Clave maestra: {resultado['clave_maestra']} (guárdala en lugar seguro)")
+
+
+def descifrado_directorio():
+    origen = input("Directorio cifrado (con claves.jsonl): ").strip()
+    destino = input("Directorio donde descifrar: ").strip()
+    clave_maestra = input("Clave maestra: ").strip()
+    try:
+        resultado = descifrar_directorio_core(origen, destino, clave_maestra, al_progreso=_mostrar_progreso)
+    except (NotADirectoryError, FileNotFoundError) as exc:
+        print(f"[ERROR] {exc}")
+        return
+    except Exception as exc:
+        print(f"[ERROR] No se pudo descifrar el directorio: {exc}")
+        return
+    _mostrar_resumen_lote(resultado)
+
+# ---------------------------
+# 8. Rotación de la clave del almacén
+# ---------------------------
+def rotacion_claves():
+    rutas = input("Archivos o directorios cifrados con el almacén (separados por comas): ").strip()
+    rutas = [ruta.strip() for ruta in rutas.split(",") if ruta.strip()]
+    if not rutas:
+        print("[ERROR] Indica al menos una ruta.")
+        return
+    retirar = input("¿Borrar las claves anteriores del almacén al terminar? (s/N): ").strip().lower() == "s"
+    try:
+        resultado = rotar_claves_core(rutas, retirar_anteriores=retirar)
+    except FileNotFoundError as exc:
+        print(f"[ERROR] {exc}")
+        return
+    except Exception as exc:
+        print(f"[ERROR] No se pudo rotar la clave: {exc}")
+        return
+    print(f"[OK] Nueva KEK {resultado['kek']}: {resultado['reenvueltos']} archivos reenvueltos, "
+          f"{resultado['ya_actuales']} ya al día, {resultado['ignorados']} sin cifrado de sobre "
+          f"en {resultado['segundos']:.2f} s")
+    for error in resultado["errores"][:20]:
+        print(f"[ERROR] {error['ruta']}: {error['error']}")
+    if resultado["retiradas"]:
+        print(f"Claves retiradas: {', '.join(resultado['retiradas'])}")
+    elif retirar:
+        print("[ERROR] Hubo errores: se conservan las claves anteriores.")
+
+# ---------------------------
+# 9. Calibración de la derivación de claves desde frases de paso
+# ---------------------------
+def calibracion_kdf():
+    texto = input("Tiempo objetivo por derivación en ms [500]: ").strip()
+    if texto and not texto.isdigit():
+        print("[ERROR] Valor no válido.")
+        return
+    try:
+        resultado = calibrar_kdf_core(int(texto) if texto else 500)
+    except Exception as exc:
+        print(f"[ERROR] No se pudo calibrar: {exc}")
+        return
+    scrypt, pbkdf2 = resultado["scrypt"], resultado["pbkdf2"]
+    print(f"[OK] scrypt: N=2^{scrypt['coste']} r={scrypt['r']} p={scrypt['p']} "
+          f"({scrypt['segundos'] * 1000:.0f} ms, {scrypt['memoria_mb']:.0f} MB)")
+    print(f"[OK] PBKDF2-SHA256: {pbkdf2['coste']} iteraciones ({pbkdf2['segundos'] * 1000:.0f} ms)")
+    print("Los nuevos cifrados con frase de paso usarán estos costes.")
+
 # ---------------------------
 # Menú principal del módulo 0489
 # ---------------------------
 def menu():
     while True:
         print("\n\033[1;33m--- 0489: Sistemas seguros de acceso e transmisión de datos ---\033[0m")
-        print("1. Cifrar archivo (Fernet AES)")
+        print("1. Cifrar archivo (AES-256-GCM por trozos)")
         print("2. Descifrar archivo")
         print("3. Generación de clave MFA simulada")
-        print("4. Volver al menú principal")
+        print("4. Benchmark de cifrado (hilos y comparativa de algoritmos)")
+        print("5. Leer un rango de un archivo cifrado")
+        print("6. Cifrar directorio completo (en paralelo)")
+        print("7. Descifrar directorio completo")
+        print("8. Rotar la clave del almacén (cifrado de sobre)")
+        print("9. Calibrar la derivación de claves desde frases de paso")
+        print("10. Volver al menú principal")
 
         opcion = input("Selecciona una opción: ").strip()
 
@@ -89,6 +486,18 @@ def menu():
         elif opcion == "3":
             generacion_mfa()
         elif opcion == "4":
+            benchmark_cifrado()
+        elif opcion == "5":
+            leer_rango_cifrado()
+        elif opcion == "6":
+            cifrado_directorio()
+        elif opcion == "7":
+            descifrado_directorio()
+        elif opcion == "8":
+            rotacion_claves()
+        elif opcion == "9":
+            calibracion_kdf()
+        elif opcion == "10":
             os.system('cls' if os.name == 'nt' else 'clear')
             break
         else:
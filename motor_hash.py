@@ -0,0 +1,106 @@
+import hashlib
+import threading
+import time
+
+
+ALGORITMOS_SOPORTADOS = ("md5", "sha1", "sha256", "blake2b", "blake2s")
+TAMANO_BUFFER = 1024 * 1024
+
+_buffers = threading.local()
+
+
+def _tomar_buffer(tam_buffer):
+    """Toma un buffer libre del hilo actual o crea uno nuevo."""
+    libres = getattr(_buffers, "libres", None)
+    if libres is None:
+        libres = _buffers.libres = []
+    for indice, buffer in enumerate(libres):
+        if len(buffer) == tam_buffer:
+            return libres.pop(indice)
+    return bytearray(tam_buffer)
+
+
+def _devolver_buffer(buffer):
+    """Devuelve el buffer al hilo para reutilizarlo en la siguiente lectura."""
+    libres = _buffers.libres
+    if len(libres) < 4:
+        libres.append(buffer)
+
+
+def crear_hashers(algoritmos):
+    """Crea un objeto hashlib por algoritmo, validando los nombres."""
+    hashers = {}
+    for nombre in algoritmos:
+        nombre = nombre.lower()
+        if nombre not in ALGORITMOS_SOPORTADOS:
+            raise ValueError(f"Algoritmo no soportado: {nombre}")
+        hashers[nombre] = hashlib.new(nombre)
+    if not hashers:
+        raise ValueError("Debe indicarse al menos un algoritmo.")
+    return hashers
+
+
+def hash_stream(f, algoritmos=("md5",), tam_buffer=TAMANO_BUFFER, observadores=()):
+    """Calcula varios digests de un objeto binario abierto en una sola lectura.
+
+    Usa ``readinto`` sobre un buffer reutilizable para no crear un objeto
+    ``bytes`` por bloque. Cada bloque leído se entrega también a los
+    ``observadores`` (callables que reciben un memoryview), de modo que otros
+    análisis pueden aprovechar la misma pasada.
+    """
+    hashers = crear_hashers(algoritmos)
+    actualizadores = [h.update for h in hashers.values()]
+    actualizadores.extend(observadores)
+    buffer = _tomar_buffer(tam_buffer)
+    total = 0
+    inicio = time.perf_counter()
+    readinto = getattr(f, "readinto", None)
+    try:
+        with memoryview(buffer) as vista:
+            while True:
+                if readinto is not None:
+                    leidos = readinto(buffer)
+                    if not leidos:
+                        break
+                    bloque = vista[:leidos]
+                else:
+                    bloque = f.read(tam_buffer)
+                    leidos = len(bloque)
+                    if not leidos:
+                        break
+                for actualizar in actualizadores:
+                    actualizar(bloque)
+                total += leidos
+    finally:
+        _devolver_buffer(buffer)
+    segundos = time.perf_counter() - inicio
+    return {
+        "hashes": {nombre: h.hexdigest() for nombre, h in hashers.items()},
+        "bytes": total,
+        "segundos": segundos,
+        "mb_s": _mb_por_segundo(total, segundos),
+    }
+
+
+def calcular_hashes(path, algoritmos=("md5",), tam_buffer=TAMANO_BUFFER, observadores=()):
+    """Calcula los digests pedidos de un fichero leyéndolo una única vez.
+
+    Devuelve un diccionario con ``hashes`` (algoritmo -> hexdigest),
+    ``bytes`` leídos, ``segundos`` empleados y el rendimiento en ``mb_s``.
+    """
+    with open(path, "rb", buffering=0) as f:
+        return hash_stream(f, algoritmos, tam_buffer, observadores)
+
+
+def _mb_por_segundo(total, segundos):
+    if segundos <= 0:
+        return 0.0
+    return total / (1024 * 1024) / segundos
+
+
+def formatear_rendimiento(resultado):
+    """Texto corto con el volumen leído y la velocidad de un cálculo de hashes."""
+    if resultado.get("cache"):
+        return "hashes recuperados de la caché (archivo sin cambios, no se ha leído)"
+    megas = resultado["bytes"] / (1024 * 1024)
+    return f"{megas:.2f} MB en {resultado['segundos']:.3f} s ({resultado['mb_s']:.1f} MB/s)"
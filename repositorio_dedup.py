@@ -0,0 +1,521 @@
+import contextlib
+import hashlib
+import io
+import json
+import os
+import sqlite3
+import stat
+import time
+import zlib
+from datetime import datetime
+
+from copias_seguridad import recorrer_arbol, sin_cambios
+
+
+FORMATO = "repositorio_dedup"
+VERSION = 1
+ALGORITMO = "sha256"
+TROZO_MINIMO = 256 * 1024
+TROZO_MEDIO = 1024 * 1024
+TROZO_MAXIMO = 4 * 1024 * 1024
+TAMANO_LECTURA = 8 * 1024 * 1024
+PAQUETE_MAXIMO = 16 * 1024 * 1024
+NIVEL_COMPRESION = 6
+UMBRAL_REEMPAQUETADO = 0.2
+
+SIN_COMPRIMIR = b"\x00"
+ZLIB = b"\x01"
+
+
+def _bits(semilla, n):
+    """``n`` bits pseudoaleatorios fijos (derivados de ``semilla``), uno por byte."""
+    digest = hashlib.sha256(semilla).digest()
+    return bytes((digest[i // 8] >> (i % 8)) & 1 for i in range(n))
+
+
+# Tabla "gear" de un bit por valor de byte. La condición de corte es que los
+# últimos bits de la secuencia coincidan con un patrón fijo: depende solo del
+# contenido cercano (los cortes se conservan aunque se inserten datos antes) y
+# se evalúa a velocidad de C con bytes.translate y bytes.find. Como en
+# FastCDC, antes del tamaño medio se exige un patrón más largo (menos
+# probable) y después uno más corto, para concentrar los tamaños en torno a
+# la media.
+TABLA_GEAR = bytes(hashlib.sha256(bytes([valor])).digest()[0] & 1 for valor in range(256))
+PATRON_ESTRICTO = _bits(b"corte-estricto", 22)
+PATRON_NORMAL = _bits(b"corte-normal", 18)
+
+
+def _buscar_corte(bits, inicio, fin):
+    """Posición de corte del trozo que empieza en ``inicio`` (``bits`` es el contenido traducido)."""
+    if fin - inicio <= TROZO_MINIMO:
+        return fin
+    limite = min(fin, inicio + TROZO_MAXIMO)
+    medio = min(limite, inicio + TROZO_MEDIO)
+    posicion = bits.find(PATRON_ESTRICTO, inicio + TROZO_MINIMO - len(PATRON_ESTRICTO), medio)
+    if posicion >= 0:
+        return posicion + len(PATRON_ESTRICTO)
+    posicion = bits.find(PATRON_NORMAL, medio - len(PATRON_NORMAL) + 1, limite)
+    if posicion >= 0:
+        return posicion + len(PATRON_NORMAL)
+    return limite
+
+
+def trocear(f, tam_lectura=TAMANO_LECTURA):
+    """Divide el contenido de ``f`` en trozos definidos por el contenido (genera memoryviews)."""
+    datos, bits, posicion, fin = b"", b"", 0, False
+    while True:
+        if not fin and len(datos) - posicion < TROZO_MAXIMO:
+            bloque = f.read(tam_lectura)
+            if bloque:
+                datos = datos[posicion:] + bloque
+                bits = datos.translate(TABLA_GEAR)
+                posicion = 0
+                continue
+            fin = True
+        if posicion >= len(datos):
+            return
+        corte = _buscar_corte(bits, posicion, len(datos))
+        yield memoryview(datos)[posicion:corte]
+        posicion = corte
+
+
+def _codificar(datos):
+    comprimido = zlib.compress(datos, NIVEL_COMPRESION)
+    if len(comprimido) < len(datos):
+        return ZLIB + comprimido
+    return SIN_COMPRIMIR + bytes(datos)
+
+
+def _decodificar(registro):
+    if registro[:1] == ZLIB:
+        return zlib.decompress(registro[1:])
+    return registro[1:]
+
+
+class Repositorio:
+    """Repositorio de backups deduplicado por trozos definidos por el contenido.
+
+    Cada archivo se divide en trozos (ver ``trocear``) y cada trozo distinto
+    se guarda una sola vez, comprimido, en un paquete de ``paquetes/``; el
+    índice SQLite dice en qué paquete y desplazamiento está cada hash. Una
+    instantánea (``instantaneas/<id>.json``) solo guarda la lista de trozos
+    de su listado de archivos, que a su vez se trocea y deduplica, así que
+    el espacio crece con los datos nuevos y no con el número de copias.
+    """
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        with open(os.path.join(ruta, "config.json"), encoding="utf-8") as f:
+            self.config = json.load(f)
+        if self.config.get("formato") != FORMATO:
+            raise ValueError("No es un repositorio deduplicado.")
+        self._conexion = sqlite3.connect(os.path.join(ruta, "indice.sqlite"))
+        self._conexion.execute("PRAGMA journal_mode=WAL")
+        self._conexion.execute("PRAGMA synchronous=NORMAL")
+        self._conexion.execute(
+            """CREATE TABLE IF NOT EXISTS trozos (
+                hash TEXT PRIMARY KEY,
+                paquete TEXT NOT NULL,
+                desplazamiento INTEGER NOT NULL,
+                longitud INTEGER NOT NULL,
+                tamano INTEGER NOT NULL
+            ) WITHOUT ROWID"""
+        )
+        self._conexion.execute("CREATE INDEX IF NOT EXISTS idx_paquete ON trozos (paquete)")
+        self._paquete = None
+        self._pendientes = {}
+        self._abiertos = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cerrar()
+
+    @contextlib.contextmanager
+    def _bloqueo(self):
+        """Impide que dos procesos escriban o purguen el repositorio a la vez."""
+        ruta = os.path.join(self.ruta, "bloqueo")
+        try:
+            descriptor = os.open(ruta, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            raise RuntimeError("El repositorio está en uso (si no es así, borra el archivo 'bloqueo').") from None
+        try:
+            os.write(descriptor, str(os.getpid()).encode())
+            yield
+        finally:
+            os.close(descriptor)
+            os.remove(ruta)
+
+    # --- Paquetes ---------------------------------------------------------
+
+    def _ruta_paquete(self, paquete):
+        return os.path.join(self.ruta, "paquetes", paquete[:2], paquete + ".pack")
+
+    def _guardar_registro(self, digest, registro, tamano):
+        """Añade un trozo ya codificado al paquete en curso."""
+        if self._paquete is None:
+            temporal = os.path.join(self.ruta, "paquetes", f"escribiendo-{os.getpid()}.tmp")
+            self._paquete = {"f": open(temporal, "wb"), "ruta": temporal, "hash": hashlib.new(ALGORITMO), "tamano": 0}
+        paquete = self._paquete
+        paquete["f"].write(registro)
+        paquete["hash"].update(registro)
+        self._pendientes[digest] = (paquete["tamano"], len(registro), tamano)
+        paquete["tamano"] += len(registro)
+        if paquete["tamano"] >= PAQUETE_MAXIMO:
+            self._cerrar_paquete()
+
+    def _cerrar_paquete(self):
+        """Da nombre (su hash) al paquete en curso y registra sus trozos en el índice."""
+        paquete, self._paquete = self._paquete, None
+        if paquete is None:
+            return
+        paquete["f"].close()
+        nombre = paquete["hash"].hexdigest()
+        destino = self._ruta_paquete(nombre)
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        os.replace(paquete["ruta"], destino)
+        self._conexion.executemany(
+            "INSERT OR REPLACE INTO trozos VALUES (?, ?, ?, ?, ?)",
+            ((digest, nombre, *posicion) for digest, posicion in self._pendientes.items()),
+        )
+        self._conexion.commit()
+        self._pendientes.clear()
+
+    def tiene(self, digest):
+        if digest in self._pendientes:
+            return True
+        return self._conexion.execute("SELECT 1 FROM trozos WHERE hash=?", (digest,)).fetchone() is not None
+
+    def guardar_trozo(self, datos):
+        """Guarda un trozo si no existe ya y devuelve ``(hash, es_nuevo)``."""
+        digest = hashlib.new(ALGORITMO, datos).hexdigest()
+        if self.tiene(digest):
+            return digest, False
+        self._guardar_registro(digest, _codificar(datos), len(datos))
+        return digest, True
+
+    def leer_registro(self, digest):
+        fila = self._conexion.execute(
+            "SELECT paquete, desplazamiento, longitud FROM trozos WHERE hash=?", (digest,)
+        ).fetchone()
+        if fila is None:
+            raise KeyError(f"Trozo no encontrado en el índice: {digest}")
+        paquete, desplazamiento, longitud = fila
+        f = self._abiertos.get(paquete)
+        if f is None:
+            if len(self._abiertos) >= 16:
+                self._abiertos.pop(next(iter(self._abiertos))).close()
+            f = self._abiertos[paquete] = open(self._ruta_paquete(paquete), "rb")
+        f.seek(desplazamiento)
+        registro = f.read(longitud)
+        if len(registro) != longitud:
+            raise ValueError(f"Paquete truncado: {paquete}")
+        return registro
+
+    def leer_trozo(self, digest):
+        """Devuelve el contenido de un trozo comprobando su hash."""
+        datos = _decodificar(self.leer_registro(digest))
+        if hashlib.new(ALGORITMO, datos).hexdigest() != digest:
+            raise ValueError(f"Trozo corrupto: {digest}")
+        return datos
+
+    # --- Instantáneas -----------------------------------------------------
+
+    def instantaneas(self, origen=None):
+        """Instantáneas del repositorio (de ``origen``, si se indica), de la más antigua a la más reciente."""
+        directorio = os.path.join(self.ruta, "instantaneas")
+        resultado = []
+        for nombre in os.listdir(directorio):
+            if nombre.endswith(".json"):
+                with open(os.path.join(directorio, nombre), encoding="utf-8") as f:
+                    instantanea = json.load(f)
+                if origen is None or instantanea["origen"] == origen:
+                    resultado.append(instantanea)
+        return sorted(resultado, key=lambda instantanea: instantanea["creado_ns"])
+
+    def _ruta_instantanea(self, identificador):
+        return os.path.join(self.ruta, "instantaneas", identificador + ".json")
+
+    def leer_instantanea(self, identificador):
+        with open(self._ruta_instantanea(identificador), encoding="utf-8") as f:
+            return json.load(f)
+
+    def listado(self, instantanea):
+        """Genera los registros (uno por archivo, directorio o enlace) de una instantánea."""
+        pendiente = b""
+        for digest in instantanea["listado"]:
+            lineas = (pendiente + self.leer_trozo(digest)).split(b"\n")
+            pendiente = lineas.pop()
+            for linea in lineas:
+                if linea:
+                    yield json.loads(linea)
+        if pendiente:
+            yield json.loads(pendiente)
+
+    def _guardar_flujo(self, f):
+        """Trocea y guarda un flujo; devuelve (lista de hashes, bytes nuevos guardados)."""
+        trozos, nuevos = [], 0
+        for trozo in trocear(f):
+            digest, es_nuevo = self.guardar_trozo(trozo)
+            trozos.append(digest)
+            if es_nuevo:
+                nuevos += len(trozo)
+        return trozos, nuevos
+
+    def crear_instantanea(self, origen, al_archivo=None):
+        """Guarda el estado actual de ``origen`` como una nueva instantánea.
+
+        Los archivos con el mismo tamaño y mtime que en la instantánea
+        anterior del mismo origen reutilizan su lista de trozos sin leerse;
+        del resto solo se guardan los trozos que no estén ya en el
+        repositorio. Devuelve la instantánea con sus estadísticas.
+        """
+        if not os.path.isdir(origen):
+            raise NotADirectoryError("El directorio de origen no existe.")
+        with self._bloqueo():
+            return self._crear_instantanea(os.path.abspath(origen), al_archivo)
+
+    def _crear_instantanea(self, origen, al_archivo):
+        inicio = time.perf_counter()
+        previas = self.instantaneas(origen)
+        anteriores, referencia_ns = {}, 0
+        if previas:
+            anteriores = {registro["ruta"]: registro for registro in self.listado(previas[-1])}
+            referencia_ns = previas[-1]["creado_ns"]
+
+        creado_ns = time.time_ns()
+        listado = io.BytesIO()
+        archivos, leidos, total_bytes, bytes_nuevos = 0, 0, 0, 0
+        errores = []
+        for relativa, ruta, st in recorrer_arbol(origen, errores):
+            anterior = anteriores.get(relativa)
+            registro = {"ruta": relativa, "modo": stat.S_IMODE(st.st_mode), "mtime_ns": st.st_mtime_ns}
+            if stat.S_ISDIR(st.st_mode):
+                registro["tipo"] = "d"
+            elif stat.S_ISLNK(st.st_mode):
+                try:
+                    registro.update(tipo="l", destino=os.readlink(ruta))
+                except OSError as exc:
+                    errores.append({"ruta": relativa, "error": exc.strerror or str(exc)})
+                    continue
+            elif stat.S_ISREG(st.st_mode):
+                registro.update(tipo="f", tamano=st.st_size)
+                if anterior is not None and sin_cambios(anterior, st, referencia_ns):
+                    registro["trozos"] = anterior["trozos"]
+                else:
+                    try:
+                        with open(ruta, "rb") as f:
+                            registro["trozos"], nuevos = self._guardar_flujo(f)
+                    except OSError as exc:
+                        errores.append({"ruta": relativa, "error": exc.strerror or str(exc)})
+                        # Solo se conserva la versión anterior si también era un archivo
+                        if anterior is None or anterior.get("tipo") != "f":
+                            continue
+                        registro = anterior
+                    else:
+                        leidos += 1
+                        bytes_nuevos += nuevos
+                        if al_archivo:
+                            al_archivo(relativa)
+                archivos += 1
+                total_bytes += registro["tamano"]
+            else:
+                continue
+            # ensure_ascii: las rutas con bytes no UTF-8 (surrogateescape) no se pueden codificar tal cual
+            listado.write(json.dumps(registro, separators=(",", ":")).encode("ascii"))
+            listado.write(b"\n")
+
+        listado.seek(0)
+        trozos_listado, _ = self._guardar_flujo(listado)
+        # Los trozos deben estar en disco antes de que la instantánea los referencie
+        self._cerrar_paquete()
+        instantanea = {
+            "id": datetime.now().strftime("%Y%m%d_%H%M%S_") + hashlib.sha256(
+                "".join(trozos_listado).encode() + str(creado_ns).encode()).hexdigest()[:8],
+            "origen": origen,
+            "raiz": os.path.basename(origen),
+            "creado": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "creado_ns": creado_ns,
+            "archivos": archivos,
+            "bytes": total_bytes,
+            "listado": trozos_listado,
+        }
+        ruta = self._ruta_instantanea(instantanea["id"])
+        with open(ruta + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(instantanea, f)
+        os.replace(ruta + ".tmp", ruta)
+        return {
+            **instantanea,
+            "ruta": ruta,
+            "leidos": leidos,
+            "bytes_nuevos": bytes_nuevos,
+            "errores": errores,
+            "segundos": time.perf_counter() - inicio,
+        }
+
+    def restaurar(self, identificador, destino, al_archivo=None):
+        """Reconstruye en ``destino`` el árbol de una instantánea comprobando cada trozo."""
+        instantanea = self.leer_instantanea(identificador)
+        os.makedirs(destino, exist_ok=True)
+        directorios, errores = [], []
+        archivos, total_bytes = 0, 0
+        for registro in self.listado(instantanea):
+            partes = registro["ruta"].split("/")
+            if any(parte in ("", ".", "..") for parte in partes):
+                raise ValueError(f"Ruta no válida en la instantánea: {registro['ruta']}")
+            ruta = os.path.join(destino, *partes)
+            if registro["tipo"] == "d":
+                os.makedirs(ruta, exist_ok=True)
+                directorios.append((ruta, registro))
+                continue
+            if registro["tipo"] == "l":
+                if os.path.lexists(ruta):
+                    os.remove(ruta)
+                os.symlink(registro["destino"], ruta)
+                continue
+            try:
+                with open(ruta, "wb") as f:
+                    for digest in registro["trozos"]:
+                        f.write(self.leer_trozo(digest))
+            except (KeyError, ValueError, OSError) as exc:
+                errores.append({"ruta": registro["ruta"], "error": str(exc)})
+                continue
+            os.chmod(ruta, registro["modo"])
+            os.utime(ruta, ns=(registro["mtime_ns"], registro["mtime_ns"]))
+            archivos += 1
+            total_bytes += registro["tamano"]
+            if al_archivo:
+                al_archivo(registro["ruta"])
+        for ruta, registro in reversed(directorios):
+            os.chmod(ruta, registro["modo"])
+            os.utime(ruta, ns=(registro["mtime_ns"], registro["mtime_ns"]))
+        return {"archivos": archivos, "bytes": total_bytes, "errores": errores}
+
+    # --- Mantenimiento ----------------------------------------------------
+
+    def _referenciados(self):
+        """Hashes de todos los trozos que usa alguna instantánea."""
+        vivos = set()
+        for instantanea in self.instantaneas():
+            vivos.update(instantanea["listado"])
+            for registro in self.listado(instantanea):
+                vivos.update(registro.get("trozos", ()))
+        return vivos
+
+    def olvidar(self, identificador):
+        """Borra una instantánea; sus trozos se liberan al purgar."""
+        os.remove(self._ruta_instantanea(identificador))
+
+    def purgar(self, umbral=UMBRAL_REEMPAQUETADO):
+        """Libera el espacio de los trozos que ya no usa ninguna instantánea.
+
+        Los paquetes sin trozos vivos se borran y los que tienen más de
+        ``umbral`` de espacio muerto se reescriben solo con los vivos (sin
+        recomprimirlos). Devuelve cuántos trozos, paquetes y bytes se liberan.
+        """
+        with self._bloqueo():
+            return self._purgar(umbral)
+
+    def _purgar(self, umbral):
+        vivos = self._referenciados()
+        paquetes = {}
+        for digest, paquete, longitud, tamano in self._conexion.execute(
+                "SELECT hash, paquete, longitud, tamano FROM trozos"):
+            paquetes.setdefault(paquete, []).append((digest, longitud, tamano, digest in vivos))
+        borrados, bytes_liberados, reescritos = 0, 0, []
+        for paquete, trozos in paquetes.items():
+            muertos = [longitud for _, longitud, _, vivo in trozos if not vivo]
+            if not muertos:
+                continue
+            total = sum(longitud for _, longitud, _, _ in trozos)
+            if len(muertos) < len(trozos) and sum(muertos) / total <= umbral:
+                continue
+            for digest, _, tamano, vivo in trozos:
+                if vivo:
+                    self._guardar_registro(digest, self.leer_registro(digest), tamano)
+            reescritos.append(paquete)
+            borrados += len(muertos)
+            bytes_liberados += sum(muertos)
+        self._cerrar_paquete()
+        # Los vivos ya apuntan a su nuevo paquete: se pueden borrar los antiguos
+        for paquete in reescritos:
+            self._conexion.execute("DELETE FROM trozos WHERE paquete=?", (paquete,))
+            f = self._abiertos.pop(paquete, None)
+            if f is not None:
+                f.close()
+            os.remove(self._ruta_paquete(paquete))
+        self._conexion.commit()
+        return {"trozos": borrados, "paquetes": len(reescritos), "bytes": bytes_liberados}
+
+    def comprobar(self, leer_datos=False):
+        """Comprueba la coherencia del repositorio.
+
+        Verifica que existen los paquetes del índice (y su tamaño), que no
+        hay paquetes sin indexar y que todos los trozos de todas las
+        instantáneas están en el índice. Con ``leer_datos`` además se lee,
+        descomprime y verifica el hash de cada trozo.
+        """
+        errores = []
+        tamanos = dict(self._conexion.execute(
+            "SELECT paquete, MAX(desplazamiento + longitud) FROM trozos GROUP BY paquete"))
+        for paquete, tamano in tamanos.items():
+            try:
+                if os.path.getsize(self._ruta_paquete(paquete)) < tamano:
+                    errores.append(f"Paquete truncado: {paquete}")
+            except OSError:
+                errores.append(f"Falta el paquete: {paquete}")
+        for directorio, _, nombres in os.walk(os.path.join(self.ruta, "paquetes")):
+            for nombre in nombres:
+                if nombre.endswith(".pack") and nombre[:-5] not in tamanos:
+                    errores.append(f"Paquete sin indexar: {nombre}")
+        instantaneas = self.instantaneas()
+        for instantanea in instantaneas:
+            faltan = [digest for digest in instantanea["listado"] if not self.tiene(digest)]
+            if faltan:
+                errores.append(f"Instantánea {instantanea['id']}: faltan {len(faltan)} trozos del listado")
+                continue
+            faltan = sum(
+                1 for registro in self.listado(instantanea)
+                for digest in registro.get("trozos", ()) if not self.tiene(digest)
+            )
+            if faltan:
+                errores.append(f"Instantánea {instantanea['id']}: faltan {faltan} trozos")
+        trozos = self._conexion.execute("SELECT COUNT(*) FROM trozos").fetchone()[0]
+        if leer_datos:
+            for (digest,) in self._conexion.execute("SELECT hash FROM trozos ORDER BY paquete, desplazamiento").fetchall():
+                try:
+                    self.leer_trozo(digest)
+                except (OSError, ValueError, zlib.error) as exc:
+                    errores.append(str(exc))
+        return {"instantaneas": len(instantaneas), "paquetes": len(tamanos), "trozos": trozos, "errores": errores}
+
+    def cerrar(self):
+        self._cerrar_paquete()
+        for f in self._abiertos.values():
+            f.close()
+        self._abiertos.clear()
+        self._conexion.close()
+
+
+def es_repositorio(ruta):
+    return os.path.isfile(os.path.join(ruta, "config.json"))
+
+
+def abrir_repositorio(ruta, crear=True):
+    """Abre el repositorio de ``ruta`` creándolo (vacío) si no existe y ``crear`` es cierto."""
+    if not es_repositorio(ruta):
+        if not crear:
+            raise FileNotFoundError("No existe un repositorio deduplicado en esa ruta.")
+        for directorio in ("paquetes", "instantaneas"):
+            os.makedirs(os.path.join(ruta, directorio), exist_ok=True)
+        with open(os.path.join(ruta, "config.json"), "w", encoding="utf-8") as f:
+            json.dump({
+                "formato": FORMATO,
+                "version": VERSION,
+                "algoritmo": ALGORITMO,
+                "trozo_minimo": TROZO_MINIMO,
+                "trozo_medio": TROZO_MEDIO,
+                "trozo_maximo": TROZO_MAXIMO,
+            }, f, indent=2)
+    return Repositorio(ruta)
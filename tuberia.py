@@ -0,0 +1,137 @@
+import queue
+import threading
+
+
+MAX_PENDIENTES = 8
+TAMANO_LECTURA = 1024 * 1024
+
+_FIN = object()
+
+
+class EscritorEnHilo:
+    """Etapa de escritura en su propio hilo.
+
+    Lo que se escribe se encola (como mucho ``max_pendientes`` bloques) y un
+    hilo lo va pasando a ``destino``, así la etapa anterior y la siguiente
+    trabajan a la vez con memoria acotada. Un error del hilo se relanza en
+    la siguiente escritura o en ``close``, que no cierra ``destino``.
+    """
+
+    def __init__(self, destino, max_pendientes=MAX_PENDIENTES):
+        self._destino = destino
+        self._cola = queue.Queue(max_pendientes)
+        self._error = None
+        self.closed = False
+        self._hilo = threading.Thread(target=self._consumir, daemon=True)
+        self._hilo.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, tipo, *exc):
+        if tipo is None:
+            self.close()
+        elif not self.closed:
+            self.closed = True
+            self._cola.put(_FIN)
+            self._hilo.join()
+
+    def _consumir(self):
+        while True:
+            datos = self._cola.get()
+            if datos is _FIN:
+                return
+            if self._error is not None:
+                continue  # se vacía la cola para no bloquear al productor
+            try:
+                self._destino.write(datos)
+            except BaseException as exc:
+                self._error = exc
+
+    def write(self, datos):
+        if self._error is not None:
+            raise self._error
+        self._cola.put(bytes(datos))
+        return len(datos)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._cola.put(_FIN)
+        self._hilo.join()
+        if self._error is not None:
+            raise self._error
+
+
+class LectorEnHilo:
+    """Etapa de lectura en su propio hilo: lee ``origen`` por adelantado.
+
+    Un hilo lee bloques de ``tam_bloque`` y los encola (como mucho
+    ``max_pendientes``) mientras quien consume procesa los anteriores. Los
+    errores del hilo se relanzan en ``read``.
+    """
+
+    def __init__(self, origen, tam_bloque=TAMANO_LECTURA, max_pendientes=MAX_PENDIENTES):
+        self._origen = origen
+        self._tam_bloque = tam_bloque
+        self._cola = queue.Queue(max_pendientes)
+        self._detener = threading.Event()
+        self._buffer = bytearray()
+        self._terminado = False
+        self._hilo = threading.Thread(target=self._producir, daemon=True)
+        self._hilo.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _encolar(self, elemento):
+        while not self._detener.is_set():
+            try:
+                self._cola.put(elemento, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _producir(self):
+        try:
+            while True:
+                datos = self._origen.read(self._tam_bloque)
+                if not datos:
+                    break
+                if not self._encolar(datos):
+                    return
+        except BaseException as exc:
+            self._encolar(exc)
+            return
+        self._encolar(_FIN)
+
+    def read(self, n=-1):
+        while not self._terminado and (n < 0 or len(self._buffer) < n):
+            elemento = self._cola.get()
+            if elemento is _FIN:
+                self._terminado = True
+            elif isinstance(elemento, BaseException):
+                self._terminado = True
+                raise elemento
+            else:
+                self._buffer += elemento
+        if n < 0 or n >= len(self._buffer):
+            datos = bytes(self._buffer)
+            self._buffer.clear()
+            return datos
+        datos = bytes(self._buffer[:n])
+        del self._buffer[:n]
+        return datos
+
+    def close(self):
+        """Detiene el hilo aunque no se haya leído todo (no cierra ``origen``)."""
+        self._detener.set()
+        self._hilo.join()
@@ -0,0 +1,232 @@
+import ctypes
+import ctypes.util
+import os
+import selectors
+import struct
+import time
+
+from linea_base import RUTA_LINEA_BASE, comprobar_registro, leer_linea_base
+
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+MASCARA_VIGILANCIA = (
+    IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+    | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+)
+COALESCENCIA_S = 0.05
+MAX_ESPERA_S = 0.5
+REINTENTO_S = 2.0
+TAMANO_LECTURA = 64 * 1024
+
+_EVENTO = struct.Struct("iIII")
+
+
+class Inotify:
+    """Envoltorio mínimo de inotify(7) mediante ctypes (solo Linux)."""
+
+    def __init__(self):
+        nombre = ctypes.util.find_library("c")
+        try:
+            libc = ctypes.CDLL(nombre or "libc.so.6", use_errno=True)
+            self._anadir = libc.inotify_add_watch
+            self._quitar = libc.inotify_rm_watch
+            iniciar = libc.inotify_init1
+        except (OSError, AttributeError):
+            raise OSError("inotify solo está disponible en Linux.") from None
+        self._anadir.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        self.fd = iniciar(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            numero = ctypes.get_errno()
+            raise OSError(numero, f"inotify_init1: {os.strerror(numero)}")
+
+    def fileno(self):
+        return self.fd
+
+    def vigilar(self, directorio, mascara=MASCARA_VIGILANCIA):
+        """Añade una vigilancia sobre ``directorio`` y devuelve su descriptor."""
+        wd = self._anadir(self.fd, os.fsencode(directorio), mascara)
+        if wd < 0:
+            numero = ctypes.get_errno()
+            raise OSError(numero, os.strerror(numero), directorio)
+        return wd
+
+    def dejar_de_vigilar(self, wd):
+        self._quitar(self.fd, wd)
+
+    def leer(self):
+        """Devuelve los eventos pendientes como tuplas (wd, máscara, nombre)."""
+        eventos = []
+        while True:
+            try:
+                datos = os.read(self.fd, TAMANO_LECTURA)
+            except BlockingIOError:
+                return eventos
+            posicion = 0
+            while posicion < len(datos):
+                wd, mascara, _, longitud = _EVENTO.unpack_from(datos, posicion)
+                posicion += _EVENTO.size
+                nombre = datos[posicion:posicion + longitud].rstrip(b"\0")
+                posicion += longitud
+                eventos.append((wd, mascara, os.fsdecode(nombre)))
+
+    def cerrar(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class VigilanteIntegridad:
+    """Vigila en tiempo real los archivos de una línea base.
+
+    Se vigila cada directorio que contiene archivos de la línea base (no
+    los archivos, para seguir detectando cambios tras un reemplazo atómico
+    con rename). Las ráfagas de eventos se agrupan: los archivos tocados se
+    comprueban cuando pasan ``coalescencia`` segundos sin eventos nuevos
+    (o como mucho ``max_espera`` desde el primero), con la misma
+    comprobación stat-primero que la verificación completa. Si la cola del
+    kernel se desborda se repite esa comprobación para toda la línea base.
+
+    Cada cambio se entrega a ``al_cambio`` con la latencia desde el primer
+    evento; un mismo estado no se avisa dos veces y, si un archivo vuelve
+    a coincidir con la línea base, se avisa como ``restaurado``.
+    """
+
+    def __init__(self, ruta_linea_base=RUTA_LINEA_BASE, al_cambio=None,
+                 coalescencia=COALESCENCIA_S, max_espera=MAX_ESPERA_S):
+        cabecera, registros = leer_linea_base(ruta_linea_base)
+        self.creada_ns = cabecera.get("creada_ns") or 0
+        self.registros = {registro["ruta"]: registro for registro in registros}
+        self.al_cambio = al_cambio
+        self.coalescencia = coalescencia
+        self.max_espera = max_espera
+        self.por_directorio = {}
+        for ruta in self.registros:
+            self.por_directorio.setdefault(os.path.dirname(ruta) or ".", []).append(ruta)
+        self.inotify = Inotify()
+        self.directorios = {}
+        self.sin_vigilar = set(self.por_directorio)
+        self.pendientes = {}
+        self.avisados = {}
+        self.desbordamientos = 0
+        self._detener_r, self._detener_w = os.pipe()
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self.inotify, selectors.EVENT_READ)
+        self._selector.register(self._detener_r, selectors.EVENT_READ)
+        self._ultimo_reintento = 0.0
+        self._ultimo_evento = 0.0
+        self._primer_pendiente = 0.0
+        self._reintentar_vigilancias()
+
+    def _reintentar_vigilancias(self):
+        """Vigila los directorios que aún no lo están (por ejemplo, recreados)."""
+        self._ultimo_reintento = time.monotonic()
+        for directorio in list(self.sin_vigilar):
+            try:
+                wd = self.inotify.vigilar(directorio)
+            except OSError:
+                continue
+            self.directorios[wd] = directorio
+            self.sin_vigilar.discard(directorio)
+            # Pudo cambiar mientras no se vigilaba
+            self._marcar(self.por_directorio[directorio])
+
+    def _marcar(self, rutas, instante=None):
+        instante = instante if instante is not None else time.monotonic()
+        if not self.pendientes:
+            self._primer_pendiente = instante
+        for ruta in rutas:
+            self.pendientes.setdefault(ruta, instante)
+
+    def _procesar_eventos(self):
+        instante = time.monotonic()
+        for wd, mascara, nombre in self.inotify.leer():
+            if mascara & IN_Q_OVERFLOW:
+                # Se han perdido eventos: no se sabe qué cambió
+                self.desbordamientos += 1
+                self._marcar(self.registros, instante)
+                continue
+            directorio = self.directorios.get(wd)
+            if directorio is None:
+                continue
+            if mascara & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                del self.directorios[wd]
+                if not mascara & IN_IGNORED:
+                    self.inotify.dejar_de_vigilar(wd)
+                self.sin_vigilar.add(directorio)
+                self._marcar(self.por_directorio[directorio], instante)
+                continue
+            ruta = os.path.join(directorio, nombre) if nombre else directorio
+            if ruta in self.registros:
+                self._marcar((ruta,), instante)
+
+    def _comprobar_pendientes(self, ahora):
+        """Comprueba los archivos tocados cuya ráfaga de eventos ya ha terminado."""
+        if not self.pendientes:
+            return
+        if ahora - self._ultimo_evento < self.coalescencia and ahora - self._primer_pendiente < self.max_espera:
+            return
+        pendientes, self.pendientes = self.pendientes, {}
+        for ruta, instante in pendientes.items():
+            cambio, _ = comprobar_registro(self.registros[ruta], self.creada_ns)
+            anterior = self.avisados.get(ruta)
+            if cambio is None:
+                if anterior is None:
+                    continue
+                del self.avisados[ruta]
+                cambio = {"ruta": ruta, "tipo": "restaurado"}
+            elif cambio == anterior:
+                continue
+            else:
+                self.avisados[ruta] = cambio
+            if self.al_cambio:
+                self.al_cambio({**cambio, "latencia_ms": (time.monotonic() - instante) * 1000})
+
+    def ejecutar(self):
+        """Bucle de eventos; termina al llamar a ``detener`` (desde otro hilo o señal)."""
+        try:
+            while True:
+                if self.pendientes:
+                    espera = self.coalescencia
+                elif self.sin_vigilar:
+                    espera = REINTENTO_S
+                else:
+                    espera = None
+                for clave, _ in self._selector.select(espera):
+                    if clave.fileobj == self._detener_r:
+                        return
+                    self._procesar_eventos()
+                    self._ultimo_evento = time.monotonic()
+                ahora = time.monotonic()
+                if self.sin_vigilar and ahora - self._ultimo_reintento >= REINTENTO_S:
+                    self._reintentar_vigilancias()
+                self._comprobar_pendientes(ahora)
+        finally:
+            self.cerrar()
+
+    def detener(self):
+        try:
+            os.write(self._detener_w, b"x")
+        except OSError:
+            pass
+
+    def cerrar(self):
+        if self.inotify.fd < 0:
+            return
+        self._selector.close()
+        self.inotify.cerrar()
+        os.close(self._detener_r)
+        os.close(self._detener_w)